@@ -9,11 +9,14 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, field_validator
 
 from app.core.database import require_user_duckdb, get_audit_db
-from app.core.security import get_current_user
+from app.core.security import get_current_user, require_admin
 from app.nl2sql.pipeline import NL2SQLPipeline
 from app.nl2sql.intent_classifier import classify_intent, generate_chitchat_response, OFF_TOPIC_RESPONSE
-from app.nl2sql.prompt_builder import build_nl2sql_prompt
-from app.nl2sql.llm_client import call_local_llm, stream_local_llm
+from app.nl2sql.answer_cache import cache_metrics, get_answer, store_answer
+from app.nl2sql.example_store import record_example
+from app.nl2sql.fast_path import fast_path_metrics
+from app.nl2sql.llm_client import call_local_llm, llm_metrics, stream_local_llm
+from app.nl2sql.scheduler import LLMBusyError, check_admission, scheduler_metrics
 from app.nl2sql.sql_validator import validate_and_fix_sql
 
 router = APIRouter()
@@ -54,7 +57,10 @@ def _sse(data: dict) -> str:
 
 
 def _log_audit(username: str, session_id: str, question: str, sql: str | None, summary: str, status: str):
-    """Write one row to the audit log."""
+    """
+    Write one row to the audit log; successful queries also become few-shot
+    examples. Blocking — call it through ``asyncio.to_thread``.
+    """
     conn = get_audit_db()
     conn.execute(
         "INSERT INTO audit_logs (user_id, username, session_id, natural_query, generated_sql, result_summary, status) "
@@ -63,43 +69,13 @@ def _log_audit(username: str, session_id: str, question: str, sql: str | None, s
     )
     conn.commit()
     conn.close()
+    if sql and status not in ("error", "chat", "off_topic"):
+        record_example(question, sql, username)
 
 
-async def _iter_llm_tokens(prompt: str):
-    """
-    Async generator that bridges the sync stream_local_llm() into async.
-    Yields str tokens one-by-one, then a final ("__done__", full_text) tuple.
-    Raises RuntimeError on LLM errors.
-    """
-    import threading
-
-    loop = asyncio.get_running_loop()
-    queue: asyncio.Queue = asyncio.Queue()
-
-    def _run():
-        try:
-            for item in stream_local_llm(prompt):
-                asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
-        except Exception as exc:
-            asyncio.run_coroutine_threadsafe(
-                queue.put(("__error__", str(exc))), loop
-            ).result()
-
-    thread = threading.Thread(target=_run, daemon=True)
-    thread.start()
-
-    while True:
-        item = await queue.get()
-        if isinstance(item, tuple):
-            if item[0] == "__error__":
-                thread.join(timeout=5)
-                raise RuntimeError(item[1])
-            # ("__done__", full_text) sentinel — yield it so caller can read full text
-            yield item
-            break
-        yield item  # regular token str
-
-    thread.join(timeout=5)
+def _busy_response(e: LLMBusyError) -> HTTPException:
+    """429/503 with Retry-After for a full LLM queue."""
+    return HTTPException(e.status_code, str(e), headers={"Retry-After": str(e.retry_after)})
 
 
 def _clean_records(df) -> list[dict]:
@@ -118,6 +94,12 @@ async def ask_question(
     current_user: Annotated[dict, Depends(get_current_user)],
 ):
     """Ask a natural language question about your uploaded data."""
+    username = current_user.get("sub", "unknown")
+    try:
+        check_admission(username)
+    except LLMBusyError as e:
+        raise _busy_response(e)
+
     try:
         conn = require_user_duckdb(req.session_id)
     except FileNotFoundError:
@@ -125,14 +107,18 @@ async def ask_question(
 
     try:
         history = conversation_store.setdefault(req.session_id, [])
-        pipeline = NL2SQLPipeline(db_conn=conn, conversation_history=history)
-        result = pipeline.run(req.question)
+        pipeline = NL2SQLPipeline(db_conn=conn, conversation_history=history, session_id=req.session_id, username=username)
+        result = await pipeline.run(req.question)
         conversation_store[req.session_id] = pipeline.history
+    except LLMBusyError as e:
+        raise _busy_response(e)
     finally:
         conn.close()
 
-    username = current_user.get("sub", "unknown")
-    _log_audit(username, req.session_id, req.question, result.get("sql"), result.get("summary", ""), result.get("type", "success"))
+    await asyncio.to_thread(
+        _log_audit, username, req.session_id, req.question,
+        result.get("sql"), result.get("summary", ""), result.get("type", "success"),
+    )
     return result
 
 
@@ -149,6 +135,11 @@ async def ask_question_stream(
     """
 
     username = current_user.get("sub", "unknown")
+    # Refuse up front (with a real status code) when the LLM queue is full
+    try:
+        check_admission(username)
+    except LLMBusyError as e:
+        raise _busy_response(e)
 
     async def generate():
         conn = None
@@ -163,7 +154,11 @@ async def ask_question_stream(
 
             # ── Stage 1: Classify intent ──────────────────────────────────────
             yield _sse({"stage": "classifying", "message": "Analyzing your question..."})
-            intent = await asyncio.to_thread(classify_intent, req.question)
+            try:
+                intent = await classify_intent(req.question, username)
+            except LLMBusyError as e:
+                yield _sse({"stage": "done", "result": {"type": "error", "message": str(e), "sql": None}})
+                return
 
             if intent == "chitchat":
                 response_text = generate_chitchat_response(req.question)
@@ -171,57 +166,76 @@ async def ask_question_stream(
                 history.append({"role": "assistant", "content": response_text})
                 conversation_store[req.session_id] = history
                 result = {"type": "chat", "data": [], "columns": [], "sql": None, "row_count": 0, "summary": response_text}
-                _log_audit(username, req.session_id, req.question, None, response_text, "chat")
+                await asyncio.to_thread(_log_audit, username, req.session_id, req.question, None, response_text, "chat")
                 yield _sse({"stage": "done", "result": result})
                 return
 
             if intent == "off_topic":
                 result = {"type": "chat", "data": [], "columns": [], "sql": None, "row_count": 0, "summary": OFF_TOPIC_RESPONSE}
-                _log_audit(username, req.session_id, req.question, None, OFF_TOPIC_RESPONSE, "off_topic")
+                await asyncio.to_thread(_log_audit, username, req.session_id, req.question, None, OFF_TOPIC_RESPONSE, "off_topic")
                 yield _sse({"stage": "done", "result": result})
                 return
 
             # ── Stage 2: Load schema ──────────────────────────────────────────
             yield _sse({"stage": "analyzing", "message": "Exploring your data structure..."})
-            pipeline = NL2SQLPipeline(db_conn=conn, conversation_history=history)
-            schema_info = await asyncio.to_thread(pipeline.get_schema_info)
-            prompt = build_nl2sql_prompt(question=req.question, schema=schema_info, history=history)
+            pipeline = NL2SQLPipeline(db_conn=conn, conversation_history=history, session_id=req.session_id, username=username)
 
-            # ── Stage 3: LLM generates SQL — stream tokens live to frontend ──
-            yield _sse({"stage": "generating", "message": "Crafting the SQL query..."})
-            llm_response = ""
-            try:
-                async for item in _iter_llm_tokens(prompt):
-                    if isinstance(item, tuple):
-                        # ("__done__", full_text) sentinel
-                        llm_response = item[1]
-                        break
-                    # Regular token — forward to frontend immediately
-                    yield _sse({"stage": "token", "token": item})
-            except RuntimeError as e:
-                yield _sse({"stage": "done", "result": {"type": "error", "message": str(e), "sql": None}})
-                return
+            # Simple templated question → SQL without the LLM
+            generated_sql = await asyncio.to_thread(pipeline.fast_sql, req.question)
+            cache_key = cached_sql = None
 
-            generated_sql = validate_and_fix_sql(llm_response, conn)
-            if not generated_sql:
-                result = {"type": "error", "message": "Could not generate a valid SQL query. Please rephrase.", "sql": llm_response}
-                yield _sse({"stage": "done", "result": result})
-                return
+            if generated_sql is None:
+                schema_info = await asyncio.to_thread(pipeline.get_schema_info, req.question)
+
+                # Same question on the same schema answered before → skip the LLM
+                cache_key = await asyncio.to_thread(pipeline.cache_key, req.question, schema_info)
+                cached_sql = get_answer(cache_key) if cache_key else None
+                generated_sql = cached_sql
+
+            if generated_sql is None:
+                prompt = await asyncio.to_thread(pipeline.build_prompt, req.question, schema_info)
+
+                # ── Stage 3: LLM generates SQL — stream tokens to frontend ──
+                yield _sse({"stage": "generating", "message": "Crafting the SQL query..."})
+                llm_response = ""
+                try:
+                    async for item in stream_local_llm(prompt, username, sql=True):
+                        if isinstance(item, tuple) and item[0] == "__queue__":
+                            # Waiting for an LLM slot — tell the user where they are
+                            yield _sse({"stage": "queued", "position": item[1],
+                                        "message": f"Waiting for the assistant — position {item[1]} in line..."})
+                            continue
+                        if isinstance(item, tuple):
+                            # ("__done__", full_text) sentinel
+                            llm_response = item[1]
+                            break
+                        # Regular token — forward to frontend immediately
+                        yield _sse({"stage": "token", "token": item})
+                except RuntimeError as e:
+                    yield _sse({"stage": "done", "result": {"type": "error", "message": str(e), "sql": None}})
+                    return
+
+                generated_sql = validate_and_fix_sql(llm_response, conn)
+                if not generated_sql:
+                    result = {"type": "error", "message": "Could not generate a valid SQL query. Please rephrase.", "sql": llm_response}
+                    yield _sse({"stage": "done", "result": result})
+                    return
 
             # ── Stage 4: Execute on DuckDB ────────────────────────────────────
             yield _sse({"stage": "executing", "message": "Running the query on your data..."})
             try:
                 result_df = conn.execute(generated_sql).fetchdf()
             except Exception as e:
-                # Self-healing retry
+                # Self-healing retry — with the full schema, not the linked subset
                 yield _sse({"stage": "healing", "message": "Fine-tuning the query..."})
+                full_schema = await asyncio.to_thread(pipeline.get_schema_info)
                 retry_prompt = (
                     f"The following SQL failed:\n{generated_sql}\n\n"
-                    f"Error: {str(e)}\n\nSchema:\n{schema_info}\n\n"
+                    f"Error: {str(e)}\n\nSchema:\n{full_schema}\n\n"
                     f"Fix the SQL. Return ONLY the corrected SQL."
                 )
                 try:
-                    retry_response = await asyncio.to_thread(call_local_llm, retry_prompt)
+                    retry_response = await call_local_llm(retry_prompt, username, sql=True)
                 except RuntimeError as retry_err:
                     yield _sse({"stage": "done", "result": {"type": "error", "message": str(retry_err), "sql": None}})
                     return
@@ -236,6 +250,9 @@ async def ask_question_stream(
                     yield _sse({"stage": "done", "result": {"type": "error", "message": str(e2), "sql": generated_sql}})
                     return
 
+            if cache_key and generated_sql != cached_sql:
+                store_answer(cache_key, generated_sql)
+
             # ── Format and return result ──────────────────────────────────────
             history.append({"role": "user", "content": req.question})
             history.append({"role": "assistant", "content": generated_sql})
@@ -250,7 +267,9 @@ async def ask_question_stream(
                 "row_count": len(result_df),
                 "summary": pipeline._generate_summary(req.question, result_df),
             }
-            _log_audit(username, req.session_id, req.question, generated_sql, result.get("summary", ""), response_type)
+            await asyncio.to_thread(
+                _log_audit, username, req.session_id, req.question, generated_sql, result.get("summary", ""), response_type,
+            )
             yield _sse({"stage": "done", "result": result})
 
         finally:
@@ -262,3 +281,23 @@ async def ask_question_stream(
         media_type="text/event-stream",
         headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+
+
+# ── Metrics (admin only) ──────────────────────────────────────────────────────
+@router.get("/metrics")
+def query_metrics(
+    _admin: Annotated[dict, Depends(require_admin)] = None,
+):
+    """
+    Counters since startup: questions answered by the fast path without
+    the LLM; answer-cache hits, misses, evictions and size;
+    LLM generations and requests coalesced into one already in flight,
+    with the health and load of each Ollama backend;
+    admission scheduler slots in use, queue length and rejections.
+    """
+    return {
+        "fast_path": fast_path_metrics(),
+        "answer_cache": cache_metrics(),
+        "llm": llm_metrics(),
+        "scheduler": scheduler_metrics(),
+    }
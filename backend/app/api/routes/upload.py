@@ -1,19 +1,38 @@
+import asyncio
+import json
 import re
 import uuid
-import shutil
+from functools import partial
 from pathlib import Path
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from app.core.config import settings
-from app.core.database import get_user_duckdb
+from app.core.database import get_anomaly_report, get_column_profile
 from app.core.security import get_current_user
-from app.ingestion.file_parser import parse_file, load_dataframe_to_duckdb
-from app.services.anomaly_detector import detect_anomalies
+from app.ingestion.streaming import (
+    UploadError,
+    receive_upload,
+    receive_uploads,
+    run_in_ingest_pool,
+    submit_to_ingest_pool,
+)
+from app.services.ingest_jobs import FINISHED, create_job, get_job, run_ingest_job, update_job
+from app.services.ingest_service import (
+    append_upload,
+    process_batch_upload,
+    process_upload,
+    reuse_cached_upload,
+)
 
 router = APIRouter()
 
+_UUID_RE = re.compile(
+    r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"
+)
+
 ALLOWED_EXTENSIONS = {".csv", ".xlsx", ".xls", ".json", ".parquet"}
 
 # Magic-byte signatures for allowed file types
@@ -23,6 +42,38 @@ _MAGIC: dict[bytes, str] = {
     b"\x50\x41\x52\x31": "parquet",    # PAR1
 }
 
+# The body is parsed by receive_upload, so describe it for the OpenAPI docs
+_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                },
+            },
+        },
+    },
+}
+
+
+_BATCH_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+                    "required": ["files"],
+                },
+            },
+        },
+    },
+}
+
 
 def _validate_magic(file_bytes: bytes, ext: str) -> bool:
     """Return True if the file's magic bytes are plausible for the declared extension."""
@@ -37,62 +88,261 @@ def _validate_magic(file_bytes: bytes, ext: str) -> bool:
     return any(header.startswith(sig) for sig in _MAGIC)
 
 
-@router.post("/")
+async def _receive(request: Request, session_id: str, batch: bool = False, stem: str | None = None):
+    """
+    Stream the uploaded file (or, with ``batch``, every ``files`` part) to
+    UPLOAD_DIR as ``<stem or session_id>.<ext>``, validating extension,
+    magic bytes and size.
+    """
+    count = 0
+
+    def make_path(filename: str) -> Path:
+        nonlocal count
+        ext = Path(filename).suffix.lower()
+        if ext not in ALLOWED_EXTENSIONS:
+            raise UploadError(f"Unsupported file type: {ext}")
+        count += 1
+        if batch:
+            return settings.UPLOAD_DIR / f"{session_id}_{count}{ext}"
+        return settings.UPLOAD_DIR / f"{stem or session_id}{ext}"
+
+    def check_header(header: bytes, filename: str):
+        # Content ≠ extension mismatch
+        if not _validate_magic(header, Path(filename).suffix.lower()):
+            raise UploadError("File content does not match the declared extension")
+
+    try:
+        if batch:
+            return await receive_uploads(request, "files", make_path, check_header, settings.MAX_BATCH_FILES)
+        return await receive_upload(request, "file", make_path, check_header)
+    except UploadError as e:
+        raise HTTPException(e.status_code, str(e))
+
+
+def _sse(data: dict) -> str:
+    """Format a dict as a Server-Sent Event line."""
+    return f"data: {json.dumps(data)}\n\n"
+
+
+def _public_job(job: dict) -> dict:
+    return {k: v for k, v in job.items() if k not in ("owner", "revision")}
+
+
+def _get_owned_job(job_id: str, user: dict) -> dict:
+    job = get_job(job_id)
+    if job is None or (job["owner"] != user.get("sub") and user.get("role") != "admin"):
+        raise HTTPException(404, "Upload job not found")
+    return job
+
+
+@router.post("/", openapi_extra=_UPLOAD_BODY)
 async def upload_file(
-    file: UploadFile = File(...),
+    request: Request,
+    background: bool = False,
     _user: Annotated[dict, Depends(get_current_user)] = None,
 ):
-    """Upload a data file and load it into a private DuckDB instance."""
-    ext = Path(file.filename).suffix.lower()
-    if ext not in ALLOWED_EXTENSIONS:
-        raise HTTPException(400, f"Unsupported file type: {ext}")
-
-    # Read first 512 bytes to validate magic bytes (content ≠ extension mismatch)
-    header = await file.read(512)
-    await file.seek(0)
-    if not _validate_magic(header, ext):
-        raise HTTPException(400, "File content does not match the declared extension")
-
-    # Save file to disk
+    """
+    Upload a data file and load it into a private DuckDB instance.
+
+    With ``?background=true`` the response (202) carries a job id as soon as
+    the file is on disk; poll ``/jobs/{job_id}`` or stream ``/jobs/{job_id}/events``.
+    """
     session_id = str(uuid.uuid4())
-    settings.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-    file_path = settings.UPLOAD_DIR / f"{session_id}{ext}"
+    filename, file_path, size, content_hash = await _receive(request, session_id)
+
+    # Identical file already ingested → reference its data instead of reloading
+    cached = await asyncio.to_thread(reuse_cached_upload, content_hash, filename, session_id)
+    if cached is not None:
+        file_path.unlink(missing_ok=True)
+
+    if background:
+        job = create_job(_user.get("sub", "unknown"), filename, session_id, size)
+        if cached is not None:
+            update_job(job["job_id"], stage="done", rows_loaded=cached["rows"], result=cached)
+        else:
+            submit_to_ingest_pool(run_ingest_job, job["job_id"], file_path, filename, session_id, content_hash)
+        return JSONResponse(
+            status_code=202,
+            content={
+                "job_id": job["job_id"],
+                "session_id": session_id,
+                "status_url": f"/api/upload/jobs/{job['job_id']}",
+                "events_url": f"/api/upload/jobs/{job['job_id']}/events",
+            },
+        )
 
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    if cached is not None:
+        return cached
 
-    # Parse and load into DuckDB
+    # Parse and load off the event loop
     try:
-        df = parse_file(file_path)
-        # Build a safe SQL identifier from the filename
-        raw = Path(file.filename).stem.lower()
-        table_name = re.sub(r"[^a-z0-9_]", "_", raw)
-        table_name = re.sub(r"_+", "_", table_name).strip("_")
-        if not table_name or table_name[0].isdigit():
-            table_name = "t_" + (table_name or "data")
-        conn = get_user_duckdb(session_id)
-        try:
-            load_dataframe_to_duckdb(conn, df, table_name)
-        finally:
-            conn.close()
-    except HTTPException:
-        raise
+        return await run_in_ingest_pool(
+            partial(process_upload, content_hash=content_hash), file_path, filename, session_id,
+        )
     except Exception as e:
         raise HTTPException(400, f"Failed to process file: {str(e)}")
 
-    # Run anomaly detection on the uploaded data
-    anomalies = detect_anomalies(df, table_name)
-
-    # Get schema info
-    columns = list(df.columns)
-    dtypes = {col: str(dtype) for col, dtype in df.dtypes.items()}
-
-    return {
-        "session_id": session_id,
-        "table_name": table_name,
-        "rows": len(df),
-        "columns": columns,
-        "dtypes": dtypes,
-        "anomalies": anomalies,
-        "message": f"Loaded {len(df)} rows into table '{table_name}'",
-    }
+
+@router.post("/batch", openapi_extra=_BATCH_BODY)
+async def upload_batch(
+    request: Request,
+    _user: Annotated[dict, Depends(get_current_user)] = None,
+):
+    """
+    Upload several files into one new session — one table per file, and one
+    per sheet for multi-sheet workbooks. Files are loaded in parallel.
+    """
+    session_id = str(uuid.uuid4())
+    received = await _receive(request, session_id, batch=True)
+
+    files = [(file_path, filename) for filename, file_path, _size, _hash in received]
+    try:
+        return await run_in_ingest_pool(process_batch_upload, files, session_id)
+    except Exception as e:
+        raise HTTPException(400, f"Failed to process files: {str(e)}")
+
+
+@router.post("/append", openapi_extra=_UPLOAD_BODY)
+async def append_file(
+    request: Request,
+    session_id: str,
+    table_name: str,
+    _user: Annotated[dict, Depends(get_current_user)] = None,
+):
+    """
+    Append a file's rows to an existing table of a session instead of
+    uploading everything again. Columns must match the stored table.
+    """
+    session_id = session_id.lower()
+    if not _UUID_RE.match(session_id):
+        raise HTTPException(422, "Invalid session_id format")
+
+    stem = f"{session_id}_append_{uuid.uuid4().hex[:8]}"
+    filename, file_path, _size, _hash = await _receive(request, session_id, stem=stem)
+
+    try:
+        return await run_in_ingest_pool(append_upload, file_path, filename, session_id, table_name)
+    except FileNotFoundError:
+        raise HTTPException(404, "Session not found. Please upload data first.")
+    except LookupError as e:
+        raise HTTPException(404, str(e))
+    except Exception as e:
+        raise HTTPException(400, f"Failed to append file: {str(e)}")
+
+
+@router.get("/jobs/{job_id}")
+def get_upload_job(
+    job_id: str,
+    _user: Annotated[dict, Depends(get_current_user)] = None,
+):
+    """Current stage, bytes read, rows loaded and (when done) the upload result."""
+    return _public_job(_get_owned_job(job_id, _user))
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_upload_job(
+    job_id: str,
+    _user: Annotated[dict, Depends(get_current_user)] = None,
+):
+    """SSE stream of job progress — one event per change, ending at done/error."""
+    _get_owned_job(job_id, _user)
+
+    async def generate():
+        revision = -1
+        while True:
+            job = get_job(job_id)
+            if job is None:
+                yield _sse({"stage": "error", "error": "Upload job expired"})
+                return
+            if job["revision"] != revision:
+                revision = job["revision"]
+                yield _sse(_public_job(job))
+            if job["stage"] in FINISHED:
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ── Anomaly reports ───────────────────────────────────────────────────────────
+
+def _get_anomaly_report(session_id: str, table_name: str, version: int | None) -> dict:
+    session_id = session_id.lower()
+    if not _UUID_RE.match(session_id):
+        raise HTTPException(422, "Invalid session_id format")
+    report = get_anomaly_report(session_id, table_name, version)
+    if report is None:
+        raise HTTPException(404, "No anomaly report for this table")
+    return report
+
+
+@router.get("/anomalies")
+def get_anomalies(
+    session_id: str,
+    table_name: str,
+    version: int | None = None,
+    _user: Annotated[dict, Depends(get_current_user)] = None,
+):
+    """
+    Anomaly report of a table version (latest if omitted). ``status`` is
+    ``pending`` until detection — queued after the load — has finished.
+    """
+    return _get_anomaly_report(session_id, table_name, version)
+
+
+@router.get("/anomalies/events")
+async def stream_anomalies(
+    session_id: str,
+    table_name: str,
+    version: int | None = None,
+    _user: Annotated[dict, Depends(get_current_user)] = None,
+):
+    """SSE stream that sends the anomaly report once it is ready (done/error)."""
+    session_id = session_id.lower()
+    report = _get_anomaly_report(session_id, table_name, version)
+    version = report["version"]
+
+    async def generate():
+        current = report
+        yield _sse(current)
+        while current["status"] == "pending":
+            await asyncio.sleep(0.5)
+            current = get_anomaly_report(session_id, table_name, version)
+            if current is None:
+                yield _sse({"status": "error", "error": "Anomaly report expired"})
+                return
+            if current["status"] != "pending":
+                yield _sse(current)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ── Column profiles ───────────────────────────────────────────────────────────
+
+@router.get("/profile")
+def get_profile(
+    session_id: str,
+    table_name: str,
+    version: int | None = None,
+    _user: Annotated[dict, Depends(get_current_user)] = None,
+):
+    """
+    Column profile of a table version (latest if omitted): per column its
+    type, null count, min/max, approximate distinct count, top values and
+    semantic role. Computed when the table is loaded or appended to.
+    """
+    session_id = session_id.lower()
+    if not _UUID_RE.match(session_id):
+        raise HTTPException(422, "Invalid session_id format")
+    profile = get_column_profile(session_id, table_name, version)
+    if profile is None:
+        raise HTTPException(404, "No column profile for this table")
+    return profile
@@ -21,15 +21,102 @@ class Settings(BaseSettings):
 
     # Local LLM settings (Ollama)
     OLLAMA_BASE_URL: str = "http://localhost:11434"
+    # Several Ollama servers, comma-separated (overrides OLLAMA_BASE_URL):
+    # requests go to the least-loaded healthy one, and each is health-checked
+    # every OLLAMA_HEALTH_INTERVAL_SECONDS
+    OLLAMA_BASE_URLS: str = ""
+    OLLAMA_HEALTH_INTERVAL_SECONDS: float = 15.0
+    # Warm-up: the model is loaded on every backend at startup and re-pinned
+    # every LLM_WARM_INTERVAL_MINUTES (keep below OLLAMA_KEEP_ALIVE) between
+    # these local hours (end exclusive); a load may take LLM_WARMUP_TIMEOUT s
+    LLM_WARMUP_ENABLED: bool = True
+    LLM_WARM_HOURS_START: int = 7
+    LLM_WARM_HOURS_END: int = 20
+    LLM_WARM_INTERVAL_MINUTES: int = 10
+    LLM_WARMUP_TIMEOUT: float = 300.0
     LLM_MODEL: str = "llama3.2:3b"
+    # How long Ollama keeps the model (and its prompt cache) loaded after a
+    # request or warm-up ("-1" pins it for good), and the context window —
+    # large enough for instructions + schema + question (Ollama's default
+    # would truncate the prompt)
+    OLLAMA_KEEP_ALIVE: str = "30m"
+    LLM_NUM_CTX: int = 8192
+    # Sent as Ollama stop sequences with SQL generation requests — small
+    # models like to explain the query after writing it
+    LLM_STOP_SEQUENCES: list[str] = ["\n\nExplanation", "\n\nThis query", "\n\nNote:"]
+    # Shared HTTP connection pool to Ollama: open connections, seconds to
+    # connect, and seconds to wait for the next bytes of a response
+    OLLAMA_MAX_CONNECTIONS: int = 32
+    OLLAMA_CONNECT_TIMEOUT: float = 5.0
+    OLLAMA_READ_TIMEOUT: float = 60.0
+    # Admission scheduler: generations running at once per healthy backend
+    # (match Ollama's OLLAMA_NUM_PARALLEL), and how many may wait in total / per user
+    # before new questions are refused with 503 / 429
+    LLM_MAX_CONCURRENT: int = 4
+    LLM_QUEUE_MAX: int = 64
+    LLM_QUEUE_MAX_PER_USER: int = 3
 
     # Data paths
     UPLOAD_DIR: Path = Path("data/uploads")
     DATABASE_DIR: Path = Path("data/databases")
+    PARQUET_DIR: Path = Path("data/parquet")
+
+    # Canonical Parquet copy of each uploaded table
+    PARQUET_ENABLED: bool = True
+    PARQUET_COMPRESSION: str = "zstd"
+    PARQUET_ROW_GROUP_SIZE: int = 122880
+    # Serve queries from views over the Parquet files instead of DuckDB tables
+    PARQUET_SERVE_QUERIES: bool = False
+    # Keep the original upload in UPLOAD_DIR once its Parquet copy is written
+    # (off: DuckDB and the Parquet copy already hold the data)
+    KEEP_RAW_UPLOADS: bool = False
 
     # Max upload size in MB
     MAX_UPLOAD_SIZE_MB: int = 500
 
+    # Threads used for parsing/loading uploads off the event loop, and the
+    # lower-priority threads for work deferred past them (anomaly scans)
+    INGEST_WORKERS: int = 2
+    BACKGROUND_WORKERS: int = 1
+    # Batch uploads: worker processes loading files/sheets in parallel, and
+    # the most files accepted in one request
+    BATCH_INGEST_PROCESSES: int = 4
+    MAX_BATCH_FILES: int = 20
+    # Type inference: rows sampled per text column, and the share of values
+    # that must parse for a column to be converted (the rest → NULL, counted
+    # as "nulled" in the inference report); the share is re-checked over all
+    # rows after loading, widening or keeping the column as text if it fails
+    INFER_SAMPLE_ROWS: int = 10000
+    INFER_MIN_CONFIDENCE: float = 0.98
+
+    # Anomaly detection switches to approximate statistics (t-digest
+    # quartiles, row-hash duplicates) above this many rows
+    ANOMALY_APPROX_ROW_THRESHOLD: int = 5_000_000
+
+    # How long finished background upload jobs stay queryable
+    INGEST_JOB_RETENTION_MINUTES: int = 60
+
+    # Sessions whose schema context is kept in memory for NL2SQL prompts
+    SCHEMA_CACHE_SESSIONS: int = 256
+    # Schema linking: approximate token budget for the schema part of the
+    # prompt, and columns with at most this many distinct values get their
+    # value counts profiled (text values are matched against questions)
+    SCHEMA_TOKEN_BUDGET: int = 1500
+    LINK_MAX_DISTINCT_VALUES: int = 50
+    # Few-shot examples per prompt (most similar first), and how many
+    # question/SQL pairs learned from successful queries are kept
+    FEW_SHOT_K: int = 3
+    FEW_SHOT_MAX_LEARNED: int = 2000
+    # Fast path: simple questions ("total revenue by region") answered with
+    # SQL written from the column names, without the LLM, when the match is
+    # at least this sure (1.0 = every column named exactly)
+    FAST_PATH_ENABLED: bool = True
+    FAST_PATH_MIN_CONFIDENCE: float = 0.8
+    # Answer cache: SQL of answered questions reused for repeats, at most
+    # this many entries (least recently used evicted), each for this long
+    ANSWER_CACHE_MAX_ENTRIES: int = 2000
+    ANSWER_CACHE_TTL_SECONDS: int = 24 * 3600
+
     # CORS — comma-separated list of allowed origins, or "*" for LAN access
     ALLOWED_ORIGINS: str = "*"
 
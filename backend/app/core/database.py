@@ -1,3 +1,4 @@
+import json
 import sqlite3
 import duckdb
 from pathlib import Path
@@ -33,6 +34,9 @@ def init_audit_db():
         conn.execute("ALTER TABLE audit_logs ADD COLUMN username TEXT NOT NULL DEFAULT ''")
     if "session_id" not in existing_cols:
         conn.execute("ALTER TABLE audit_logs ADD COLUMN session_id TEXT")
+    # Query logging and per-user export still write/read user_id alongside username
+    if "user_id" not in existing_cols:
+        conn.execute("ALTER TABLE audit_logs ADD COLUMN user_id TEXT")
     # Rename legacy user_id → username by copying data (SQLite can't rename cols in old versions)
     if "user_id" in existing_cols and "username" in existing_cols:
         conn.execute("UPDATE audit_logs SET username = user_id WHERE username = ''")
@@ -52,6 +56,94 @@ def init_audit_db():
         )
     """)
 
+    # Content-addressed upload store: sha256 of the raw file and the table
+    # name derived from its filename → the session that materialised it and
+    # its upload payload. A cache from before table names were part of the
+    # key is dropped — it only saves re-ingesting.
+    cache_cols = {row[1] for row in conn.execute("PRAGMA table_info(upload_cache)").fetchall()}
+    if cache_cols and "table_name" not in cache_cols:
+        conn.execute("DROP TABLE upload_cache")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS upload_cache (
+            content_hash TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (content_hash, table_name)
+        )
+    """)
+
+    # Sessions created from a cache hit read another session's DuckDB file
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS session_links (
+            session_id TEXT PRIMARY KEY,
+            target_session_id TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Version counter per loaded table — bumped on every upload/append so
+    # derived metadata (caches, reports) can tell when data changed
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            session_id TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (session_id, table_name)
+        )
+    """)
+
+    # Anomaly reports, computed after a load and kept per table version.
+    # scope is 'table' for uploads and 'appended_rows' for appends.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS anomaly_reports (
+            session_id TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            scope TEXT NOT NULL DEFAULT 'table',
+            anomalies TEXT,
+            error TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (session_id, table_name, version)
+        )
+    """)
+
+    # Column profiles (see ingestion/profiler.py), one per table version
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS column_profiles (
+            session_id TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            profile TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (session_id, table_name, version)
+        )
+    """)
+
+    # Few-shot example store: built-in seeds (owner '') plus question/SQL
+    # pairs of each user's successful queries, offered only to that user.
+    # tables lists the tables the SQL reads. A store from before owners
+    # existed is dropped — startup rebuilds it from the audit log.
+    example_cols = {row[1] for row in conn.execute("PRAGMA table_info(sql_examples)").fetchall()}
+    if example_cols and "owner" not in example_cols:
+        conn.execute("DROP TABLE sql_examples")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sql_examples (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            owner TEXT NOT NULL DEFAULT '',
+            question TEXT NOT NULL,
+            sql TEXT NOT NULL,
+            tables TEXT NOT NULL DEFAULT '',
+            source TEXT NOT NULL DEFAULT 'audit',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (owner, question)
+        )
+    """)
+
     conn.commit()
 
     # Seed default users only if the table is empty
@@ -131,8 +223,325 @@ def record_successful_login(username: str):
     conn.close()
 
 
+# ── Upload cache helpers ──────────────────────────────────────────────────────
+
+def get_cached_upload(content_hash: str, table_name: str) -> tuple[str, dict] | None:
+    """Return (session_id, payload) previously stored for this file hash and table name."""
+    conn = get_audit_db()
+    row = conn.execute(
+        "SELECT session_id, payload FROM upload_cache WHERE content_hash = ? AND table_name = ?",
+        (content_hash, table_name),
+    ).fetchone()
+    conn.close()
+    if not row:
+        return None
+    return row[0], json.loads(row[1])
+
+
+def store_cached_upload(content_hash: str, table_name: str, session_id: str, payload: dict):
+    conn = get_audit_db()
+    conn.execute(
+        "INSERT OR REPLACE INTO upload_cache (content_hash, table_name, session_id, payload) VALUES (?, ?, ?, ?)",
+        (content_hash, table_name, session_id, json.dumps(payload, default=str)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def delete_cached_upload(content_hash: str, table_name: str):
+    conn = get_audit_db()
+    conn.execute("DELETE FROM upload_cache WHERE content_hash = ? AND table_name = ?", (content_hash, table_name))
+    conn.commit()
+    conn.close()
+
+
+def backs_upload_cache(session_id: str) -> bool:
+    """True if an upload-cache entry points at this session's data."""
+    conn = get_audit_db()
+    row = conn.execute(
+        "SELECT 1 FROM upload_cache WHERE session_id = ? LIMIT 1", (session_id,)
+    ).fetchone()
+    conn.close()
+    return row is not None
+
+
+def link_session(session_id: str, target_session_id: str):
+    """Make ``session_id`` read the DuckDB data of ``target_session_id``."""
+    conn = get_audit_db()
+    conn.execute(
+        "INSERT OR REPLACE INTO session_links (session_id, target_session_id) VALUES (?, ?)",
+        (session_id, target_session_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+def sessions_linked_to(target_session_id: str) -> list[str]:
+    conn = get_audit_db()
+    rows = conn.execute(
+        "SELECT session_id FROM session_links WHERE target_session_id = ?",
+        (target_session_id,),
+    ).fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+
+def move_session_references(old_session_id: str, new_session_id: str):
+    """
+    Point links and upload-cache entries at another session's data, and
+    copy the table versions, anomaly reports and column profiles there.
+    """
+    conn = get_audit_db()
+    conn.execute("UPDATE session_links SET target_session_id = ? WHERE target_session_id = ?",
+                 (new_session_id, old_session_id))
+    conn.execute("UPDATE upload_cache SET session_id = ? WHERE session_id = ?",
+                 (new_session_id, old_session_id))
+    conn.execute(
+        "INSERT OR REPLACE INTO table_versions (session_id, table_name, version, row_count) "
+        "SELECT ?, table_name, version, row_count FROM table_versions WHERE session_id = ?",
+        (new_session_id, old_session_id),
+    )
+    _copy_anomaly_reports(conn, old_session_id, new_session_id)
+    _copy_column_profiles(conn, old_session_id, new_session_id)
+    conn.commit()
+    conn.close()
+
+
+def unlink_session(session_id: str):
+    """
+    Drop a session's dedup link, first copying the linked data's table
+    versions, anomaly reports and column profiles to the session.
+    """
+    target = _linked_session(session_id)
+    conn = get_audit_db()
+    if target:
+        conn.execute(
+            "INSERT OR REPLACE INTO table_versions (session_id, table_name, version, row_count) "
+            "SELECT ?, table_name, version, row_count FROM table_versions WHERE session_id = ?",
+            (session_id, target),
+        )
+        _copy_anomaly_reports(conn, target, session_id)
+        _copy_column_profiles(conn, target, session_id)
+    conn.execute("DELETE FROM session_links WHERE session_id = ?", (session_id,))
+    conn.commit()
+    conn.close()
+
+
+def _linked_session(session_id: str) -> str | None:
+    conn = get_audit_db()
+    row = conn.execute(
+        "SELECT target_session_id FROM session_links WHERE session_id = ?",
+        (session_id,),
+    ).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+# ── Table versions ────────────────────────────────────────────────────────────
+
+def bump_table_version(session_id: str, table_name: str, row_count: int) -> int:
+    """Record that a table was (re)loaded or appended to; returns its new version."""
+    conn = get_audit_db()
+    conn.execute(
+        """INSERT INTO table_versions (session_id, table_name, version, row_count)
+           VALUES (?, ?, 1, ?)
+           ON CONFLICT (session_id, table_name) DO UPDATE
+           SET version = version + 1, row_count = excluded.row_count,
+               updated_at = CURRENT_TIMESTAMP""",
+        (session_id, table_name, row_count),
+    )
+    version = conn.execute(
+        "SELECT version FROM table_versions WHERE session_id = ? AND table_name = ?",
+        (session_id, table_name),
+    ).fetchone()[0]
+    conn.commit()
+    conn.close()
+    return version
+
+
+def get_table_versions(session_id: str) -> dict[str, int]:
+    """``{table_name: version}`` for the data a session reads (following dedup links)."""
+    data_session = session_db_path(session_id).stem
+    conn = get_audit_db()
+    rows = conn.execute(
+        "SELECT table_name, version FROM table_versions WHERE session_id = ?",
+        (data_session,),
+    ).fetchall()
+    conn.close()
+    return dict(rows)
+
+
+# ── Anomaly reports ───────────────────────────────────────────────────────────
+
+def _copy_anomaly_reports(conn: sqlite3.Connection, from_session_id: str, to_session_id: str):
+    conn.execute(
+        "INSERT OR REPLACE INTO anomaly_reports "
+        "(session_id, table_name, version, status, scope, anomalies, error, updated_at) "
+        "SELECT ?, table_name, version, status, scope, anomalies, error, updated_at "
+        "FROM anomaly_reports WHERE session_id = ?",
+        (to_session_id, from_session_id),
+    )
+
+
+def save_anomaly_report(
+    session_id: str,
+    table_name: str,
+    version: int,
+    status: str,
+    scope: str = "table",
+    anomalies: list[dict] | None = None,
+    error: str | None = None,
+):
+    """Insert or overwrite the report for one table version (status: pending/done/error)."""
+    conn = get_audit_db()
+    conn.execute(
+        """INSERT OR REPLACE INTO anomaly_reports
+           (session_id, table_name, version, status, scope, anomalies, error, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)""",
+        (session_id, table_name, version, status, scope,
+         json.dumps(anomalies, default=str) if anomalies is not None else None, error),
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_anomaly_report(session_id: str, table_name: str, version: int | None = None) -> dict | None:
+    """
+    The anomaly report for a table of the data a session reads (following
+    dedup links) — the given version, or the latest one.
+    """
+    data_session = session_db_path(session_id).stem
+    conn = get_audit_db()
+    query = (
+        "SELECT table_name, version, status, scope, anomalies, error, updated_at "
+        "FROM anomaly_reports WHERE session_id = ? AND table_name = ?"
+    )
+    params = [data_session, table_name]
+    if version is not None:
+        query += " AND version = ?"
+        params.append(version)
+    row = conn.execute(query + " ORDER BY version DESC LIMIT 1", params).fetchone()
+    conn.close()
+    if not row:
+        return None
+    return {
+        "table_name": row[0],
+        "version": row[1],
+        "status": row[2],
+        "scope": row[3],
+        "anomalies": json.loads(row[4]) if row[4] is not None else None,
+        "error": row[5],
+        "updated_at": row[6],
+    }
+
+
+# ── Column profiles ───────────────────────────────────────────────────────────
+
+def _copy_column_profiles(conn: sqlite3.Connection, from_session_id: str, to_session_id: str):
+    conn.execute(
+        "INSERT OR REPLACE INTO column_profiles (session_id, table_name, version, profile, updated_at) "
+        "SELECT ?, table_name, version, profile, updated_at FROM column_profiles WHERE session_id = ?",
+        (to_session_id, from_session_id),
+    )
+
+
+def save_column_profile(session_id: str, table_name: str, version: int, profile: dict):
+    """Store the profile of one table version, dropping those of older versions."""
+    conn = get_audit_db()
+    conn.execute(
+        """INSERT OR REPLACE INTO column_profiles (session_id, table_name, version, profile, updated_at)
+           VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)""",
+        (session_id, table_name, version, json.dumps(profile, default=str)),
+    )
+    conn.execute(
+        "DELETE FROM column_profiles WHERE session_id = ? AND table_name = ? AND version < ?",
+        (session_id, table_name, version),
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_column_profile(session_id: str, table_name: str, version: int | None = None) -> dict | None:
+    """
+    The column profile of a table of the data a session reads (following
+    dedup links) — the given version, or the latest one.
+    """
+    data_session = session_db_path(session_id).stem
+    conn = get_audit_db()
+    query = "SELECT version, profile, updated_at FROM column_profiles WHERE session_id = ? AND table_name = ?"
+    params = [data_session, table_name]
+    if version is not None:
+        query += " AND version = ?"
+        params.append(version)
+    row = conn.execute(query + " ORDER BY version DESC LIMIT 1", params).fetchone()
+    conn.close()
+    if not row:
+        return None
+    return {**json.loads(row[1]), "version": row[0], "updated_at": row[2]}
+
+
+# ── Few-shot example store ────────────────────────────────────────────────────
+
+def add_sql_examples(examples: list[tuple[str, str, str, str]], source: str = "audit") -> int:
+    """
+    Store (owner, question, sql, tables) examples, skipping questions the
+    owner already has; returns how many were new.
+    """
+    conn = get_audit_db()
+    before = conn.total_changes
+    conn.executemany(
+        "INSERT OR IGNORE INTO sql_examples (owner, question, sql, tables, source) VALUES (?, ?, ?, ?, ?)",
+        [(owner, q, sql, tables, source) for owner, q, sql, tables in examples],
+    )
+    added = conn.total_changes - before
+    conn.commit()
+    conn.close()
+    return added
+
+
+def get_sql_examples() -> list[tuple[str, str, str, str, str]]:
+    """All stored examples as (owner, question, sql, tables, source), oldest first."""
+    conn = get_audit_db()
+    rows = conn.execute("SELECT owner, question, sql, tables, source FROM sql_examples ORDER BY id").fetchall()
+    conn.close()
+    return rows
+
+
+def trim_sql_examples(max_learned: int):
+    """Keep only the newest ``max_learned`` examples learned from queries (seeds stay)."""
+    conn = get_audit_db()
+    conn.execute(
+        "DELETE FROM sql_examples WHERE source = 'audit' AND id NOT IN "
+        "(SELECT id FROM sql_examples WHERE source = 'audit' ORDER BY id DESC LIMIT ?)",
+        (max_learned,),
+    )
+    conn.commit()
+    conn.close()
+
+
+def successful_audit_queries() -> list[tuple[str, str, str]]:
+    """(username, question, SQL) of audit-log entries whose SQL ran and returned a result."""
+    conn = get_audit_db()
+    rows = conn.execute(
+        "SELECT username, natural_query, generated_sql FROM audit_logs "
+        "WHERE generated_sql != '' AND status NOT IN ('error', 'chat', 'off_topic') ORDER BY id"
+    ).fetchall()
+    conn.close()
+    return rows
+
+
 # ── DuckDB (per-session data) ─────────────────────────────────────────────────
 
+def session_db_path(session_id: str) -> Path:
+    """Path of the DuckDB file holding a session's data, following dedup links."""
+    db_path = settings.DATABASE_DIR / f"{session_id}.duckdb"
+    if not db_path.exists():
+        target = _linked_session(session_id)
+        if target:
+            return settings.DATABASE_DIR / f"{target}.duckdb"
+    return db_path
+
+
 def get_user_duckdb(session_id: str):
     """Create or connect to a user's DuckDB instance (used during upload)."""
     settings.DATABASE_DIR.mkdir(parents=True, exist_ok=True)
@@ -142,7 +551,7 @@ def get_user_duckdb(session_id: str):
 
 def require_user_duckdb(session_id: str):
     """Connect to an existing user DuckDB — raises 404-friendly error if session missing."""
-    db_path = settings.DATABASE_DIR / f"{session_id}.duckdb"
+    db_path = session_db_path(session_id)
     if not db_path.exists():
         raise FileNotFoundError(f"Session '{session_id}' not found. Please upload data first.")
     return duckdb.connect(str(db_path))
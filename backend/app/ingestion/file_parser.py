@@ -1,17 +1,26 @@
+import duckdb
 import pandas as pd
 from pathlib import Path
 
-from app.ingestion.schema_detector import detect_and_clean_schema
+from app.ingestion.schema_detector import build_clean_projection, detect_and_clean_schema, quote_ident, settle_types
 
+# Formats DuckDB can scan natively with its parallel readers. Anything else
+# (xls/xlsx) goes through pandas.
+NATIVE_READERS = {
+    ".csv": "read_csv",
+    ".json": "read_json_auto",
+    ".parquet": "read_parquet",
+}
 
-def parse_file(file_path: Path) -> pd.DataFrame:
-    """Parse uploaded file into a clean DataFrame."""
+
+def parse_file(file_path: Path, sheet_name: str | None = None) -> pd.DataFrame:
+    """Parse uploaded file into a clean DataFrame (first sheet unless ``sheet_name``)."""
     suffix = file_path.suffix.lower()
 
     if suffix == ".csv":
         df = pd.read_csv(file_path)
     elif suffix in (".xlsx", ".xls"):
-        df = pd.read_excel(file_path)
+        df = pd.read_excel(file_path, sheet_name=sheet_name or 0)
     elif suffix == ".json":
         df = pd.read_json(file_path)
     elif suffix == ".parquet":
@@ -23,9 +32,75 @@ def parse_file(file_path: Path) -> pd.DataFrame:
     return df
 
 
+def list_sheets(file_path: Path) -> list[str | None]:
+    """Sheet names of an Excel workbook; ``[None]`` for single-table formats."""
+    if file_path.suffix.lower() not in (".xlsx", ".xls"):
+        return [None]
+    with pd.ExcelFile(file_path) as workbook:
+        return list(workbook.sheet_names)
+
+
 def load_dataframe_to_duckdb(conn, df: pd.DataFrame, table_name: str):
     """Load a cleaned DataFrame into DuckDB as a table."""
     conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
     conn.register("_temp_df", df)
     conn.execute(f'CREATE TABLE "{table_name}" AS SELECT * FROM _temp_df')
     conn.unregister("_temp_df")
+
+
+def native_source(file_path: Path, all_varchar: bool = False) -> str:
+    """
+    FROM-clause expression that scans ``file_path`` with DuckDB's own reader.
+
+    ``all_varchar`` (CSV only) skips the reader's own type sniffing so that
+    ``infer_text_types`` decides every column.
+    """
+    reader = NATIVE_READERS[file_path.suffix.lower()]
+    path = str(file_path).replace("'", "''")
+    options = ", all_varchar = true" if all_varchar else ""
+    return f"{reader}('{path}'{options})"
+
+
+def describe_table(conn, table_name: str) -> dict:
+    """Row count, column names and DuckDB types of a loaded table."""
+    described = conn.execute(f"DESCRIBE {quote_ident(table_name)}").fetchall()
+    rows = conn.execute(f"SELECT COUNT(*) FROM {quote_ident(table_name)}").fetchone()[0]
+    return {
+        "rows": rows,
+        "columns": [row[0] for row in described],
+        "dtypes": {row[0]: row[1] for row in described},
+    }
+
+
+def ingest_file(conn, file_path: Path, table_name: str, sheet_name: str | None = None) -> dict:
+    """
+    Load an uploaded file straight into DuckDB and return ``describe_table``
+    plus the per-column ``inference`` report.
+
+    CSV/JSON/Parquet are read by DuckDB itself, with column renaming and type
+    promotion applied as a SQL projection (then checked by
+    ``settle_types``) — the data never passes through pandas. Excel files fall back to ``parse_file`` + ``load_dataframe_to_duckdb``.
+    """
+    suffix = file_path.suffix.lower()
+
+    if suffix in NATIVE_READERS:
+        source = native_source(file_path)
+        projection, inference = build_clean_projection(conn, source)
+        conn.execute(f"DROP TABLE IF EXISTS {quote_ident(table_name)}")
+        try:
+            conn.execute(f"CREATE TABLE {quote_ident(table_name)} AS SELECT {projection} FROM {source}")
+        except duckdb.ConversionException:
+            if suffix != ".csv":
+                raise
+            # The CSV sniffer typed a column from its sample and a later row
+            # didn't fit — re-read as text and let TRY_CAST absorb bad values
+            source = native_source(file_path, all_varchar=True)
+            projection, inference = build_clean_projection(conn, source)
+            conn.execute(f"CREATE TABLE {quote_ident(table_name)} AS SELECT {projection} FROM {source}")
+        settle_types(conn, table_name, inference)
+    else:
+        df = parse_file(file_path, sheet_name)
+        inference = df.attrs.get("inference", {})
+        load_dataframe_to_duckdb(conn, df, table_name)
+
+    return {**describe_table(conn, table_name), "inference": inference}
@@ -0,0 +1,100 @@
+"""
+parquet_store.py — Canonical compressed Parquet copy of every loaded table.
+
+Each table lives in ``PARQUET_DIR/<session_id>/<table_name>/`` as one or more
+``part-NNNNN.parquet`` files (the initial load, then one per append), written
+by DuckDB with PARQUET_COMPRESSION and PARQUET_ROW_GROUP_SIZE and its default
+per-row-group min/max statistics. The initial copy is written in the
+background after the upload returns (see ``ingest_service``). With
+PARQUET_SERVE_QUERIES the DuckDB table is then replaced by a view over those
+files, so the session database holds no second copy of the data.
+"""
+
+import shutil
+from pathlib import Path
+
+from app.core.config import settings
+from app.ingestion.schema_detector import quote_ident
+
+
+def table_dir(session_id: str, table_name: str) -> Path:
+    return (settings.PARQUET_DIR / session_id / table_name).resolve()
+
+
+def _sql_path(path: Path) -> str:
+    return str(path).replace("'", "''")
+
+
+def write_part(conn, session_id: str, table_name: str, select_sql: str) -> Path:
+    """Write the rows of ``select_sql`` as the table's next Parquet part."""
+    directory = table_dir(session_id, table_name)
+    directory.mkdir(parents=True, exist_ok=True)
+    part = directory / f"part-{len(list(directory.glob('part-*.parquet'))):05d}.parquet"
+    conn.execute(
+        f"COPY ({select_sql}) TO '{_sql_path(part)}' "
+        f"(FORMAT PARQUET, COMPRESSION {settings.PARQUET_COMPRESSION}, "
+        f"ROW_GROUP_SIZE {int(settings.PARQUET_ROW_GROUP_SIZE)})"
+    )
+    return part
+
+
+def _create_view(conn, session_id: str, table_name: str):
+    pattern = _sql_path(table_dir(session_id, table_name) / "part-*.parquet")
+    conn.execute(
+        f"CREATE OR REPLACE VIEW {quote_ident(table_name)} AS "
+        f"SELECT * FROM read_parquet('{pattern}', union_by_name = true)"
+    )
+
+
+def is_view(conn, table_name: str) -> bool:
+    row = conn.execute(
+        "SELECT table_type FROM information_schema.tables WHERE table_schema = 'main' AND table_name = ?",
+        [table_name],
+    ).fetchone()
+    return bool(row) and row[0] == "VIEW"
+
+
+def materialize(conn, session_id: str, table_name: str):
+    """
+    Write the canonical Parquet copy of a freshly loaded table and, with
+    PARQUET_SERVE_QUERIES, swap the table for a view over it.
+    """
+    if not settings.PARQUET_ENABLED:
+        return
+    shutil.rmtree(table_dir(session_id, table_name), ignore_errors=True)
+    write_part(conn, session_id, table_name, f"SELECT * FROM {quote_ident(table_name)}")
+    if settings.PARQUET_SERVE_QUERIES:
+        # One transaction, so queries never see the table missing
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            conn.execute(f"DROP TABLE {quote_ident(table_name)}")
+            _create_view(conn, session_id, table_name)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def has_parquet(session_id: str, table_name: str) -> bool:
+    return table_dir(session_id, table_name).is_dir()
+
+
+def clone(conn, source_session_id: str, target_session_id: str):
+    """
+    Copy a session's Parquet files to another session id and repoint the views
+    in ``conn`` (the target session's database) at the copies.
+    """
+    source = (settings.PARQUET_DIR / source_session_id).resolve()
+    if not source.is_dir():
+        return
+    target = (settings.PARQUET_DIR / target_session_id).resolve()
+    shutil.copytree(source, target, dirs_exist_ok=True)
+    for table in (p.name for p in target.iterdir() if p.is_dir()):
+        if is_view(conn, table):
+            _create_view(conn, target_session_id, table)
+
+
+def delete_raw_upload(file_path: Path):
+    """Apply the raw-upload retention setting once conversion has succeeded."""
+    if settings.PARQUET_ENABLED and not settings.KEEP_RAW_UPLOADS:
+        file_path.unlink(missing_ok=True)
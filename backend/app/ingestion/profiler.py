@@ -0,0 +1,170 @@
+"""
+profiler.py — Column profiles of a loaded table.
+
+A profile holds, per column: type, null count, min/max, approximate
+distinct count, the most frequent values of low-cardinality columns and a
+semantic role (date, id, name, category, measure, text). It is computed in
+two DuckDB scans right after a load and stored per table version, so the
+prompt builder, chart advisor and result summary read it instead of
+looking at the data again. After an append only the new rows are
+profiled, and ``merge_profiles`` folds them into the stored profile.
+"""
+
+import datetime
+import decimal
+import re
+from collections import Counter
+
+from app.core.config import settings
+from app.ingestion.schema_detector import quote_ident
+
+_INTEGER_TYPES = {
+    "TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT",
+    "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT", "UHUGEINT",
+}
+_NUMERIC_TYPES = _INTEGER_TYPES | {"FLOAT", "DOUBLE", "REAL"}
+
+_YEAR_NAME_RE = re.compile(r"(^|_)(year|yr|fy)($|_)")
+_ID_NAME_RE = re.compile(r"(^|_)(id|code|key|no|number|sku|uuid)$")
+_NAME_RE = re.compile(
+    r"(^|_)(name|employee|person|customer|client|contact|username|title|label)($|_)"
+)
+
+
+def is_numeric_type(dtype: str) -> bool:
+    return dtype in _NUMERIC_TYPES or dtype.startswith("DECIMAL")
+
+
+def is_temporal_type(dtype: str) -> bool:
+    return dtype == "DATE" or dtype.startswith("TIMESTAMP")
+
+
+def _json_value(value):
+    """DuckDB scalar → JSON-friendly value (dates as ISO strings, decimals as floats)."""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+
+def _role(name: str, dtype: str, column: dict) -> str:
+    if is_temporal_type(dtype):
+        return "date"
+    if dtype in _INTEGER_TYPES and _YEAR_NAME_RE.search(name):
+        low, high = column["min"], column["max"]
+        if low is not None and 1900 <= low and high <= 2100:
+            return "date"
+    if name == "id" or _ID_NAME_RE.search(name):
+        return "id"
+    if is_numeric_type(dtype):
+        return "measure"
+    if column["top_values"]:
+        return "category"
+    if dtype == "VARCHAR" and _NAME_RE.search(name):
+        return "name"
+    return "text"
+
+
+def profile_table(conn, table_name: str, source: str | None = None) -> dict:
+    """
+    Profile every column of ``table_name``. Distinct counts are HyperLogLog
+    estimates; ``top_values`` (value and count, most frequent first) are
+    filled only for columns with at most LINK_MAX_DISTINCT_VALUES values.
+    ``source`` — a FROM expression with the table's columns, such as a
+    batch of appended rows — is scanned instead of the table.
+    """
+    columns = conn.execute(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        "WHERE table_schema = 'main' AND table_name = ? ORDER BY ordinal_position",
+        [table_name],
+    ).fetchall()
+    table = source or quote_ident(table_name)
+
+    # Scan 1: counts, ranges and distinct estimates for all columns at once
+    selects = ["count(*)"]
+    for name, dtype in columns:
+        ref = quote_ident(name)
+        ranged = is_numeric_type(dtype) or is_temporal_type(dtype)
+        selects += [
+            f"count({ref})",
+            f"min({ref})" if ranged else "NULL",
+            f"max({ref})" if ranged else "NULL",
+            f"approx_count_distinct({ref})",
+        ]
+    row = conn.execute(f"SELECT {', '.join(selects)} FROM {table}").fetchone()
+    rows = row[0]
+
+    profiled = []
+    for i, (name, dtype) in enumerate(columns):
+        non_null, low, high, distinct = row[1 + 4 * i: 5 + 4 * i]
+        profiled.append({
+            "name": name,
+            "type": dtype,
+            "nulls": rows - non_null,
+            "min": _json_value(low),
+            "max": _json_value(high),
+            "distinct": min(distinct, non_null),
+            "top_values": [],
+        })
+
+    # Scan 2: value counts of the low-cardinality columns
+    limit = settings.LINK_MAX_DISTINCT_VALUES
+    small = [c for c in profiled if 0 < c["distinct"] <= limit and not is_temporal_type(c["type"])]
+    if small:
+        selects = [f"histogram({quote_ident(c['name'])})" for c in small]
+        histograms = conn.execute(f"SELECT {', '.join(selects)} FROM {table}").fetchone()
+        for column, histogram in zip(small, histograms):
+            counts = sorted((histogram or {}).items(), key=lambda kv: -kv[1])[:limit]
+            column["top_values"] = [{"value": _json_value(v), "count": n} for v, n in counts]
+
+    for column in profiled:
+        column["role"] = _role(column["name"], column["type"], column)
+    return {"table": table_name, "rows": rows, "columns": profiled}
+
+
+def _merged_range(a, b, pick):
+    values = [v for v in (a, b) if v is not None]
+    return pick(values) if values else None
+
+
+def merge_profiles(profile: dict, batch: dict) -> dict | None:
+    """
+    Profile of a table after appending the rows profiled in ``batch``,
+    without scanning the table again. Null counts, ranges and the value
+    counts of low-cardinality columns add up exactly; other distinct
+    counts become upper bounds (the sum, capped at the non-null count).
+    None when the columns differ — profile the whole table then.
+    """
+    def shape(p):
+        return [(c["name"], c["type"]) for c in p["columns"]]
+
+    if shape(profile) != shape(batch):
+        return None
+    limit = settings.LINK_MAX_DISTINCT_VALUES
+    rows = profile["rows"] + batch["rows"]
+    merged = []
+    for old, new in zip(profile["columns"], batch["columns"]):
+        old_count, new_count = profile["rows"] - old["nulls"], batch["rows"] - new["nulls"]
+        column = {
+            "name": old["name"],
+            "type": old["type"],
+            "nulls": old["nulls"] + new["nulls"],
+            "min": _merged_range(old["min"], new["min"], min),
+            "max": _merged_range(old["max"], new["max"], max),
+        }
+        if not old_count or not new_count:
+            kept = new if not old_count else old
+            column.update(distinct=kept["distinct"], top_values=kept["top_values"])
+        elif old["top_values"] and new["top_values"]:
+            counts = Counter()
+            for v in old["top_values"] + new["top_values"]:
+                counts[v["value"]] += v["count"]
+            column["distinct"] = len(counts)
+            top = counts.most_common() if len(counts) <= limit else []
+            column["top_values"] = [{"value": v, "count": n} for v, n in top]
+        else:
+            column.update(distinct=min(old["distinct"] + new["distinct"], old_count + new_count), top_values=[])
+        column["role"] = _role(column["name"], column["type"], column)
+        merged.append(column)
+    return {"table": profile["table"], "rows": rows, "columns": merged}
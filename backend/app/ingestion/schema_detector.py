@@ -1,6 +1,10 @@
 import re
+import time
+
 import pandas as pd
 
+from app.core.config import settings
+
 
 def clean_column_name(col: str) -> str:
     """Normalize messy column names to clean SQL-safe names."""
@@ -29,6 +33,24 @@ COLUMN_ALIASES = {
     "mon": "month",
 }
 
+# Formats tried (in order) when promoting VARCHAR columns to TIMESTAMP in SQL.
+# Month-first before day-first, matching pd.to_datetime(dayfirst=False).
+DATETIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y",
+    "%d/%m/%Y",
+    "%d-%m-%Y",
+    "%Y/%m/%d",
+    "%b %d, %Y",
+    "%b %d %Y",
+    "%d %b %Y",
+    "%B %d, %Y",
+    "%d %B %Y",
+]
+
 
 def expand_abbreviation(col: str) -> str:
     """Expand known abbreviations in column names."""
@@ -37,23 +59,248 @@ def expand_abbreviation(col: str) -> str:
     return "_".join(expanded)
 
 
+def clean_column_names(columns: list) -> list[str]:
+    """Clean and expand every column name, keeping the result unique and non-empty."""
+    seen: dict[str, int] = {}
+    cleaned = []
+    for i, col in enumerate(columns, 1):
+        name = expand_abbreviation(clean_column_name(str(col))) or f"column_{i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        seen.setdefault(name, 1)
+        cleaned.append(name)
+    return cleaned
+
+
+def _pick_type(non_null: int, matches: dict[str, int]) -> tuple[str | None, float]:
+    """
+    Choose a column type from sample match counts.
+
+    Types are tried in order (TIMESTAMP, BIGINT, DOUBLE); the first whose
+    share of parsable non-null sample values reaches INFER_MIN_CONFIDENCE
+    wins. Returns ``(type or None, confidence)``.
+    """
+    best = 0.0
+    for dtype, count in matches.items():
+        confidence = count / non_null
+        if confidence >= settings.INFER_MIN_CONFIDENCE:
+            return dtype, confidence
+        best = max(best, confidence)
+    return None, best
+
+
+def _report(dtype: str, confidence: float, sample_rows: int, start: float) -> dict:
+    return {
+        "type": dtype,
+        "confidence": round(confidence, 3),
+        "sample_rows": sample_rows,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
 def detect_and_clean_schema(df: pd.DataFrame) -> pd.DataFrame:
-    """Clean column names and infer better data types."""
-    # Clean column names
-    df.columns = [expand_abbreviation(clean_column_name(c)) for c in df.columns]
+    """
+    Clean column names and infer better data types.
 
-    # Try to convert object columns to datetime
-    for col in df.select_dtypes(include=["object"]).columns:
-        try:
-            df[col] = pd.to_datetime(df[col], format="mixed", dayfirst=False)
-        except (ValueError, TypeError):
-            pass
+    Each object column's type is decided from its first INFER_SAMPLE_ROWS
+    non-null values, then the whole column is converted once with
+    ``errors="coerce"``. Values that don't parse become NaN/NaT and are
+    counted as ``nulled``, unless there are so many that the column stays
+    text. The per-column report is left in ``df.attrs["inference"]``.
+    """
+    df.columns = clean_column_names(list(df.columns))
 
-    # Try to convert object columns to numeric
+    report = {}
     for col in df.select_dtypes(include=["object"]).columns:
-        try:
-            df[col] = pd.to_numeric(df[col].str.replace(",", ""))
-        except (ValueError, TypeError, AttributeError):
-            pass
+        start = time.perf_counter()
+        sample = df[col].dropna().head(settings.INFER_SAMPLE_ROWS).astype("string")
+        if sample.empty:
+            continue
+
+        as_dt = pd.to_datetime(sample, format="mixed", dayfirst=False, errors="coerce")
+        as_num = pd.to_numeric(sample.str.replace(",", ""), errors="coerce")
+        dtype, confidence = _pick_type(len(sample), {
+            "TIMESTAMP": int(as_dt.notna().sum()),
+            "BIGINT": int((as_num.notna() & (as_num % 1 == 0)).sum()),
+            "DOUBLE": int(as_num.notna().sum()),
+        })
+
+        text = df[col].astype("string")
+        if dtype == "TIMESTAMP":
+            converted = pd.to_datetime(text, format="mixed", dayfirst=False, errors="coerce")
+        elif dtype is not None:
+            converted = pd.to_numeric(text.str.replace(",", ""), errors="coerce")
+        report[col] = _report(dtype or "VARCHAR", confidence, len(sample), start)
+        if dtype is None:
+            continue
+        # Same check as settle_types, over the whole column
+        non_null, parsed = int(text.notna().sum()), int(converted.notna().sum())
+        if parsed < non_null * settings.INFER_MIN_CONFIDENCE:
+            report[col].update(widened_from=dtype, type="VARCHAR", nulled=0)
+            continue
+        df[col] = converted
+        report[col]["nulled"] = non_null - parsed
 
+    df.attrs["inference"] = report
     return df
+
+
+# ── SQL-side cleaning (native DuckDB ingestion) ───────────────────────────────
+
+def quote_ident(name: str) -> str:
+    """Quote a SQL identifier for DuckDB."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _datetime_expr(ref: str, fmt: str | None = None) -> str:
+    if fmt is None:
+        return f"TRY_CAST({ref} AS TIMESTAMP)"
+    return f"COALESCE(TRY_CAST({ref} AS TIMESTAMP), try_strptime({ref}, '{fmt}'))"
+
+
+def _best_datetime_format(conn, ref: str) -> str | None:
+    """
+    Pick the DATETIME_FORMATS entry that parses most of a small subsample.
+
+    try_strptime over a list of formats is ~25x slower than a single format,
+    so only the winner is used for the sample check and the bulk conversion.
+    """
+    checks = ", ".join(f"count(try_strptime({ref}, '{fmt}'))" for fmt in DATETIME_FORMATS)
+    counts = conn.execute(
+        f"SELECT {checks} "
+        f"FROM (SELECT {ref} FROM _infer_sample WHERE {ref} IS NOT NULL LIMIT 200)"
+    ).fetchone()
+    best = max(range(len(counts)), key=lambda i: counts[i])
+    return DATETIME_FORMATS[best] if counts[best] else None
+
+
+def _numeric_expr(ref: str, target: str) -> str:
+    return f"TRY_CAST(replace({ref}, ',', '') AS {target})"
+
+
+def _integer_expr(ref: str) -> str:
+    # TRY_CAST('1.5' AS BIGINT) rounds, so integers are matched textually;
+    # anything else (a decimal past the sample, say) becomes NULL
+    return (
+        f"CASE WHEN regexp_full_match(trim(replace({ref}, ',', '')), '[+-]?[0-9]+') "
+        f"THEN {_numeric_expr(ref, 'BIGINT')} END"
+    )
+
+
+def infer_text_types(conn, source: str, text_cols: list[str]) -> dict[str, dict]:
+    """
+    Decide TIMESTAMP/BIGINT/DOUBLE/VARCHAR for VARCHAR columns of ``source``.
+
+    Only the first INFER_SAMPLE_ROWS rows are read (into a temp table), so the
+    cost is bounded regardless of file size. Returns ``{column: report}`` with
+    the chosen type, confidence, sample size and time spent per column.
+    """
+    if not text_cols:
+        return {}
+
+    cols = ", ".join(quote_ident(c) for c in text_cols)
+    conn.execute(
+        f"CREATE OR REPLACE TEMP TABLE _infer_sample AS "
+        f"SELECT {cols} FROM {source} LIMIT {int(settings.INFER_SAMPLE_ROWS)}"
+    )
+    report = {}
+    try:
+        for col in text_cols:
+            start = time.perf_counter()
+            ref = quote_ident(col)
+            fmt = _best_datetime_format(conn, ref)
+            non_null, as_ts, as_int, as_dbl = conn.execute(
+                f"SELECT count({ref}), count({_datetime_expr(ref, fmt)}), "
+                f"count({_integer_expr(ref)}), "
+                f"count({_numeric_expr(ref, 'DOUBLE')}) FROM _infer_sample"
+            ).fetchone()
+            if non_null == 0:
+                report[col] = _report("VARCHAR", 0.0, 0, start)
+                continue
+            dtype, confidence = _pick_type(non_null, {"TIMESTAMP": as_ts, "BIGINT": as_int, "DOUBLE": as_dbl})
+            report[col] = _report(dtype or "VARCHAR", confidence, non_null, start)
+            if dtype == "TIMESTAMP" and fmt:
+                report[col]["format"] = fmt
+    finally:
+        conn.execute("DROP TABLE IF EXISTS _infer_sample")
+    return report
+
+
+def build_clean_projection(conn, source: str) -> tuple[str, dict[str, dict]]:
+    """
+    Build a SELECT list that renames and re-types the columns of ``source``.
+
+    ``source`` is any FROM-clause expression (e.g. ``read_csv('x.csv')``).
+    Columns are renamed with the same rules as ``detect_and_clean_schema``;
+    VARCHAR columns are typed by ``infer_text_types`` and converted in bulk
+    with TRY_CAST; each one given a type also keeps its text in
+    ``raw_column(name)`` until ``settle_types`` has checked every value.
+    Returns ``(select_list, inference_report)`` with the report keyed by the
+    cleaned column names.
+    """
+    described = conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()
+    originals = [row[0] for row in described]
+    cleaned = clean_column_names(originals)
+
+    text_cols = [row[0] for row in described if row[1] == "VARCHAR"]
+    inferred = infer_text_types(conn, source, text_cols)
+
+    select_list, raw_list, report = [], [], {}
+    for orig, new in zip(originals, cleaned):
+        ref = quote_ident(orig)
+        expr = ref
+        if orig in inferred:
+            dtype = inferred[orig]["type"]
+            if dtype == "TIMESTAMP":
+                expr = _datetime_expr(ref, inferred[orig].get("format"))
+            elif dtype == "BIGINT":
+                expr = _integer_expr(ref)
+            elif dtype == "DOUBLE":
+                expr = _numeric_expr(ref, dtype)
+            if dtype != "VARCHAR":
+                raw_list.append(f"{ref} AS {quote_ident(raw_column(new))}")
+            report[new] = inferred[orig]
+        select_list.append(f"{expr} AS {quote_ident(new)}")
+    return ", ".join(select_list + raw_list), report
+
+
+def raw_column(name: str) -> str:
+    """Column holding the text of typed column ``name`` during a load."""
+    return f"__raw_{name}"
+
+
+def settle_types(conn, table_name: str, report: dict[str, dict]):
+    """
+    Check every value of the columns typed from the sample, once loaded.
+
+    A BIGINT column with decimals past the sample becomes DOUBLE, and a
+    column whose values parse less often than INFER_MIN_CONFIDENCE overall
+    goes back to VARCHAR (both noted as ``widened_from``). What remains
+    unparsable — a stray "N/A" — is NULL and counted as ``nulled`` in the
+    report. Drops the ``raw_column`` copies afterwards.
+    """
+    typed = [c for c, r in report.items() if r["type"] != "VARCHAR"]
+    if not typed:
+        return
+    table = quote_ident(table_name)
+    checks = []
+    for col in typed:
+        raw = quote_ident(raw_column(col))
+        as_double = _numeric_expr(raw, "DOUBLE") if report[col]["type"] == "BIGINT" else "NULL"
+        checks.append(f"count({raw}), count({quote_ident(col)}), count({as_double})")
+    counts = conn.execute(f"SELECT {', '.join(checks)} FROM {table}").fetchone()
+
+    for i, col in enumerate(typed):
+        non_null, parsed, as_double = counts[3 * i:3 * i + 3]
+        entry, raw = report[col], quote_ident(raw_column(col))
+        dtype, expr = entry["type"], None
+        if dtype == "BIGINT" and as_double > parsed and as_double >= non_null * settings.INFER_MIN_CONFIDENCE:
+            dtype, parsed, expr = "DOUBLE", as_double, _numeric_expr(raw, "DOUBLE")
+        if parsed < non_null * settings.INFER_MIN_CONFIDENCE:
+            dtype, parsed, expr = "VARCHAR", non_null, raw
+        if expr:
+            conn.execute(f"ALTER TABLE {table} ALTER {quote_ident(col)} SET DATA TYPE {dtype} USING {expr}")
+            entry.update(widened_from=entry["type"], type=dtype)
+        entry["nulled"] = non_null - parsed
+        conn.execute(f"ALTER TABLE {table} DROP COLUMN {raw}")
@@ -0,0 +1,252 @@
+"""
+streaming.py — Bounded-memory upload receiver and ingest worker pool.
+
+FastAPI's ``UploadFile`` spools the whole multipart body to a temp file before
+the route runs. ``receive_upload`` instead parses the request stream itself and
+writes each file chunk straight to ``UPLOAD_DIR`` off the event loop, enforcing
+``MAX_UPLOAD_SIZE_MB`` as bytes arrive. Parsing/loading then runs on a small
+dedicated thread pool so other requests (SSE streams) stay responsive; work
+deferred past the upload (anomaly scans) has its own lower-priority pool, so
+a burst of it never holds up new uploads.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+from multipart.multipart import MultipartParser, parse_options_header
+
+from app.core.config import settings
+
+# How many bytes of the file are buffered before magic-byte validation.
+HEADER_BYTES = 512
+
+_ingest_pool = ThreadPoolExecutor(
+    max_workers=settings.INGEST_WORKERS,
+    thread_name_prefix="ingest",
+)
+
+
+def _lower_priority():
+    # Linux applies nice values per thread; elsewhere this is a no-op
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+
+_background_pool = ThreadPoolExecutor(
+    max_workers=settings.BACKGROUND_WORKERS,
+    thread_name_prefix="background",
+    initializer=_lower_priority,
+)
+
+
+# Batch uploads stage each file/sheet in its own process (created on first use;
+# "spawn" so workers don't inherit the server's threads)
+_batch_pool: ProcessPoolExecutor | None = None
+
+
+def get_batch_pool() -> ProcessPoolExecutor:
+    global _batch_pool
+    if _batch_pool is None:
+        _batch_pool = ProcessPoolExecutor(
+            max_workers=settings.BATCH_INGEST_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _batch_pool
+
+
+class UploadError(ValueError):
+    """Raised for a rejected upload; ``status_code`` maps to the HTTP response."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def run_in_ingest_pool(fn: Callable, *args):
+    """Run a blocking ingest step on the bounded ingest pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_ingest_pool, fn, *args)
+
+
+def submit_to_ingest_pool(fn: Callable, *args) -> Future:
+    """Start a blocking ingest step on the pool without waiting for it."""
+    return _ingest_pool.submit(fn, *args)
+
+
+def submit_background(fn: Callable, *args) -> Future:
+    """Queue blocking work deferred past an upload on the low-priority pool."""
+    return _background_pool.submit(fn, *args)
+
+
+class _FilePart:
+    """State for one file part being received."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.path: Path | None = None
+        self.handle = None
+        self.size = 0
+        self.header = b""
+        self.pending: list[bytes] = []
+        self.sha256 = hashlib.sha256()
+        self.ended = False
+        self.closed = False
+
+
+async def receive_upload(
+    request,
+    field_name: str,
+    make_path: Callable[[str], Path],
+    check_header: Callable[[bytes, str], None],
+) -> tuple[str, Path, int, str]:
+    """
+    Stream the ``field_name`` file part of a multipart request to disk,
+    hashing it on the way.
+
+    ``make_path(filename)`` returns the destination path (and may reject the
+    name by raising ``UploadError``); ``check_header(first_bytes, filename)``
+    validates the first ``HEADER_BYTES`` before anything is written.
+    Returns ``(filename, path, size_in_bytes, sha256_hex)``.
+    """
+    received = await receive_uploads(request, field_name, make_path, check_header, max_files=1)
+    return received[0]
+
+
+async def receive_uploads(
+    request,
+    field_name: str,
+    make_path: Callable[[str], Path],
+    check_header: Callable[[bytes, str], None],
+    max_files: int,
+) -> list[tuple[str, Path, int, str]]:
+    """
+    Like ``receive_upload`` but for up to ``max_files`` parts named
+    ``field_name``. MAX_UPLOAD_SIZE_MB applies to their combined size.
+    """
+    max_bytes = settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes + 64 * 1024:
+        raise UploadError(f"Upload exceeds the {settings.MAX_UPLOAD_SIZE_MB} MB limit", 413)
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected a multipart/form-data upload")
+
+    parts: list[_FilePart] = []
+    current: _FilePart | None = None
+    current_field = b""
+    current_value = b""
+    headers: dict[bytes, bytes] = {}
+    too_many = False
+
+    def on_part_begin():
+        nonlocal headers, current
+        headers = {}
+        current = None
+
+    def on_header_field(data, start, end):
+        nonlocal current_field
+        current_field += data[start:end]
+
+    def on_header_value(data, start, end):
+        nonlocal current_value
+        current_value += data[start:end]
+
+    def on_header_end():
+        nonlocal current_field, current_value
+        headers[current_field.lower()] = current_value
+        current_field, current_value = b"", b""
+
+    def on_headers_finished():
+        nonlocal current, too_many
+        _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+        if disposition.get(b"name", b"").decode() != field_name or b"filename" not in disposition:
+            return
+        if len(parts) >= max_files:
+            too_many = True
+            return
+        current = _FilePart(disposition[b"filename"].decode("utf-8", errors="replace"))
+        parts.append(current)
+
+    def on_part_data(data, start, end):
+        if current is not None:
+            current.pending.append(data[start:end])
+
+    def on_part_end():
+        if current is not None:
+            current.ended = True
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if too_many:
+                raise UploadError(f"Too many files (max {max_files})")
+            for part in parts:
+                if part.closed:
+                    continue
+                total = sum(p.size for p in parts) + sum(len(b) for b in part.pending)
+                if total > max_bytes:
+                    raise UploadError(f"Upload exceeds the {settings.MAX_UPLOAD_SIZE_MB} MB limit", 413)
+                await _flush(part, make_path, check_header)
+        parser.finalize()
+        if not parts:
+            raise UploadError(f"Missing file field '{field_name}'")
+        for part in parts:
+            part.ended = True
+            await _flush(part, make_path, check_header)
+    except BaseException:
+        for part in parts:
+            if part.handle is not None:
+                if not part.closed:
+                    await asyncio.to_thread(part.handle.close)
+                part.path.unlink(missing_ok=True)
+        raise
+
+    return [(p.filename, p.path, p.size, p.sha256.hexdigest()) for p in parts]
+
+
+async def _flush(part: _FilePart, make_path, check_header):
+    """
+    Write buffered part data to disk, validating the header on first write,
+    and close the file once the part has ended.
+    """
+    data = b"".join(part.pending)
+    part.pending.clear()
+    part.size += len(data)
+    part.sha256.update(data)
+
+    if part.handle is None:
+        part.header += data
+        if len(part.header) < HEADER_BYTES and not part.ended:
+            return
+        part.path = make_path(part.filename)
+        check_header(part.header[:HEADER_BYTES], part.filename)
+        part.path.parent.mkdir(parents=True, exist_ok=True)
+        part.handle = await asyncio.to_thread(open, part.path, "wb")
+        data, part.header = part.header, b""
+
+    if data:
+        await asyncio.to_thread(part.handle.write, data)
+    if part.ended and not part.closed:
+        await asyncio.to_thread(part.handle.close)
+        part.closed = True
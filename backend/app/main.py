@@ -8,6 +8,9 @@ from fastapi.responses import JSONResponse
 from app.api.routes import upload, query, auth, audit, export
 from app.core.config import settings
 from app.core.database import init_audit_db
+from app.nl2sql.example_store import seed_example_store
+from app.nl2sql.llm_client import close_llm_client, start_health_checks
+from app.nl2sql.ollama_pool import model_state
 
 # ── Structured logging ────────────────────────────────────────────────────────
 logging.basicConfig(
@@ -15,6 +18,8 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(name)s — %(message)s",
 )
 logger = logging.getLogger("datawhisper")
+# httpx logs every Ollama request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # ── App ───────────────────────────────────────────────────────────────────────
 app = FastAPI(
@@ -34,6 +39,8 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Sent with 429/503 when the LLM queue is full; the frontend reads it
+    expose_headers=["Retry-After"],
 )
 
 
@@ -79,10 +86,18 @@ app.include_router(export.router, prefix="/api/export", tags=["Export Reports"])
 @app.on_event("startup")
 async def startup():
     init_audit_db()
+    seed_example_store()
+    start_health_checks()
     logger.info("DataWhisper started — model: %s", settings.LLM_MODEL)
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    await close_llm_client()
+
+
 # ── Health check (public) ─────────────────────────────────────────────────────
 @app.get("/health")
 def health_check():
-    return {"status": "running", "model": settings.LLM_MODEL}
+    """``model_loaded`` turns true once a healthy Ollama backend has the model in memory."""
+    return {"status": "running", "model": settings.LLM_MODEL, **model_state()}
@@ -0,0 +1,103 @@
+"""
+answer_cache.py — Reuse the SQL of questions that were already answered.
+
+Entries map (schema fingerprint, normalized question, relevant history)
+to the SQL that answered it and ran successfully, so a repeated question
+skips the LLM; the SQL is still executed, so results are always current.
+The fingerprint covers the schema text sent to the LLM and the versions
+of the session's tables, so a load or append makes older answers
+unreachable; ``invalidate_session`` also drops them right away.
+Entries are evicted least-recently-used beyond ANSWER_CACHE_MAX_ENTRIES
+and expire after ANSWER_CACHE_TTL_SECONDS.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from app.core.config import settings
+from app.core.database import get_table_versions, session_db_path
+
+# Questions that lean on the previous turns ("and by region?", "sort them")
+_FOLLOW_UP_RE = re.compile(
+    r"^(and|or|but|also|now|then|what about|how about|instead)\b"
+    r"|\b(it|its|they|them|those|these|that|previous|above|same|instead)\b"
+)
+
+# key → (data session, SQL, stored at)
+_entries: OrderedDict[str, tuple[str, str, float]] = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0, "invalidated": 0}
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, single-spaced, without trailing punctuation."""
+    return " ".join(question.lower().split()).rstrip(" ?.!")
+
+
+def answer_key(session_id: str, question: str, schema: str, history: list | None = None) -> str:
+    """
+    Cache key of a question. History only counts for follow-ups (as judged
+    by their wording) — a standalone question gets the same SQL whatever
+    was asked before it.
+    """
+    data_session = session_db_path(session_id).stem
+    versions = sorted(get_table_versions(data_session).items())
+    normalized = normalize_question(question)
+    turns = []
+    if history and _FOLLOW_UP_RE.search(normalized):
+        # Same window build_prompt_suffix sends to the LLM
+        turns = [f"{m['role']}: {m['content']}" for m in history[-6:]]
+    raw = "\x1f".join([data_session, repr(versions), schema, normalized, *turns])
+    return data_session + ":" + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get_answer(key: str) -> str | None:
+    """Cached SQL for a key, or None (counted as a miss)."""
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and time.monotonic() - entry[2] > settings.ANSWER_CACHE_TTL_SECONDS:
+            del _entries[key]
+            _stats["expired"] += 1
+            entry = None
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return entry[1]
+
+
+def store_answer(key: str, sql: str):
+    """Remember the SQL that answered a question and ran successfully."""
+    with _lock:
+        _entries[key] = (key.split(":", 1)[0], sql, time.monotonic())
+        _entries.move_to_end(key)
+        _stats["stores"] += 1
+        while len(_entries) > settings.ANSWER_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def invalidate_session(session_id: str):
+    """Drop the answers for a session's data (its tables changed)."""
+    data_session = session_db_path(session_id).stem
+    with _lock:
+        stale = [key for key, entry in _entries.items() if entry[0] == data_session]
+        for key in stale:
+            del _entries[key]
+        _stats["invalidated"] += len(stale)
+
+
+def cache_metrics() -> dict:
+    """Counters since startup plus the current size and hit rate."""
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entries": len(_entries),
+            "max_entries": settings.ANSWER_CACHE_MAX_ENTRIES,
+            "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else None,
+        }
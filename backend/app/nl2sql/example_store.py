@@ -0,0 +1,163 @@
+"""
+example_store.py — Few-shot examples chosen per question.
+
+The store (``sql_examples`` in SQLite) starts with the built-in
+``SEED_EXAMPLES`` and grows with the question/SQL pairs of successful
+queries. Learned pairs carry the literals of their user's data, so they
+are only offered back to that user. An in-memory TF-IDF index over the
+questions returns the ``FEW_SHOT_K`` most similar examples, so a prompt
+carries a few relevant examples instead of all of them. New pairs are
+added to the index as they come; it is rebuilt from SQLite only once they
+make up a tenth of it, to refresh the weights of the older entries.
+"""
+
+import math
+import re
+import threading
+from collections import Counter
+
+import duckdb
+
+from app.core.config import settings
+from app.core.database import (
+    add_sql_examples,
+    get_sql_examples,
+    successful_audit_queries,
+    trim_sql_examples,
+)
+from app.nl2sql.prompt_builder import SEED_EXAMPLES
+
+_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "by", "with", "and", "or",
+    "is", "are", "was", "be", "me", "my", "what", "which", "show", "give", "list",
+    "get", "find", "all", "each", "per", "their", "there", "that", "this", "it",
+}
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_TABLE_RE = re.compile(r"^Table: (.+)$", re.M)
+
+_REFRESH_SHARE = 0.1
+
+_lock = threading.Lock()
+_index: dict = {
+    "stale": True, "examples": [], "features": [], "vectors": [], "df": Counter(), "idf": {},
+    "added": 0,  # examples indexed since the last rebuild
+}
+
+
+def _features(text: str) -> Counter:
+    """Word unigrams and bigrams (plurals folded, stopwords dropped)."""
+    words = []
+    for word in _WORD_RE.findall(text.lower()):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+
+def _idf(n_examples: int, n_with: int) -> float:
+    return math.log((1 + n_examples) / (1 + n_with)) + 1.0
+
+
+def _vector(features: Counter, idf: dict[str, float]) -> dict[str, float]:
+    weights = {f: n * idf.get(f, 0.0) for f, n in features.items()}
+    norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+    return {f: w / norm for f, w in weights.items()}
+
+
+def _tables_in(sql: str) -> str:
+    try:
+        return ",".join(sorted(duckdb.get_table_names(sql)))
+    except duckdb.Error:
+        return ""
+
+
+def _rebuild():
+    examples = get_sql_examples()
+    features = [_features(question) for _owner, question, _sql, _tables, _source in examples]
+    df = Counter(f for feats in features for f in feats)
+    idf = {f: _idf(len(examples), n) for f, n in df.items()}
+    _index.update(
+        stale=False,
+        examples=examples,
+        features=features,
+        vectors=[_vector(feats, idf) for feats in features],
+        df=df,
+        idf=idf,
+        added=0,
+    )
+
+
+def _add(example: tuple[str, str, str, str, str]):
+    """Index one new example (under ``_lock``), dropping the oldest learned one past FEW_SHOT_MAX_LEARNED."""
+    examples, features, vectors, df, idf = (
+        _index["examples"], _index["features"], _index["vectors"], _index["df"], _index["idf"]
+    )
+    feats = _features(example[1])
+    df.update(feats.keys())
+    for f in feats:
+        idf[f] = _idf(len(examples) + 1, df[f])
+    examples.append(example)
+    features.append(feats)
+    vectors.append(_vector(feats, idf))
+
+    learned = [i for i, e in enumerate(examples) if e[4] != "seed"]
+    if len(learned) > settings.FEW_SHOT_MAX_LEARNED:
+        oldest = learned[0]
+        df.subtract(features[oldest].keys())
+        del examples[oldest], features[oldest], vectors[oldest]
+
+    # Older entries keep the weights of when they were indexed
+    _index["added"] += 1
+    if _index["added"] > len(examples) * _REFRESH_SHARE:
+        _index["stale"] = True
+
+
+def seed_example_store():
+    """Load the built-in examples and past successful queries (run at startup)."""
+    add_sql_examples([("", q, sql, _tables_in(sql)) for q, sql in SEED_EXAMPLES], source="seed")
+    add_sql_examples([(user, q, sql, _tables_in(sql)) for user, q, sql in successful_audit_queries()])
+    trim_sql_examples(settings.FEW_SHOT_MAX_LEARNED)
+    with _lock:
+        _index["stale"] = True
+
+
+def record_example(question: str, sql: str, user: str):
+    """
+    Add the question/SQL pair of ``user``'s successful query to the store.
+    Blocking — call it off the event loop.
+    """
+    example = (user, question.strip(), sql.strip(), _tables_in(sql), "audit")
+    if add_sql_examples([example[:4]]):
+        trim_sql_examples(settings.FEW_SHOT_MAX_LEARNED)
+        with _lock:
+            if not _index["stale"]:
+                _add(example)
+
+
+def find_examples(question: str, schema: str = "", user: str | None = None, k: int | None = None) -> list[tuple[str, str]]:
+    """
+    The ``k`` stored examples most similar to ``question`` as (question, SQL).
+
+    Learned examples are only offered to the user they were learned from,
+    and only when every table their SQL reads is in ``schema``; the seeds
+    are generic and always eligible.
+    """
+    k = settings.FEW_SHOT_K if k is None else k
+    tables = set(_TABLE_RE.findall(schema))
+    with _lock:
+        if _index["stale"]:
+            _rebuild()
+        examples, vectors, idf = _index["examples"], _index["vectors"], _index["idf"]
+
+    query = _vector(_features(question), idf)
+    scored = []
+    for (owner, q, sql, used, source), vector in zip(examples, vectors):
+        if source != "seed" and (owner != user or not set(filter(None, used.split(","))) <= tables):
+            continue
+        score = sum(w * vector.get(f, 0.0) for f, w in query.items())
+        if score > 0:
+            scored.append((score, q, sql))
+    scored.sort(key=lambda s: -s[0])
+    return [(q, sql) for _, q, sql in scored[:k]]
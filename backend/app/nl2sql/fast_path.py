@@ -0,0 +1,243 @@
+"""
+fast_path.py — Answer simple, templated questions without the LLM.
+
+Questions shaped like "total revenue", "average salary by department",
+"top 5 products by sales", "revenue by month" or "how many rows" are
+parsed against the session's column names and profiled roles, and their
+SQL is written directly. Every word of the question must be accounted
+for — a filter, a follow-up ("and by region?") or anything else the
+patterns don't cover sends the question to the LLM. Columns named only
+in part ("price" for unit_price) lower the confidence, and a match below
+FAST_PATH_MIN_CONFIDENCE (or one that fits two columns or tables equally)
+goes to the LLM too.
+"""
+
+import re
+import threading
+
+from app.core.config import settings
+from app.ingestion.profiler import is_temporal_type
+from app.ingestion.schema_detector import quote_ident
+from app.nl2sql.answer_cache import normalize_question
+from app.nl2sql.intent_classifier import AGGREGATION_KEYWORDS, RETRIEVAL_VERBS
+from app.nl2sql.scheduler import scheduler_metrics
+from app.nl2sql.schema_linker import name_terms
+
+# Aggregation words that name a SQL function, plus their synonyms
+_FUNCTIONS = {
+    "total": "SUM", "sum": "SUM", "average": "AVG", "max": "MAX", "min": "MIN",
+    "median": "MEDIAN", "stddev": "STDDEV_SAMP", "variance": "VAR_SAMP",
+}
+_AGGREGATES = {kw: _FUNCTIONS[kw] for kw in AGGREGATION_KEYWORDS if kw in _FUNCTIONS}
+_AGGREGATES.update({"avg": "AVG", "mean": "AVG", "maximum": "MAX", "highest": "MAX",
+                    "minimum": "MIN", "lowest": "MIN"})
+# Result column prefix per function, as in the prompt's examples (avg_salary)
+_PREFIXES = {"SUM": "total", "AVG": "avg", "MAX": "max", "MIN": "min",
+             "MEDIAN": "median", "STDDEV_SAMP": "stddev", "VAR_SAMP": "variance"}
+
+_TIME_UNITS = {"day", "week", "month", "quarter", "year"}
+_ROW_WORDS = {"row", "record", "entry", "line"}
+_TABLE_WORDS = {"table", "data", "dataset"}
+_DIMENSION_ROLES = {"id", "date", "name", "category", "text"}
+_PARTIAL_MATCH = 0.9
+
+_AGG_ALT = "|".join(sorted(map(re.escape, _AGGREGATES), key=len, reverse=True))
+_LEAD_RE = re.compile(
+    r"^(?:(?:" + "|".join(re.escape(v.strip()) for v in RETRIEVAL_VERBS)
+    + r"|get|give|find|tell)(?: me)?|what(?:'s| is| are| was| were))\s+"
+)
+_ARTICLE_RE = re.compile(r"^(?:the|all|our|my|each|every)\s+")
+_TABLE_TAIL_RE = re.compile(r"^(?P<head>.+)\s+(?:in|from|of) (?:the )?(?P<table>[a-z0-9_ ]+)$")
+_THERE_RE = re.compile(r"\s+(?:are|were) there$")
+_GROUP = r"\s+(?:by|per|for each|in each|across)\s+(?P<dim>.+)"
+
+_COUNT_RE = re.compile(
+    r"^(?:how many|number of|total number of|count(?: of)?)(?:\s+(?P<thing>.+?))??(?:" + _GROUP + r")?$"
+)
+_TOP_RE = re.compile(r"^(?P<dir>top|bottom)\s+(?P<n>\d{1,4})\s+(?P<dim>.+?)\s+by\s+(?P<measure>.+)$")
+_AGG_RE = re.compile(rf"^(?P<agg>{_AGG_ALT})(?:\s+of)?\s+(?P<measure>.+?)(?:{_GROUP})?$")
+_BY_RE = re.compile(rf"^(?P<measure>.+?){_GROUP}$")
+
+_lock = threading.Lock()
+_stats = {"attempts": 0, "hits": 0, "low_confidence": 0, "no_match": 0, "est_llm_seconds_saved": 0.0}
+_by_pattern: dict[str, int] = {}
+
+
+def _strip(phrase: str) -> str:
+    return _ARTICLE_RE.sub("", phrase.strip())
+
+
+def _roles(context: dict) -> dict[str, dict]:
+    return {c["name"]: c for c in context["profile"]["columns"]}
+
+
+def _resolve(phrase: str, columns: dict[str, dict], roles: set[str]) -> tuple[str, float] | None:
+    """
+    The one column with one of ``roles`` a phrase names, and how sure that
+    is: 1.0 when the phrase is the column's name, less when it is only part
+    of it. Measures and dimensions are looked up separately ("sales" the
+    amount is not "sales_rep"). None when no column or several fit equally.
+    """
+    terms = name_terms(_strip(phrase))
+    if not terms:
+        return None
+    matches = []
+    for name, column in columns.items():
+        if column["role"] not in roles:
+            continue
+        column_terms = name_terms(name)
+        if terms == column_terms:
+            matches.append((1.0, name))
+        elif terms < column_terms:
+            matches.append((_PARTIAL_MATCH, name))
+    if not matches:
+        return None
+    matches.sort(reverse=True)
+    if len(matches) > 1 and matches[0][0] == matches[1][0]:
+        return None
+    return matches[0][1], matches[0][0]
+
+
+def _dimension(phrase: str, columns: dict[str, dict]) -> tuple[str, str, bool, float] | None:
+    """
+    (select expression, result name, is time, confidence) for a group-by
+    phrase: a non-measure column, or a time unit ("month") applied to the
+    table's only date column.
+    """
+    found = _resolve(phrase, columns, _DIMENSION_ROLES)
+    if found:
+        name, confidence = found
+        return quote_ident(name), name, columns[name]["role"] == "date", confidence
+    unit = _strip(phrase).rstrip("s")
+    dates = [c for c in columns.values() if c["role"] == "date"]
+    if unit not in _TIME_UNITS or len(dates) != 1:
+        return None
+    column = dates[0]
+    if is_temporal_type(column["type"]):
+        expression = f"CAST(DATE_TRUNC('{unit}', {quote_ident(column['name'])}) AS DATE)"
+    elif unit == "year":
+        expression = quote_ident(column["name"])  # integer year column
+    else:
+        return None
+    return expression, unit, True, 1.0
+
+
+def _measure(phrase: str, columns: dict[str, dict], default: str = "SUM") -> tuple[str, str, float] | None:
+    """(aggregate expression, result name, confidence) for "average salary" or plain "salary"."""
+    match = re.match(rf"^(?P<agg>{_AGG_ALT})(?:\s+of)?\s+(?P<rest>.+)$", phrase)
+    function = _AGGREGATES[match["agg"]] if match else default
+    found = _resolve(match["rest"] if match else phrase, columns, {"measure"})
+    if not found:
+        return None
+    name, confidence = found
+    prefix = _PREFIXES[function]
+    alias = name if name.startswith(prefix + "_") else f"{prefix}_{name}"
+    return f"{function}({quote_ident(name)})", alias, confidence
+
+
+def _grouped(table: str, dim: tuple, value: str, alias: str, descending: bool = True, limit: int | None = None) -> str:
+    expression, name, is_time, _ = dim
+    select = expression if expression == quote_ident(name) else f"{expression} AS {quote_ident(name)}"
+    # Time series read left to right; everything else biggest first
+    order = quote_ident(name) if is_time and limit is None else f"{quote_ident(alias)} {'DESC' if descending else 'ASC'}"
+    sql = (
+        f"SELECT {select}, {value} AS {quote_ident(alias)} FROM {quote_ident(table)} "
+        f"GROUP BY {expression} ORDER BY {order}"
+    )
+    return sql if limit is None else f"{sql} LIMIT {limit}"
+
+
+def _parse(text: str, context: dict) -> tuple[str, str, float] | None:
+    """(pattern, SQL, confidence) for a question about one table, or None."""
+    table = context["table"]
+    columns = _roles(context)
+
+    match = _COUNT_RE.match(text)
+    if match:
+        thing = _strip(match["thing"] or "")
+        value, alias, confidence = "COUNT(*)", "row_count", 1.0
+        if thing and not (name_terms(thing) <= _ROW_WORDS or name_terms(thing) == name_terms(table)):
+            # "orders" counts order_id rather than order_date
+            found = _resolve(thing, columns, {"id"}) or _resolve(thing, columns, _DIMENSION_ROLES)
+            if not found:
+                return None
+            name, confidence = found
+            value, alias = f"COUNT(DISTINCT {quote_ident(name)})", f"{name}_count"
+        if not match["dim"]:
+            return "count", f"SELECT {value} AS {quote_ident(alias)} FROM {quote_ident(table)}", confidence
+        dim = _dimension(match["dim"], columns)
+        if not dim:
+            return None
+        return "count_by", _grouped(table, dim, value, alias), confidence * dim[3]
+
+    match = _TOP_RE.match(text)
+    if match:
+        dim, measure = _dimension(match["dim"], columns), _measure(match["measure"], columns)
+        if not dim or not measure:
+            return None
+        sql = _grouped(table, dim, measure[0], measure[1], match["dir"] == "top", int(match["n"]))
+        return "top_n", sql, dim[3] * measure[2]
+
+    match = _AGG_RE.match(text) or _BY_RE.match(text)
+    if match:
+        groups = match.groupdict()
+        phrase = f"{groups['agg']} {match['measure']}" if groups.get("agg") else match["measure"]
+        measure = _measure(phrase, columns)
+        if not measure:
+            return None
+        value, alias, confidence = measure
+        if not match["dim"]:
+            return "aggregate", f"SELECT {value} AS {quote_ident(alias)} FROM {quote_ident(table)}", confidence
+        dim = _dimension(match["dim"], columns)
+        if not dim:
+            return None
+        return "aggregate_by", _grouped(table, dim, value, alias), confidence * dim[3]
+    return None
+
+
+def fast_sql(question: str, contexts: list[dict]) -> str | None:
+    """
+    SQL for a simple question, or None when it should go to the LLM (no
+    pattern fits, confidence is below FAST_PATH_MIN_CONFIDENCE, or two
+    tables fit equally well).
+    """
+    if not settings.FAST_PATH_ENABLED or not contexts:
+        return None
+    text = _strip(_LEAD_RE.sub("", normalize_question(question)))
+
+    # "... in the sales data" picks the table
+    match = _TABLE_TAIL_RE.match(text)
+    if match:
+        named_terms = name_terms(match["table"]) - _TABLE_WORDS
+        named = [c for c in contexts if name_terms(c["table"]) - _TABLE_WORDS == named_terms]
+        if named:
+            contexts, text = named, match["head"]
+    text = _THERE_RE.sub("", text)
+
+    parsed = [p for p in (_parse(text, c) for c in contexts) if p]
+    parsed.sort(key=lambda p: p[2], reverse=True)
+    with _lock:
+        _stats["attempts"] += 1
+        if not parsed or (len(parsed) > 1 and parsed[0][2] == parsed[1][2]):
+            _stats["no_match"] += 1
+            return None
+        pattern, sql, confidence = parsed[0]
+        if confidence < settings.FAST_PATH_MIN_CONFIDENCE:
+            _stats["low_confidence"] += 1
+            return None
+        _stats["hits"] += 1
+        _by_pattern[pattern] = _by_pattern.get(pattern, 0) + 1
+        # What the LLM would have taken, at its recent average
+        _stats["est_llm_seconds_saved"] += scheduler_metrics()["avg_seconds"]
+    return sql
+
+
+def fast_path_metrics() -> dict:
+    """Questions answered without the LLM since startup, by pattern, and the share of all tried."""
+    with _lock:
+        return {
+            **_stats,
+            "est_llm_seconds_saved": round(_stats["est_llm_seconds_saved"], 1),
+            "hit_rate": round(_stats["hits"] / _stats["attempts"], 3) if _stats["attempts"] else None,
+            "by_pattern": dict(_by_pattern),
+        }
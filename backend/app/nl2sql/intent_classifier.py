@@ -1,4 +1,5 @@
 from app.nl2sql.llm_client import call_local_llm
+from app.nl2sql.scheduler import LLMBusyError
 
 
 # ── Prompt injection / jailbreak patterns ─────────────────────────────────────
@@ -67,24 +68,36 @@ OFF_TOPIC_KEYWORDS = [
     "tell me a joke", "make me laugh",
 ]
 
+# Verbs that only introduce what to retrieve ("show total sales") — also
+# stripped by the fast-path SQL generator
+RETRIEVAL_VERBS = [
+    "show ", "list ", "display ", "fetch ", "retrieve ", "calculate ", "compute ",
+]
+
 # Unambiguous data-action starters — if question begins with one of these
 # we short-circuit directly to data_query BEFORE any chitchat checks.
 DATA_ACTION_STARTERS = [
     # Unambiguous data retrieval verbs — these can ONLY mean data queries
-    "show ", "list ", "display ", "fetch ", "retrieve ",
-    "count ", "calculate ", "compute ", "rank ", "filter ",
+    *RETRIEVAL_VERBS,
+    "count ", "rank ", "filter ",
     # These are data-specific enough in context
     "how many ", "how much ", "how long ",
     "who earns", "who has the highest", "who has the lowest",
 ]
 
+# Aggregation words — the fast-path SQL generator maps the ones naming a
+# SQL aggregate function straight to it
+AGGREGATION_KEYWORDS = [
+    "total", "average", "count", "sum", "max", "min", "calculate", "compute",
+    "aggregate", "distinct", "unique", "median", "stddev", "variance",
+]
+
 # Data query patterns → SQL pipeline
 DATA_KEYWORDS = [
     # Action verbs
     "show", "list", "display", "get", "find", "give", "fetch", "retrieve",
     # Aggregations
-    "total", "average", "count", "sum", "max", "min", "calculate", "compute",
-    "aggregate", "distinct", "unique", "median", "stddev", "variance",
+    *AGGREGATION_KEYWORDS,
     # Questions
     "how many", "how much", "how long", "how old", "which", "who earns",
     "what is the total", "what is the average",
@@ -132,7 +145,7 @@ TABLE_CONTEXT_WORDS = [
 ]
 
 
-def classify_intent(question: str) -> str:
+async def classify_intent(question: str, user: str | None = None) -> str:
     """
     Classify whether a question is:
     - "data_query" → go through NL-to-SQL pipeline
@@ -147,6 +160,8 @@ def classify_intent(question: str) -> str:
       5. Weak data signal → data_query
       6. LLM fallback
       7. Default → data_query  (users are here to query their data)
+
+    The LLM fallback is queued as ``user`` ahead of SQL generation.
     """
     q_lower = question.strip().lower()
 
@@ -205,7 +220,10 @@ User message: "{question}"
 Reply with ONLY one word: data_query, off_topic, or chitchat"""
 
     try:
-        response = call_local_llm(classify_prompt).strip().lower()
+        response = (await call_local_llm(classify_prompt, user, priority="classify")).strip().lower()
+    except LLMBusyError:
+        # A full queue would refuse the SQL request too — say so now
+        raise
     except RuntimeError:
         # If LLM is unavailable, attempt data_query so user sees a real error
         return "data_query"
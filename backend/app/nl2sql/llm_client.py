@@ -1,84 +1,342 @@
+import asyncio
+import hashlib
 import json as _json
-import requests
-from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+import time
+from functools import partial
+
+import httpx
+
 from app.core.config import settings
+from app.nl2sql.ollama_pool import UNREACHABLE, begin, candidates, check_backends, end, mark_down, pool_status, warm_backends
+from app.nl2sql.scheduler import queue_changed, release, wait_for_slot
+from app.nl2sql.sql_validator import complete_statement_end
 
+# One pooled client per process: connections to Ollama are kept alive and
+# reused instead of opening a new one per question
+_client: httpx.AsyncClient | None = None
+_health_task: asyncio.Task | None = None
 
-def call_local_llm(prompt: str) -> str:
-    """Call local Ollama LLM (non-streaming). All data stays on your machine."""
-    try:
-        response = requests.post(
-            f"{settings.OLLAMA_BASE_URL}/api/generate",
-            json={
-                "model": settings.LLM_MODEL,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.1,  # Low temp for precise SQL
-                    "num_predict": 512,
-                },
-            },
-            timeout=60,
+# Single flight: requests with an identical payload already being generated
+# share that generation. prompt hash → future (non-streaming) or flight
+# dict (streaming: tokens so far, done/error, wake-up event, subscribers)
+_call_flights: dict[str, asyncio.Future] = {}
+_stream_flights: dict[str, dict] = {}
+_stats = {"generations": 0, "coalesced": 0, "tokens_generated": 0, "early_stops": 0}
+_NUM_PREDICT = 512
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.OLLAMA_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(
+                settings.OLLAMA_READ_TIMEOUT,
+                connect=settings.OLLAMA_CONNECT_TIMEOUT,
+            ),
         )
+    return _client
+
+
+async def _health_loop():
+    while True:
+        await check_backends(_get_client())
+        warm_backends(_get_client())
+        await asyncio.sleep(settings.OLLAMA_HEALTH_INTERVAL_SECONDS)
+
+
+def start_health_checks():
+    """Poll the Ollama backends and keep the model warm in the background (called at startup)."""
+    global _health_task
+    if _health_task is None:
+        _health_task = asyncio.create_task(_health_loop())
+
+
+async def close_llm_client():
+    """Stop the health checks and close the pooled connections (called at shutdown)."""
+    global _client, _health_task
+    if _health_task is not None:
+        _health_task.cancel()
+        _health_task = None
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _release_slot(started: float, _task: asyncio.Future):
+    # A done callback, so the slot comes back even if the task was cancelled before it ran
+    release(started)
+
+
+def _finish_call(key: str, started: float, _task: asyncio.Future):
+    _call_flights.pop(key, None)
+    release(started)
+
+
+def _generate_payload(prompt: str, stream: bool, sql: bool = False) -> dict:
+    """
+    Request body for /api/generate. Every request keeps the model loaded
+    (keep_alive) with one fixed context size: a different num_ctx would
+    reload the model, and an unloaded model loses the KV cache Ollama
+    reuses for prompts that share a prefix. SQL generation also sends the
+    LLM_STOP_SEQUENCES that mark the start of an explanation.
+    """
+    payload = {
+        "model": settings.LLM_MODEL,
+        "prompt": prompt,
+        "stream": stream,
+        "keep_alive": settings.OLLAMA_KEEP_ALIVE,
+        "options": {
+            "temperature": 0.1,  # Low temp for precise SQL
+            "num_predict": _NUM_PREDICT,
+            "num_ctx": settings.LLM_NUM_CTX,
+        },
+    }
+    if sql and settings.LLM_STOP_SEQUENCES:
+        payload["options"]["stop"] = list(settings.LLM_STOP_SEQUENCES)
+    return payload
+
+
+def _flight_key(payload: dict) -> str:
+    return hashlib.sha256(_json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+async def _queue_for(user: str | None, priority: str, flights: dict, key: str):
+    """
+    Yield queue positions while waiting for an LLM slot, then ``True`` once
+    the slot is held. Stops without a slot if an identical request starts
+    generating meanwhile (its flight can be joined instead).
+    """
+    waiter = wait_for_slot(user, priority)
+    try:
+        async for position in waiter:
+            if key in flights:
+                return
+            yield position
+    finally:
+        await waiter.aclose()
+    yield True
+
+
+async def _generate(payload: dict) -> str:
+    """
+    Generate on the least-loaded backend, moving on to the next one if it
+    is unreachable or answers with a server error (5xx).
+    """
+    failure = None
+    for backend in candidates():
+        begin(backend)
+        try:
+            response = await _get_client().post(f"{backend['url']}/api/generate", json=payload)
+            response.raise_for_status()
+            return response.json()["response"]
+        except UNREACHABLE as e:
+            mark_down(backend, e)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code < 500:
+                raise RuntimeError(f"LLM error: {str(e)}")
+            mark_down(backend, e)
+            failure = e
+        except httpx.TimeoutException:
+            raise RuntimeError(
+                "Ollama request timed out. The model may still be loading — try again."
+            )
+        except Exception as e:
+            raise RuntimeError(f"LLM error: {str(e)}")
+        finally:
+            end(backend)
+    if failure is not None:
+        raise RuntimeError(f"LLM error: {str(failure)}")
+    raise RuntimeError(
+        "Ollama is not running. Start it with: ollama serve"
+    )
+
+
+async def call_local_llm(prompt: str, user: str | None = None, priority: str = "generate", sql: bool = False) -> str:
+    """
+    Call local Ollama LLM (non-streaming). All data stays on your machine.
+    Waits for a slot from the admission scheduler as ``user`` (raises
+    LLMBusyError when the queue is full). Concurrent calls with the same
+    prompt share one generation. ``sql`` adds the SQL stop sequences.
+    """
+    payload = _generate_payload(prompt, stream=False, sql=sql)
+    key = _flight_key(payload)
+    flight = _call_flights.get(key)
+    while flight is None:
+        admitted = False
+        async for item in _queue_for(user, priority, _call_flights, key):
+            admitted = item is True
+        flight = _call_flights.get(key)
+        if admitted and flight is None:
+            _stats["generations"] += 1
+            flight = asyncio.ensure_future(_generate(payload))
+            _call_flights[key] = flight
+            flight.add_done_callback(partial(_finish_call, key, time.monotonic()))
+            queue_changed()
+            break
+        if admitted:
+            release()
+    else:
+        _stats["coalesced"] += 1
+    # shield: one caller giving up must not cancel the others' answer
+    return await asyncio.shield(flight)
+
+
+def _notify(flight: dict):
+    """Wake the subscribers of a stream flight waiting for the next token."""
+    flight["event"].set()
+    flight["event"] = asyncio.Event()
+
+
+async def _stream_from(backend: dict, flight: dict, payload: dict):
+    """Stream one generation from ``backend`` into the flight."""
+    text = ""
+    async with _get_client().stream("POST", f"{backend['url']}/api/generate", json=payload) as response:
         response.raise_for_status()
-        return response.json()["response"]
-    except RequestsConnectionError:
-        raise RuntimeError(
-            "Ollama is not running. Start it with: ollama serve"
-        )
-    except Timeout:
-        raise RuntimeError(
-            "Ollama request timed out. The model may still be loading — try again."
-        )
+        async for raw_line in response.aiter_lines():
+            if not raw_line:
+                continue
+            try:
+                chunk = _json.loads(raw_line)
+            except Exception:
+                continue
+            token = chunk.get("response", "")
+            if token:
+                text += token
+                flight["tokens"].append(token)
+                _stats["tokens_generated"] += 1
+                _notify(flight)
+            if chunk.get("done"):
+                break
+            if flight["sql"] and token:
+                stop_at = complete_statement_end(text)
+                if stop_at is not None:
+                    flight["end"] = stop_at
+                    _stats["early_stops"] += 1
+                    break
+
+
+async def _produce(key: str, flight: dict, payload: dict):
+    """
+    Run one streaming generation, appending tokens to the flight. For SQL
+    flights the response is closed — which stops Ollama generating — as
+    soon as the first statement is complete. A backend that is unreachable
+    or answers with a server error (5xx) is skipped for the next one as
+    long as no token has been streamed yet.
+    """
+    failure = None
+    try:
+        for backend in candidates():
+            begin(backend)
+            try:
+                await _stream_from(backend, flight, payload)
+                break
+            except UNREACHABLE as e:
+                mark_down(backend, e)
+                if flight["tokens"]:
+                    raise
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code < 500:
+                    raise
+                mark_down(backend, e)
+                failure = e
+            finally:
+                end(backend)
+        else:
+            if failure is not None:
+                raise failure
+            flight["error"] = "Ollama is not running. Start it with: ollama serve"
+    except httpx.ConnectError:
+        flight["error"] = "Ollama is not running. Start it with: ollama serve"
+    except httpx.TimeoutException:
+        flight["error"] = "Ollama request timed out. The model may still be loading."
     except Exception as e:
-        raise RuntimeError(f"LLM error: {str(e)}")
+        flight["error"] = f"LLM error: {str(e)}"
+    finally:
+        flight["done"] = True
+        if _stream_flights.get(key) is flight:
+            del _stream_flights[key]
+        _notify(flight)
 
 
-def stream_local_llm(prompt: str):
+async def stream_local_llm(prompt: str, user: str | None = None, priority: str = "generate", sql: bool = False):
     """
     Stream tokens from Ollama one-by-one.
     Yields (token: str) as they arrive.
-    Raises RuntimeError on connection/timeout issues.
+    Raises RuntimeError on connection/timeout issues (LLMBusyError when the
+    admission queue is full).
+    While waiting for a slot from the admission scheduler it yields
+    ("__queue__", position) whenever ``user``'s position changes.
     Also returns the full assembled response via the final yielded value
     which is a special sentinel tuple ("__done__", full_text).
+
+    With ``sql``, SQL stop sequences are sent and generation ends as soon
+    as a complete statement has been emitted; the full text is cut there.
+
+    Concurrent streams of the same prompt share one generation: a stream
+    that joins late first gets the tokens generated so far. Generation is
+    stopped (and its response closed) once every subscriber has left.
     """
+    payload = _generate_payload(prompt, stream=True, sql=sql)
+    key = _flight_key(payload) + (":sql" if sql else "")
+    flight = _stream_flights.get(key)
+    last_position = None
+    while flight is None:
+        admitted = False
+        async for item in _queue_for(user, priority, _stream_flights, key):
+            if item is True:
+                admitted = True
+            elif item != last_position:
+                last_position = item
+                yield ("__queue__", item)
+        flight = _stream_flights.get(key)
+        if admitted and flight is None:
+            _stats["generations"] += 1
+            flight = {"tokens": [], "done": False, "error": None, "event": asyncio.Event(), "subscribers": 0,
+                      "sql": sql, "end": None}
+            _stream_flights[key] = flight
+            flight["task"] = asyncio.ensure_future(_produce(key, flight, payload))
+            flight["task"].add_done_callback(partial(_release_slot, time.monotonic()))
+            queue_changed()
+            break
+        if admitted:
+            release()
+    else:
+        _stats["coalesced"] += 1
+
+    flight["subscribers"] += 1
     try:
-        response = requests.post(
-            f"{settings.OLLAMA_BASE_URL}/api/generate",
-            json={
-                "model": settings.LLM_MODEL,
-                "prompt": prompt,
-                "stream": True,
-                "options": {
-                    "temperature": 0.1,
-                    "num_predict": 512,
-                },
-            },
-            stream=True,
-            timeout=60,
-        )
-        response.raise_for_status()
-    except RequestsConnectionError:
-        raise RuntimeError("Ollama is not running. Start it with: ollama serve")
-    except Timeout:
-        raise RuntimeError("Ollama request timed out. The model may still be loading.")
-    except Exception as e:
-        raise RuntimeError(f"LLM error: {str(e)}")
+        sent = 0
+        while True:
+            tokens = flight["tokens"]
+            if sent < len(tokens):
+                sent += 1
+                yield tokens[sent - 1]
+                continue
+            if flight["done"]:
+                break
+            await flight["event"].wait()
+    finally:
+        flight["subscribers"] -= 1
+        if flight["subscribers"] == 0 and not flight["done"]:
+            flight["task"].cancel()
+            if _stream_flights.get(key) is flight:
+                del _stream_flights[key]
 
-    full_text = ""
-    for raw_line in response.iter_lines():
-        if not raw_line:
-            continue
-        try:
-            chunk = _json.loads(raw_line)
-        except Exception:
-            continue
-        token = chunk.get("response", "")
-        if token:
-            full_text += token
-            yield token
-        if chunk.get("done"):
-            break
+    if flight["error"]:
+        raise RuntimeError(flight["error"])
 
     # Sentinel: lets the consumer know generation is complete + get full text
-    yield ("__done__", full_text)
+    yield ("__done__", "".join(flight["tokens"])[:flight["end"]])
+
+
+def llm_metrics() -> dict:
+    """
+    Generations sent to Ollama, requests that joined one already in flight,
+    streamed tokens, and SQL streams stopped early. ``backends`` has the
+    health and load of each Ollama server.
+    """
+    return {**_stats, "in_flight": len(_call_flights) + len(_stream_flights), "backends": pool_status()}
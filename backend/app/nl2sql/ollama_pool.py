@@ -0,0 +1,196 @@
+"""
+ollama_pool.py — Spread LLM requests over several Ollama servers.
+
+OLLAMA_BASE_URLS lists the backends (just OLLAMA_BASE_URL when empty).
+Each request goes to the healthy backend with the fewest requests in
+flight; a backend that cannot be reached is marked down on the spot and
+the request moves on to the next one. ``check_backends`` polls every
+backend's /api/ps so one that comes back rejoins the rotation, and notes
+whether LLM_MODEL is loaded there. The admission scheduler runs
+LLM_MAX_CONCURRENT generations per healthy backend.
+
+``warm_backends`` loads the model on each backend at startup and, between
+LLM_WARM_HOURS_START and LLM_WARM_HOURS_END, re-pins it with
+OLLAMA_KEEP_ALIVE every LLM_WARM_INTERVAL_MINUTES (or at once if a backend
+restarted without it), so no question waits for the model to load.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+import httpx
+
+from app.core.config import settings
+from app.nl2sql.scheduler import set_backend_count
+
+logger = logging.getLogger("datawhisper")
+
+# Errors meaning the request never reached a working server — safe to
+# send it to another backend
+UNREACHABLE = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+_backends: list[dict] = []
+_warm_tasks: set[asyncio.Task] = set()  # referenced until done
+
+
+def backend_urls() -> list[str]:
+    """Configured Ollama base URLs, without trailing slashes."""
+    urls = [u.strip().rstrip("/") for u in settings.OLLAMA_BASE_URLS.split(",") if u.strip()]
+    return urls or [settings.OLLAMA_BASE_URL.rstrip("/")]
+
+
+def _pool() -> list[dict]:
+    if not _backends:
+        # Optimistic until the first health check says otherwise
+        _backends.extend(
+            {"url": url, "healthy": True, "active": 0, "requests": 0, "failures": 0,
+             "error": None, "checked_at": None,
+             "model_loaded": False, "warming": False, "warmed_at": None, "warm_error": None,
+             "load_seconds": None}
+            for url in backend_urls()
+        )
+        set_backend_count(len(_backends))
+    return _backends
+
+
+def _set_health(backend: dict, healthy: bool, error: str | None = None):
+    backend["error"] = error
+    if backend["healthy"] == healthy:
+        return
+    backend["healthy"] = healthy
+    if healthy:
+        logger.info("Ollama backend %s is back up", backend["url"])
+    else:
+        backend["failures"] += 1
+        logger.warning("Ollama backend %s is down — %s", backend["url"], error)
+    # With every backend down, keep one backend's worth of slots so
+    # requests still fail fast instead of queueing
+    set_backend_count(max(1, sum(b["healthy"] for b in _backends)))
+
+
+def candidates() -> list[dict]:
+    """
+    Backends in the order to try them: healthy ones first, fewest requests
+    in flight first (ties go to the one that has served fewer); backends
+    marked down come last in case they recovered since the last check.
+    """
+    return sorted(_pool(), key=lambda b: (not b["healthy"], b["active"], b["requests"]))
+
+
+def begin(backend: dict):
+    """Count a request sent to ``backend``."""
+    backend["active"] += 1
+    backend["requests"] += 1
+
+
+def end(backend: dict):
+    backend["active"] -= 1
+
+
+def mark_down(backend: dict, error: Exception):
+    """Take a backend out of the rotation until a health check finds it up."""
+    _set_health(backend, False, str(error) or type(error).__name__)
+
+
+def _is_model(name: str) -> bool:
+    model = settings.LLM_MODEL
+    return name == model or (":" not in model and name == f"{model}:latest")
+
+
+async def _check(client: httpx.AsyncClient, backend: dict):
+    asked = time.time()
+    try:
+        response = await client.get(f"{backend['url']}/api/ps", timeout=settings.OLLAMA_CONNECT_TIMEOUT)
+        response.raise_for_status()
+        loaded = response.json().get("models") or []
+        # A warm-up that finished meanwhile knows better than this answer
+        if not backend["warming"] and (backend["warmed_at"] or 0) < asked:
+            backend["model_loaded"] = any(_is_model(m.get("name", "")) for m in loaded)
+        _set_health(backend, True)
+    except Exception as e:
+        backend["model_loaded"] = False
+        _set_health(backend, False, str(e) or type(e).__name__)
+    backend["checked_at"] = time.time()
+
+
+async def check_backends(client: httpx.AsyncClient):
+    """Poll every backend once, concurrently."""
+    await asyncio.gather(*(_check(client, b) for b in _pool()))
+
+
+# ── Warm-up ──────────────────────────────────────────────────────────────────
+
+def _in_warm_hours() -> bool:
+    return settings.LLM_WARM_HOURS_START <= datetime.now().hour < settings.LLM_WARM_HOURS_END
+
+
+def _needs_warming(backend: dict) -> bool:
+    if not backend["healthy"] or backend["warming"]:
+        return False
+    if backend["warmed_at"] is None:
+        return True  # startup, whatever the hour
+    if not _in_warm_hours():
+        return False
+    if time.time() - backend["warmed_at"] >= settings.LLM_WARM_INTERVAL_MINUTES * 60:
+        return True
+    # Unloaded behind our back (Ollama restarted); a failed load waits for the interval
+    return not backend["model_loaded"] and backend["warm_error"] is None
+
+
+async def _warm(client: httpx.AsyncClient, backend: dict):
+    backend["warming"] = True
+    started = time.monotonic()
+    try:
+        # No prompt: Ollama only loads the model. Same num_ctx as real
+        # requests — a different one would make the next request reload it
+        response = await client.post(
+            f"{backend['url']}/api/generate",
+            json={
+                "model": settings.LLM_MODEL,
+                "keep_alive": settings.OLLAMA_KEEP_ALIVE,
+                "options": {"num_ctx": settings.LLM_NUM_CTX},
+            },
+            timeout=httpx.Timeout(settings.LLM_WARMUP_TIMEOUT, connect=settings.OLLAMA_CONNECT_TIMEOUT),
+        )
+        response.raise_for_status()
+        backend["model_loaded"] = True
+        backend["warm_error"] = None
+        backend["load_seconds"] = round(time.monotonic() - started, 2)
+        logger.info("Model %s warm on %s (%.1fs)", settings.LLM_MODEL, backend["url"], backend["load_seconds"])
+    except UNREACHABLE as e:
+        mark_down(backend, e)
+    except Exception as e:
+        backend["warm_error"] = str(e) or type(e).__name__
+        logger.warning("Warming %s on %s failed — %s", settings.LLM_MODEL, backend["url"], backend["warm_error"])
+    finally:
+        backend["warming"] = False
+        backend["warmed_at"] = time.time()
+
+
+def warm_backends(client: httpx.AsyncClient):
+    """Start loading the model on every healthy backend that needs it (without waiting for the loads)."""
+    if not settings.LLM_WARMUP_ENABLED:
+        return
+    for backend in _pool():
+        if _needs_warming(backend):
+            task = asyncio.create_task(_warm(client, backend))
+            _warm_tasks.add(task)
+            task.add_done_callback(_warm_tasks.discard)
+
+
+def model_state() -> dict:
+    """Whether the model is loaded on at least one healthy backend, and whether a load is under way."""
+    backends = _pool()
+    return {
+        "model_loaded": any(b["healthy"] and b["model_loaded"] for b in backends),
+        "warming": any(b["warming"] for b in backends),
+        "backends_ready": sum(b["healthy"] and b["model_loaded"] for b in backends),
+        "backends": len(backends),
+    }
+
+
+def pool_status() -> list[dict]:
+    """Health, requests in flight and totals per backend."""
+    return [dict(b) for b in _pool()]
@@ -1,6 +1,13 @@
+import asyncio
 import math
 
+from app.nl2sql.answer_cache import answer_key, get_answer, store_answer
+from app.nl2sql.example_store import find_examples
+from app.nl2sql.fast_path import fast_sql
 from app.nl2sql.prompt_builder import build_nl2sql_prompt
+from app.nl2sql.scheduler import LLMBusyError
+from app.nl2sql.schema_cache import build_table_context, get_table_contexts
+from app.nl2sql.schema_linker import link_schema
 from app.nl2sql.sql_validator import validate_and_fix_sql
 from app.nl2sql.llm_client import call_local_llm
 from app.nl2sql.intent_classifier import classify_intent, generate_chitchat_response, OFF_TOPIC_RESPONSE
@@ -14,44 +21,62 @@ class NL2SQLPipeline:
     Steps:
     0. Classify intent (data query vs chitchat)
     1. Build prompt with schema context
-    2. Send to local LLM (Ollama)
+    2. Send to local LLM (Ollama) — skipped when the fast path can write the
+       SQL itself or the answer cache has it
     3. Extract and validate SQL
     4. Execute on DuckDB
     5. Format result for user
     """
 
-    def __init__(self, db_conn, conversation_history: list = None):
+    def __init__(self, db_conn, conversation_history: list = None, session_id: str = None, username: str = None):
         self.conn = db_conn
         self.history = conversation_history or []
+        self.session_id = session_id
+        self.username = username  # whose queue LLM calls wait in
 
-    def get_schema_info(self) -> str:
-        """Extract all table schemas from the DuckDB connection."""
+    def _table_contexts(self) -> list[dict]:
+        """Schema context of every table — from the per-session schema cache when the session is known."""
+        if self.session_id:
+            return get_table_contexts(self.session_id, self.conn)
         tables = self.conn.execute(
             "SELECT table_name FROM information_schema.tables WHERE table_schema='main'"
         ).fetchall()
+        return [build_table_context(self.conn, table_name) for (table_name,) in tables]
 
-        schema_parts = []
-        for (table_name,) in tables:
-            columns = self.conn.execute(
-                "SELECT column_name, data_type FROM information_schema.columns "
-                "WHERE table_name = ?",
-                [table_name],
-            ).fetchall()
-            cols_str = ", ".join([f"{name} ({dtype})" for name, dtype in columns])
-            sample = self.conn.execute(
-                f'SELECT * FROM "{table_name}" LIMIT 3'
-            ).fetchdf().to_string(index=False)
-            schema_parts.append(
-                f"Table: {table_name}\n"
-                f"  Columns: {cols_str}\n"
-                f"  Sample rows:\n{sample}"
-            )
-        return "\n\n".join(schema_parts)
+    def get_schema_info(self, question: str = None) -> str:
+        """
+        Extract table schemas from the DuckDB connection. With a
+        ``question``, only the tables/columns relevant to it are included.
+        """
+        contexts = self._table_contexts()
+        if question:
+            return link_schema(question, contexts, self.history)
+        return "\n\n".join(c["block"] for c in contexts)
+
+    def build_prompt(self, question: str, schema_info: str) -> str:
+        """NL2SQL prompt with the stored few-shot examples most similar to the question."""
+        return build_nl2sql_prompt(
+            question=question,
+            schema=schema_info,
+            history=self.history,
+            examples=find_examples(question, schema_info, self.username),
+        )
+
+    def fast_sql(self, question: str) -> str | None:
+        """SQL for a simple templated question written without the LLM, or None."""
+        sql = fast_sql(question, self._table_contexts())
+        return validate_and_fix_sql(sql, self.conn) if sql else None
 
-    def run(self, user_question: str) -> dict:
-        """Execute the full NL-to-SQL pipeline."""
+    def cache_key(self, question: str, schema_info: str) -> str | None:
+        """Answer-cache key of a question (None when the session is unknown)."""
+        if not self.session_id:
+            return None
+        return answer_key(self.session_id, question, schema_info, self.history)
+
+    async def run(self, user_question: str) -> dict:
+        """Execute the full NL-to-SQL pipeline. Raises LLMBusyError when the LLM queue is full."""
         # Step 0: Classify intent — is this a data query or chitchat?
-        intent = classify_intent(user_question)
+        intent = await classify_intent(user_question, self.username)
 
         if intent == "chitchat":
             response_text = generate_chitchat_response(user_question)
@@ -76,43 +101,56 @@ class NL2SQLPipeline:
                 "summary": OFF_TOPIC_RESPONSE,
             }
 
-        schema_info = self.get_schema_info()
+        # Simple templated question → SQL straight from the column names
+        generated_sql = await asyncio.to_thread(self.fast_sql, user_question)
+        cache_key = cached_sql = None
 
-        # Build the prompt
-        prompt = build_nl2sql_prompt(
-            question=user_question,
-            schema=schema_info,
-            history=self.history,
-        )
+        if generated_sql is None:
+            schema_info = await asyncio.to_thread(self.get_schema_info, user_question)
 
-        # Get SQL from LLM
-        try:
-            llm_response = call_local_llm(prompt)
-        except RuntimeError as e:
-            return {"type": "error", "message": str(e), "sql": None}
+            # Same question on the same schema answered before → reuse its SQL
+            cache_key = await asyncio.to_thread(self.cache_key, user_question, schema_info)
+            cached_sql = get_answer(cache_key) if cache_key else None
+            generated_sql = cached_sql
 
-        generated_sql = validate_and_fix_sql(llm_response, self.conn)
+        if generated_sql is None:
+            # Build the prompt
+            prompt = await asyncio.to_thread(self.build_prompt, user_question, schema_info)
 
-        if not generated_sql:
-            return {
-                "type": "error",
-                "message": "Could not generate a valid SQL query. Please rephrase.",
-                "sql": llm_response,
-            }
+            # Get SQL from LLM
+            try:
+                llm_response = await call_local_llm(prompt, self.username, sql=True)
+            except LLMBusyError:
+                raise
+            except RuntimeError as e:
+                return {"type": "error", "message": str(e), "sql": None}
+
+            generated_sql = validate_and_fix_sql(llm_response, self.conn)
+
+            if not generated_sql:
+                return {
+                    "type": "error",
+                    "message": "Could not generate a valid SQL query. Please rephrase.",
+                    "sql": llm_response,
+                }
 
         # Execute the query
         try:
             result_df = self.conn.execute(generated_sql).fetchdf()
         except Exception as e:
-            # Self-healing: send error back to LLM for correction
+            # Self-healing: send error back to LLM for correction, with the
+            # full schema in case linking left out what the query needs
+            full_schema = await asyncio.to_thread(self.get_schema_info)
             retry_prompt = (
                 f"The following SQL failed:\n{generated_sql}\n\n"
                 f"Error: {str(e)}\n\n"
-                f"Schema:\n{schema_info}\n\n"
+                f"Schema:\n{full_schema}\n\n"
                 f"Fix the SQL query. Return ONLY the corrected SQL."
             )
             try:
-                retry_response = call_local_llm(retry_prompt)
+                retry_response = await call_local_llm(retry_prompt, self.username, sql=True)
+            except LLMBusyError:
+                raise
             except RuntimeError as retry_err:
                 return {"type": "error", "message": str(retry_err), "sql": None}
             generated_sql = validate_and_fix_sql(retry_response, self.conn)
@@ -123,6 +161,9 @@ class NL2SQLPipeline:
             except Exception as e2:
                 return {"type": "error", "message": str(e2), "sql": generated_sql}
 
+        if cache_key and generated_sql != cached_sql:
+            store_answer(cache_key, generated_sql)
+
         # Update conversation history
         self.history.append({"role": "user", "content": user_question})
         self.history.append({"role": "assistant", "content": generated_sql})
@@ -149,9 +190,19 @@ class NL2SQLPipeline:
             "summary": self._generate_summary(user_question, result_df),
         }
 
+    def _column_profiles(self) -> dict:
+        """Column name → profile across the session's tables (first table wins on clashes)."""
+        if not self.session_id:
+            return {}
+        profiles = {}
+        for context in get_table_contexts(self.session_id, self.conn):
+            for column in context["profile"]["columns"]:
+                profiles.setdefault(column["name"], column)
+        return profiles
+
     def _detect_response_type(self, df, question: str = "") -> str:
         """Delegate chart-type recommendation to the visualization advisor."""
-        return recommend_chart_type(df, question)
+        return recommend_chart_type(df, question, self._column_profiles())
 
     def _generate_summary(self, question: str, df) -> str:
         """Generate a meaningful natural-language summary of the query result."""
@@ -162,6 +213,14 @@ class NL2SQLPipeline:
         if rows == 0:
             return "No results found for your query."
 
+        # Ids and years are numbers, but totals of them mean nothing
+        profiles = self._column_profiles()
+
+        def is_measure(col) -> bool:
+            if col in profiles and profiles[col]["role"] in ("id", "date"):
+                return False
+            return pd.api.types.is_numeric_dtype(df[col])
+
         # Single scalar value
         if rows == 1 and cols == 1:
             val = df.iloc[0, 0]
@@ -188,7 +247,7 @@ class NL2SQLPipeline:
         # Two-column result (label + value)
         if cols == 2:
             label_col, value_col = df.columns[0], df.columns[1]
-            if pd.api.types.is_numeric_dtype(df[value_col]):
+            if is_measure(value_col):
                 total    = df[value_col].sum()
                 top_row  = df.loc[df[value_col].idxmax()]
                 top_val  = top_row[value_col]
@@ -206,7 +265,7 @@ class NL2SQLPipeline:
             return f"{rows} results for {label_col}."
 
         # Multi-column
-        numeric_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+        numeric_cols = [c for c in df.columns if is_measure(c)]
         if numeric_cols:
             summaries = []
             for col in numeric_cols[:3]:
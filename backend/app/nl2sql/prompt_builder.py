@@ -1,15 +1,6 @@
-def build_nl2sql_prompt(question: str, schema: str, history: list = None) -> str:
-    """Build a structured prompt for NL-to-SQL conversion."""
-
-    history_context = ""
-    if history:
-        recent = history[-6:]  # Last 3 Q&A pairs for context
-        history_context = "\n## Previous Conversation:\n"
-        for msg in recent:
-            role = "User" if msg["role"] == "user" else "SQL"
-            history_context += f"{role}: {msg['content']}\n"
-
-    return f"""You are a DuckDB SQL expert. Convert the user question into a single valid DuckDB SQL query.
+# Instructions and DuckDB reference — the same for every question, so they
+# lead the prompt and stay in Ollama's prompt cache
+_INSTRUCTIONS = """You are a DuckDB SQL expert. Convert the user question into a single valid DuckDB SQL query.
 
 ## STRICT RULES:
 1. Return ONLY the SQL query — no explanation, no markdown, no code fences
@@ -84,84 +75,144 @@ def build_nl2sql_prompt(question: str, schema: str, history: list = None) -> str
   WHERE col > (SELECT AVG(col) FROM table)      — above average
   WHERE col > (SELECT AVG(col) FROM table       — above dept average
                 WHERE dept = t.dept)
-  HAVING COUNT(*) > 3                            — filter after GROUP BY
-
-## FEW-SHOT EXAMPLES:
--- Q: Rank employees by salary within each department
-SELECT emp_name, department, salary,
+  HAVING COUNT(*) > 3                            — filter after GROUP BY"""
+
+# Built-in few-shot examples (question, SQL). They seed the example store,
+# which picks the most similar examples per question (see example_store).
+SEED_EXAMPLES = [
+    (
+        "Rank employees by salary within each department",
+        """SELECT emp_name, department, salary,
        RANK() OVER (PARTITION BY department ORDER BY salary DESC) AS salary_rank
-FROM employees
-
--- Q: Show each employee's salary and how much more they earn than the previous employee sorted by salary
-SELECT emp_name, salary,
+FROM employees""",
+    ),
+    (
+        "Show each employee's salary and how much more they earn than the previous employee sorted by salary",
+        """SELECT emp_name, salary,
        salary - LAG(salary, 1) OVER (ORDER BY salary DESC) AS diff_from_previous
 FROM employees
-ORDER BY salary DESC
-
--- Q: Show employees whose salary is above their own department average
-WITH dept_avg AS (
+ORDER BY salary DESC""",
+    ),
+    (
+        "Show employees whose salary is above their own department average",
+        """WITH dept_avg AS (
     SELECT department, AVG(salary) AS avg_sal FROM employees GROUP BY department
 )
 SELECT e.emp_name, e.department, e.salary, d.avg_sal
 FROM employees e
 JOIN dept_avg d ON e.department = d.department
-WHERE e.salary > d.avg_sal
-
--- Q: Show cumulative total salary ordered by join date
-SELECT emp_name, join_date, salary,
+WHERE e.salary > d.avg_sal""",
+    ),
+    (
+        "Show cumulative total salary ordered by join date",
+        """SELECT emp_name, join_date, salary,
        SUM(salary) OVER (ORDER BY join_date ROWS UNBOUNDED PRECEDING) AS running_total
-FROM employees
-
--- Q: Show employees in the top 25 percent by salary
-SELECT emp_name, salary
+FROM employees""",
+    ),
+    (
+        "Show employees in the top 25 percent by salary",
+        """SELECT emp_name, salary
 FROM (
     SELECT emp_name, salary,
            NTILE(4) OVER (ORDER BY salary DESC) AS quartile
     FROM employees
 ) t
-WHERE quartile = 1
-
--- Q: Show salary standard deviation and mean for each department
-SELECT department,
+WHERE quartile = 1""",
+    ),
+    (
+        "Show salary standard deviation and mean for each department",
+        """SELECT department,
        AVG(salary) AS mean_salary,
        stddev_samp(salary) AS salary_stddev
 FROM employees
-GROUP BY department
-
--- Q: What is the median salary?
-SELECT median(salary) AS median_salary FROM employees
-
--- Q: How many years has each employee been with the company?
-SELECT emp_name, join_date,
+GROUP BY department""",
+    ),
+    (
+        "What is the median salary?",
+        """SELECT median(salary) AS median_salary FROM employees""",
+    ),
+    (
+        "How many years has each employee been with the company?",
+        """SELECT emp_name, join_date,
        date_diff('year', join_date, TODAY()) AS years_of_service
-FROM employees
-
--- Q: Show pairs of employees in the same department with salary difference > 20000
-SELECT a.emp_name AS employee_1, b.emp_name AS employee_2,
+FROM employees""",
+    ),
+    (
+        "Show pairs of employees in the same department with salary difference > 20000",
+        """SELECT a.emp_name AS employee_1, b.emp_name AS employee_2,
        a.department,
        ABS(a.salary - b.salary) AS salary_difference
 FROM employees a
 JOIN employees b ON a.department = b.department AND a.emp_id < b.emp_id
-WHERE ABS(a.salary - b.salary) > 20000
-
--- Q: Which department has the highest average performance score among departments with more than 3 employees?
-SELECT department, AVG(performance_score) AS avg_performance
+WHERE ABS(a.salary - b.salary) > 20000""",
+    ),
+    (
+        "Which department has the highest average performance score among departments with more than 3 employees?",
+        """SELECT department, AVG(performance_score) AS avg_performance
 FROM employees
 GROUP BY department
 HAVING COUNT(*) > 3
 ORDER BY avg_performance DESC
-LIMIT 1
-
--- Q: Show average salary by department
-SELECT department, AVG(salary) AS avg_salary
+LIMIT 1""",
+    ),
+    (
+        "Show average salary by department",
+        """SELECT department, AVG(salary) AS avg_salary
 FROM employees
 GROUP BY department
-ORDER BY avg_salary DESC
+ORDER BY avg_salary DESC""",
+    ),
+]
+
+
+def build_prompt_prefix(schema: str) -> str:
+    """
+    Stable part of the prompt: instructions + schema. While a session's
+    schema is unchanged this text is identical across its questions, so
+    Ollama reuses the KV cache for it and only prefills the suffix.
+    """
+    return f"""{_INSTRUCTIONS}
 
 ## Database Schema:
 {schema}
-{history_context}
+"""
+
+
+def format_examples(examples: list[tuple[str, str]]) -> str:
+    """Render (question, SQL) pairs as the prompt's few-shot section."""
+    if not examples:
+        return ""
+    shots = "\n\n".join(f"-- Q: {question}\n{sql}" for question, sql in examples)
+    return f"\n## FEW-SHOT EXAMPLES:\n{shots}\n"
+
+
+def build_prompt_suffix(question: str, history: list = None, examples: list[tuple[str, str]] = None) -> str:
+    """Variable part of the prompt: few-shot examples, recent conversation, the question."""
+    history_context = ""
+    if history:
+        recent = history[-6:]  # Last 3 Q&A pairs for context
+        history_context = "\n## Previous Conversation:\n"
+        for msg in recent:
+            role = "User" if msg["role"] == "user" else "SQL"
+            history_context += f"{role}: {msg['content']}\n"
+
+    return f"""{format_examples(examples)}{history_context}
 ## User Question:
 {question}
 
 ## SQL Query (return ONLY the SQL, nothing else):"""
+
+
+def build_nl2sql_prompt(
+    question: str,
+    schema: str,
+    history: list = None,
+    examples: list[tuple[str, str]] = None,
+) -> str:
+    """
+    Build a structured prompt for NL-to-SQL conversion: stable prefix +
+    variable suffix. ``examples`` defaults to ``SEED_EXAMPLES``.
+    """
+    if examples is None:
+        examples = SEED_EXAMPLES
+    return build_prompt_prefix(schema) + build_prompt_suffix(question, history, examples)
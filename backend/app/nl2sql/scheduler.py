@@ -0,0 +1,183 @@
+"""
+scheduler.py — Admission control for LLM requests.
+
+At most LLM_MAX_CONCURRENT generations per healthy Ollama backend run at
+once; the rest wait in per-user queues served round-robin, so one user firing many
+questions cannot starve the others. Short classification calls are
+admitted before SQL generation. When a user already has
+LLM_QUEUE_MAX_PER_USER requests waiting, or LLM_QUEUE_MAX requests wait in
+total, new ones are refused at once (429 / 503 with a Retry-After
+estimate) instead of timing out in Ollama's own queue.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+
+from app.core.config import settings
+
+# Admission order: every "classify" waiter before any "generate" waiter
+PRIORITIES = ("classify", "generate")
+
+# priority → {user: deque of futures}; users rotate to the back once served
+_queues: dict[str, OrderedDict[str, deque]] = {p: OrderedDict() for p in PRIORITIES}
+_state = {"running": 0, "avg_seconds": 5.0, "changed": None, "backends": 1}
+_stats = {"admitted": 0, "queued": 0, "rejected": 0}
+
+
+class LLMBusyError(RuntimeError):
+    """Raised when the LLM queue is full; ``status_code`` and ``retry_after`` map to the HTTP response."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _changed() -> asyncio.Event:
+    if _state["changed"] is None:
+        _state["changed"] = asyncio.Event()
+    return _state["changed"]
+
+
+def queue_changed():
+    """Wake every waiter so it re-reads its position (and the state it waits on)."""
+    _changed().set()
+    _state["changed"] = asyncio.Event()
+
+
+def _limit() -> int:
+    return settings.LLM_MAX_CONCURRENT * _state["backends"]
+
+
+def set_backend_count(count: int):
+    """Scale the slots to ``count`` healthy Ollama backends (admitting waiters if it grew)."""
+    _state["backends"] = count
+    _dispatch()
+
+
+def _waiting() -> int:
+    return sum(len(q) for queues in _queues.values() for q in queues.values())
+
+
+def _waiting_for(user: str) -> int:
+    return sum(len(queues.get(user, ())) for queues in _queues.values())
+
+
+def _order():
+    """Waiters in the order they will be admitted."""
+    for priority in PRIORITIES:
+        queues = list(_queues[priority].values())
+        depth = max((len(q) for q in queues), default=0)
+        for i in range(depth):
+            for q in queues:
+                if i < len(q):
+                    yield q[i]
+
+
+def retry_after() -> int:
+    """Seconds until a new request would likely be admitted."""
+    limit = _limit()
+    return max(1, math.ceil(_state["avg_seconds"] * (_waiting() + 1) / limit))
+
+
+def check_admission(user: str):
+    """Raise LLMBusyError if a new request of ``user`` would be refused right now."""
+    if _waiting_for(user) >= settings.LLM_QUEUE_MAX_PER_USER:
+        _stats["rejected"] += 1
+        raise LLMBusyError(
+            "You already have several questions waiting. Please wait for them to finish.",
+            429, retry_after(),
+        )
+    if _waiting() >= settings.LLM_QUEUE_MAX:
+        _stats["rejected"] += 1
+        raise LLMBusyError(
+            "The assistant is busy right now. Please try again shortly.",
+            503, retry_after(),
+        )
+
+
+def _dispatch():
+    """Hand free slots to the next waiters (priority first, then round-robin by user)."""
+    admitted = False
+    while _state["running"] < _limit():
+        for priority in PRIORITIES:
+            queues = _queues[priority]
+            if queues:
+                user, q = next(iter(queues.items()))
+                future = q.popleft()
+                del queues[user]
+                if q:
+                    queues[user] = q  # back of the rotation
+                break
+        else:
+            break
+        if future.done():  # waiter gave up
+            continue
+        future.set_result(None)
+        _state["running"] += 1
+        _stats["admitted"] += 1
+        admitted = True
+    if admitted:
+        queue_changed()
+
+
+def release(started: float | None = None):
+    """Give back a slot taken at ``started`` (time.monotonic(); None if it went unused)."""
+    _state["running"] -= 1
+    if started is not None:
+        _state["avg_seconds"] = 0.8 * _state["avg_seconds"] + 0.2 * (time.monotonic() - started)
+    _dispatch()
+
+
+async def wait_for_slot(user: str | None, priority: str = "generate"):
+    """
+    Async generator: yields the caller's 1-based queue position each time
+    the queue moves, and finishes once a slot is held — the caller must
+    then ``release`` it. A free slot with nobody waiting is taken without
+    yielding. Raises LLMBusyError when the queue is full.
+    """
+    user = user or "anonymous"
+    if _state["running"] < _limit() and not _waiting():
+        _state["running"] += 1
+        _stats["admitted"] += 1
+        return
+
+    check_admission(user)
+    future = asyncio.get_running_loop().create_future()
+    _queues[priority].setdefault(user, deque()).append(future)
+    _stats["queued"] += 1
+    queue_changed()
+    admitted = False
+    try:
+        while not future.done():
+            position = next(i for i, f in enumerate(_order(), 1) if f is future)
+            yield position
+            if future.done():
+                break
+            await _changed().wait()
+        admitted = True
+    finally:
+        if not admitted:
+            if future.done() and not future.cancelled():
+                release()  # admitted just as the caller left
+            else:
+                future.cancel()
+                queue = _queues[priority].get(user)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del _queues[priority][user]
+                queue_changed()
+
+
+def scheduler_metrics() -> dict:
+    """Running and waiting requests plus admission counters since startup."""
+    return {
+        **_stats,
+        "running": _state["running"],
+        "waiting": _waiting(),
+        "max_concurrent": _limit(),
+        "avg_seconds": round(_state["avg_seconds"], 2),
+    }
@@ -0,0 +1,147 @@
+"""
+schema_cache.py — Per-session cache of the schema context sent to the LLM.
+
+Each table's context (column profile, sample rows) is read once at
+ingest and kept with the table version it describes. A lookup only
+compares those versions with ``table_versions``, so questions skip the
+profiling scans and sample-row reads; uploads and appends replace the
+context of the table they changed.
+"""
+
+import threading
+from collections import OrderedDict
+
+from app.core.config import settings
+from app.core.database import (
+    get_column_profile,
+    get_table_versions,
+    save_column_profile,
+    session_db_path,
+)
+from app.ingestion.profiler import merge_profiles, profile_table
+from app.ingestion.schema_detector import quote_ident
+from app.nl2sql.answer_cache import invalidate_session
+
+# data session id → {table_name: (version, table context)}
+_cache: OrderedDict[str, dict[str, tuple[int, dict]]] = OrderedDict()
+_lock = threading.Lock()
+
+
+def build_table_context(conn, table_name: str, profile: dict | None = None) -> dict:
+    """
+    Read what the prompt and the schema linker need to know about one
+    table: its column profile (computed unless given) and a few sample rows.
+    """
+    profile = profile or profile_table(conn, table_name)
+    context = {
+        "table": table_name,
+        "columns": [(c["name"], c["type"]) for c in profile["columns"]],
+        "profile": profile,
+        "sample": conn.execute(f"SELECT * FROM {quote_ident(table_name)} LIMIT 3").fetchdf(),
+        # Values of low-cardinality text columns, matched against questions
+        "values": {
+            c["name"]: [str(v["value"])[:60] for v in c["top_values"]]
+            for c in profile["columns"]
+            if c["type"] == "VARCHAR" and c["top_values"]
+        },
+    }
+    context["block"] = render_table(context)
+    return context
+
+
+def _column_facts(profile: dict, shown: set[str]) -> str:
+    """Common values of category columns and the range of date columns."""
+    facts = []
+    for column in profile["columns"]:
+        if column["name"] not in shown:
+            continue
+        if column["role"] == "category" and column["type"] == "VARCHAR":
+            values = [str(v["value"])[:30] for v in column["top_values"]]
+            more = f" (+{len(values) - 5} more)" if len(values) > 5 else ""
+            facts.append(f"{column['name']}: {', '.join(values[:5])}{more}")
+        elif column["role"] == "date" and column["min"] is not None:
+            facts.append(f"{column['name']}: {column['min']} to {column['max']}")
+    return "; ".join(facts)
+
+
+def render_table(context: dict, columns: list[str] | None = None, sample: bool = True) -> str:
+    """
+    A table's block as shown in the prompt — optionally only some of its
+    columns, and without the sample rows.
+    """
+    shown = [(n, t) for n, t in context["columns"] if columns is None or n in columns]
+    cols_str = ", ".join([f"{name} ({dtype})" for name, dtype in shown])
+    block = f"Table: {context['table']}\n  Columns: {cols_str}"
+    facts = _column_facts(context["profile"], {name for name, _ in shown})
+    if facts:
+        block += f"\n  Values: {facts}"
+    if sample:
+        rows = context["sample"][[name for name, _ in shown]].to_string(index=False)
+        block += f"\n  Sample rows:\n{rows}"
+    return block
+
+
+def _store(data_session: str, table_name: str, version: int, context: dict):
+    with _lock:
+        entry = _cache.setdefault(data_session, {})
+        entry[table_name] = (version, context)
+        _cache.move_to_end(data_session)
+        while len(_cache) > settings.SCHEMA_CACHE_SESSIONS:
+            _cache.popitem(last=False)
+
+
+def refresh_table(session_id: str, conn, table_name: str, version: int, appended: str | None = None):
+    """
+    Profile and cache a table right after it was loaded or appended to; the
+    profile is also stored with the table version. After an append,
+    ``appended`` (a FROM expression over the new rows) is profiled and
+    merged into the previous version's profile instead of scanning the
+    whole table. Cached answers for the session's data are dropped.
+    """
+    profile = None
+    previous = get_column_profile(session_id, table_name, version - 1) if appended else None
+    if previous is not None:
+        profile = merge_profiles(previous, profile_table(conn, table_name, appended))
+    context = build_table_context(conn, table_name, profile)
+    save_column_profile(session_id, table_name, version, context["profile"])
+    _store(session_id, table_name, version, context)
+    invalidate_session(session_id)
+
+
+def get_table_contexts(session_id: str, conn) -> list[dict]:
+    """
+    Context of every table a session can query. Tables whose version is
+    unchanged come from the cache; the rest are read from ``conn`` and cached.
+    """
+    data_session = session_db_path(session_id).stem
+    versions = get_table_versions(data_session)
+    with _lock:
+        cached = dict(_cache.get(data_session, {}))
+
+    if versions:
+        tables = sorted(versions)
+    else:
+        # Sessions loaded before table versions were recorded
+        tables = [row[0] for row in conn.execute(
+            "SELECT table_name FROM information_schema.tables WHERE table_schema = 'main' ORDER BY table_name"
+        ).fetchall()]
+
+    contexts = []
+    for table_name in tables:
+        version = versions.get(table_name)
+        hit = cached.get(table_name)
+        if hit is not None and version is not None and hit[0] == version:
+            contexts.append(hit[1])
+            continue
+        if version is None:
+            contexts.append(build_table_context(conn, table_name))
+            continue
+        # Not in memory (e.g. after a restart) — the stored profile saves the scans
+        stored = get_column_profile(data_session, table_name, version)
+        context = build_table_context(conn, table_name, stored)
+        if stored is None:
+            save_column_profile(data_session, table_name, version, context["profile"])
+        _store(data_session, table_name, version, context)
+        contexts.append(context)
+    return contexts
+
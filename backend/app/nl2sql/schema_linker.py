@@ -0,0 +1,150 @@
+"""
+schema_linker.py — Pick the part of the schema a question is about.
+
+Tables and columns are scored against the question by name (including the
+abbreviations in ``COLUMN_ALIASES``) and by the distinct values stored for
+low-cardinality text columns. Only relevant tables are sent to the LLM,
+narrowed to their relevant columns when the full blocks would exceed
+``SCHEMA_TOKEN_BUDGET``. A schema that fits the budget is sent whole.
+"""
+
+import re
+from functools import lru_cache
+
+from app.core.config import settings
+from app.ingestion.schema_detector import COLUMN_ALIASES
+from app.nl2sql.schema_cache import render_table
+
+# full word → its abbreviations, e.g. "quantity" → {"qty"}
+_ABBREVIATIONS: dict[str, set[str]] = {}
+for _short, _full in COLUMN_ALIASES.items():
+    _ABBREVIATIONS.setdefault(_full, set()).add(_short)
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (≈ 4 characters per token for English and SQL)."""
+    return len(text) // 4 + 1
+
+
+def _stem(word: str) -> str:
+    """Singular form for plain English plurals (categories → category, sales → sale)."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+@lru_cache(maxsize=4096)
+def name_terms(name: str) -> frozenset[str]:
+    """Terms of a table or column name (cached — names repeat across questions)."""
+    return frozenset(_terms(name))
+
+
+def _terms(text: str) -> set[str]:
+    """Stemmed words of ``text``, plus alias expansions and abbreviations."""
+    terms = set()
+    for word in _WORD_RE.findall(text.lower()):
+        for variant in {word, COLUMN_ALIASES.get(word, word)}:
+            for part in variant.split("_"):
+                terms.add(_stem(part))
+                terms.update(_ABBREVIATIONS.get(part, ()))
+    return terms
+
+
+def _mentions(text: str, value: str) -> bool:
+    return re.search(rf"(?<![a-z0-9]){re.escape(value.lower())}(?![a-z0-9])", text) is not None
+
+
+def _score_table(question: str, words: set[str], context: dict, weight: dict[str, float]) -> tuple[float, dict[str, float]]:
+    """
+    Relevance of a table and of each of its columns to the question. Name
+    terms are weighted by rarity, so "metric_7" beats the other "metric_*"
+    columns; columns far below the table's best match are dropped.
+    """
+    name_scores, value_hits = {}, set()
+    for name, _dtype in context["columns"]:
+        parts = name_terms(name)
+        matched = parts & words
+        if matched:
+            name_scores[name] = 2.0 * sum(weight[t] for t in matched) / len(parts)
+        values = context["values"].get(name, ())
+        if any(_mentions(question, v) for v in values if len(v) >= 2):
+            value_hits.add(name)
+    best = max(name_scores.values(), default=0.0)
+    column_scores = {n: sc for n, sc in name_scores.items() if sc >= best / 2}
+    for name in value_hits:
+        column_scores[name] = column_scores.get(name, 0.0) + 3.0
+    table_score = 3.0 * len(name_terms(context["table"]) & words) + sum(column_scores.values())
+    return table_score, column_scores
+
+
+def _always_kept(context: dict) -> set[str]:
+    """Columns kept in narrowed blocks anyway: dates (for time filters) and ids (for joins)."""
+    return {c["name"] for c in context["profile"]["columns"] if c["role"] in ("date", "id")}
+
+
+def link_schema(question: str, contexts: list[dict], history: list | None = None, budget: int | None = None) -> str:
+    """
+    Schema text for ``question`` that fits within ``budget`` tokens.
+
+    If the whole schema fits, it is returned unchanged: the prompt prefix
+    then stays identical across a session's questions and Ollama can reuse
+    its cached prefill (see ``prompt_builder``). The last user turn of
+    ``history`` counts towards relevance, so follow-ups ("and by region?")
+    keep their tables. When nothing matches all tables are candidates.
+    Blocks are tried in decreasing detail — full tables, then relevant
+    columns with sample rows, then without — and the most relevant tables
+    that fit are kept (always at least one).
+    """
+    budget = budget or settings.SCHEMA_TOKEN_BUDGET
+    full = "\n\n".join(c["block"] for c in contexts)
+    if estimate_tokens(full) <= budget:
+        return full
+
+    text = question.lower()
+    previous = [m["content"] for m in (history or []) if m["role"] == "user"][-1:]
+    words = _terms(" ".join([question, *previous]))
+
+    # Term weight: 1 / number of columns (across all tables) whose name has it
+    counts: dict[str, int] = {}
+    for context in contexts:
+        for name, _dtype in context["columns"]:
+            for term in name_terms(name) & words:
+                counts[term] = counts.get(term, 0) + 1
+    weight = {term: 1.0 / n for term, n in counts.items()}
+
+    scored = []
+    for context in contexts:
+        table_score, column_scores = _score_table(text, words, context, weight)
+        scored.append((table_score, context, column_scores))
+    relevant = [s for s in scored if s[0] > 0] or scored
+    relevant.sort(key=lambda s: -s[0])
+
+    def narrowed(context: dict, column_scores: dict, sample: bool) -> str:
+        keep = set(column_scores) | _always_kept(context)
+        if not keep:
+            keep = {n for n, _ in context["columns"]}
+        return render_table(context, columns=keep, sample=sample)
+
+    tiers = [
+        [c["block"] for _, c, _ in relevant],
+        [narrowed(c, cs, True) for _, c, cs in relevant],
+        [narrowed(c, cs, False) for _, c, cs in relevant],
+    ]
+    for blocks in tiers:
+        text = "\n\n".join(blocks)
+        if estimate_tokens(text) <= budget:
+            return text
+
+    # Even the narrowest blocks are too big — keep the best tables that fit
+    kept, used = [], 0
+    for block in tiers[-1]:
+        cost = estimate_tokens(block)
+        if kept and used + cost > budget:
+            break
+        kept.append(block)
+        used += cost
+    return "\n\n".join(kept)
@@ -1,4 +1,7 @@
 import re
+from functools import cache
+
+import duckdb
 
 
 FORBIDDEN_KEYWORDS = [
@@ -24,6 +27,59 @@ def extract_sql(llm_response: str) -> str:
     return llm_response.strip()
 
 
+_CLOSED_FENCE_RE = re.compile(r"```(?:sql)?\s*.*?```", re.DOTALL)
+_OPEN_FENCE_RE = re.compile(r"```(?:sql)?\s*")
+_STATEMENT_START_RE = re.compile(r"^[ \t]*(SELECT|WITH)\b", re.IGNORECASE | re.MULTILINE)
+# A finished word on the first line after a blank line
+_AFTER_BLANK_RE = re.compile(r"\n[ \t]*\n\s*([A-Za-z_]+)[^A-Za-z_]")
+
+
+@cache
+def _keywords() -> frozenset[str]:
+    """Every DuckDB keyword — any of them might continue the statement."""
+    with duckdb.connect() as conn:
+        rows = conn.execute("SELECT keyword_name FROM duckdb_keywords()").fetchall()
+    return frozenset(row[0].upper() for row in rows)
+
+
+def _parses(sql: str) -> bool:
+    try:
+        return len(duckdb.extract_statements(sql)) == 1
+    except duckdb.Error:
+        return False
+
+
+def complete_statement_end(text: str) -> int | None:
+    """
+    Where the first complete SQL statement of a partial LLM response ends
+    (an index into ``text``), or None while it is still being written.
+    Complete means a closed code fence, a semicolon after a statement
+    DuckDB can parse, or a parseable statement followed by a blank line
+    and a word that is not a DuckDB keyword (the start of an explanation,
+    not "NATURAL JOIN" or "BETWEEN").
+    """
+    fence = _CLOSED_FENCE_RE.search(text)
+    if fence:
+        return fence.end()
+
+    opened = _OPEN_FENCE_RE.search(text)
+    start = _STATEMENT_START_RE.search(text, opened.end() if opened else 0)
+    if not start:
+        return None
+    start = start.start(1)
+
+    semicolon = text.find(";", start)
+    while semicolon != -1:
+        if _parses(text[start:semicolon + 1]):
+            return semicolon + 1
+        semicolon = text.find(";", semicolon + 1)
+
+    blank = _AFTER_BLANK_RE.search(text, start)
+    if blank and blank.group(1).upper() not in _keywords() and _parses(text[start:blank.start()]):
+        return blank.start()
+    return None
+
+
 def is_safe_sql(sql: str) -> bool:
     """Check that SQL is a safe, read-only SELECT query."""
     stripped = sql.strip()
@@ -1,61 +1,217 @@
-import pandas as pd
+import math
 
+from app.core.config import settings
+from app.ingestion.profiler import is_numeric_type, is_temporal_type
+from app.ingestion.schema_detector import quote_ident
 
-def detect_anomalies(df: pd.DataFrame, table_name: str) -> list[dict]:
-    """Proactively detect anomalies in uploaded data."""
+# Approximate mode: rank error assumed for t-digest quartiles
+_QUANTILE_RANK_ERROR = 0.01
+
+
+def _fences(q1: float, q3: float) -> tuple[float, float]:
+    iqr = q3 - q1
+    return q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+
+def _outside(col: str, lower: float, upper: float) -> str:
+    return f"count_if({col} < {lower!r} OR {col} > {upper!r})"
+
+
+def _bound(low: float, high: float, method: str) -> dict:
+    return {"min": max(0, math.floor(low)), "max": math.ceil(high), "method": method}
+
+
+def _bucket_unit(first, last) -> str:
+    """Day, week or month buckets depending on how much time the column spans."""
+    span = (last - first).days
+    if span <= 92:
+        return "day"
+    if span <= 731:
+        return "week"
+    return "month"
+
+
+def _bucket_changes(conn, source: str, date_col: str, numeric: list[str], first, last) -> tuple[str, list]:
+    """
+    Sum numeric columns per time bucket of ``date_col`` and compare each
+    complete bucket with the previous one. Returns the bucket unit and, per
+    column, ``(changed, compared, [first few changed bucket starts])``.
+    """
+    unit = _bucket_unit(first, last)
+    date_ref = quote_ident(date_col)
+    sums = ", ".join(f"sum({quote_ident(c)}) AS v{i}" for i, c in enumerate(numeric))
+    lagged = ", ".join(f"v{i}, lag(v{i} IGNORE NULLS) OVER (ORDER BY bucket) AS p{i}" for i in range(len(numeric)))
+    # Same rule as pandas pct_change(): a change away from 0 is infinite,
+    # 0 → 0 is not a change
+    flags = [
+        f"CASE WHEN p{i} = 0 THEN v{i} <> 0 ELSE abs((v{i} - p{i}) / p{i}) > 0.5 END"
+        for i in range(len(numeric))
+    ]
+    stats = ", ".join(
+        f"count_if({flag}), count(p{i}), list(bucket ORDER BY bucket) FILTER (WHERE {flag})"
+        for i, flag in enumerate(flags)
+    )
+    # Buckets cut off by the start or end of the data would look like
+    # sudden drops, so only buckets fully inside the data's span are used
+    row = conn.execute(
+        f"""
+        WITH buckets AS (
+            SELECT date_trunc('{unit}', {date_ref})::DATE AS bucket, {sums}
+            FROM {source} WHERE {date_ref} IS NOT NULL GROUP BY bucket
+        ), complete AS (
+            SELECT * FROM buckets
+            WHERE bucket >= date_trunc('day', ?::TIMESTAMP)
+              AND bucket + INTERVAL 1 {unit} <= date_trunc('day', ?::TIMESTAMP) + INTERVAL 1 DAY
+        )
+        SELECT {stats} FROM (SELECT bucket, {lagged} FROM complete)
+        """,
+        [first, last],
+    ).fetchone()
+    return unit, [row[i:i + 3] for i in range(0, len(row), 3)]
+
+
+def detect_anomalies(conn, table_name: str, source: str | None = None, profile: dict | None = None) -> list[dict]:
+    """
+    Proactively detect anomalies in uploaded data.
+
+    Runs entirely inside DuckDB: one aggregate scan for null counts,
+    quartiles and date ranges, one for outlier and duplicate counts, and one
+    grouped scan per date column for sudden changes between day/week/month
+    totals — so tables larger than memory work and all cores are used.
+    ``source`` overrides the FROM expression (e.g. a staging table) while
+    messages still name ``table_name``. With the table's column ``profile``,
+    columns it marks as identifiers or years are left out of the totals.
+
+    Above ``ANOMALY_APPROX_ROW_THRESHOLD`` rows the statistics are
+    approximate and every entry carries ``approximate: True`` plus an
+    ``error_bound`` giving the likely range of the reported count (exact
+    checks report a zero-width range).
+    """
+    source = source or quote_ident(table_name)
     anomalies = []
 
-    # Check for missing values
-    null_counts = df.isnull().sum()
-    for col, count in null_counts.items():
+    described = conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()
+    columns = [row[0] for row in described]
+    numeric = [row[0] for row in described if is_numeric_type(row[1])]
+    date_cols = [row[0] for row in described if is_temporal_type(row[1])]
+
+    total = conn.execute(f"SELECT count(*) FROM {source}").fetchone()[0]
+    if total == 0:
+        return anomalies
+    approximate = total > settings.ANOMALY_APPROX_ROW_THRESHOLD
+
+    def add(entry: dict, bound: dict | None = None):
+        if approximate:
+            entry["approximate"] = True
+            entry["error_bound"] = bound
+        anomalies.append(entry)
+
+    # Pass 1: per-column non-null counts, quartiles, date ranges. Approximate mode
+    # also fetches the quantiles ±rank error so the outlier fences — and
+    # hence the outlier counts — can be given a range.
+    # quantiles of DECIMAL columns come back as Decimal, which doesn't mix
+    # with the float fence arithmetic below, so every column is read as DOUBLE
+    if approximate:
+        eps = _QUANTILE_RANK_ERROR
+        probs = [0.25 - eps, 0.25, 0.25 + eps, 0.75 - eps, 0.75, 0.75 + eps]
+        quantile = f"approx_quantile({{}}::DOUBLE, {probs})"
+    else:
+        quantile = "quantile_cont({}::DOUBLE, [0.25, 0.75])"
+    select = [f"count({quote_ident(c)})" for c in columns]
+    select += [quantile.format(quote_ident(c)) for c in numeric]
+    select += [f"min({quote_ident(c)}), max({quote_ident(c)})" for c in date_cols]
+    stats = conn.execute(f"SELECT {', '.join(select)} FROM {source}").fetchone()
+    non_null = dict(zip(columns, stats[:len(columns)]))
+    quartiles = dict(zip(numeric, stats[len(columns):len(columns) + len(numeric)]))
+    ranges = stats[len(columns) + len(numeric):]
+    date_ranges = {c: ranges[2 * i:2 * i + 2] for i, c in enumerate(date_cols)}
+
+    # Check for missing values (counts are exact in both modes)
+    for col in columns:
+        count = total - non_null[col]
         if count > 0:
-            pct = round(count / len(df) * 100, 1)
+            pct = round(count / total * 100, 1)
             if pct > 20:
-                anomalies.append({
+                add({
                     "type": "missing_data",
                     "severity": "high" if pct > 50 else "medium",
-                    "message": f"Column '{col}' has {pct}% missing values ({count}/{len(df)} rows)",
-                })
-
-    # Check numeric columns for outliers (IQR method)
-    for col in df.select_dtypes(include=["number"]).columns:
-        q1 = df[col].quantile(0.25)
-        q3 = df[col].quantile(0.75)
-        iqr = q3 - q1
-        if iqr == 0:
+                    "message": f"Column '{col}' has {pct}% missing values ({count}/{total} rows)",
+                }, _bound(count, count, "exact"))
+
+    # Pass 2: outliers (IQR method) and duplicate rows
+    bounds = {}
+    for col in numeric:
+        if not quartiles[col]:
+            continue
+        if approximate:
+            q1_lo, q1, q1_hi, q3_lo, q3, q3_hi = quartiles[col]
+            # Widest fences flag the fewest outliers, narrowest the most
+            wide = (2.5 * q1_lo - 1.5 * q3_hi, 2.5 * q3_hi - 1.5 * q1_lo)
+            narrow = (2.5 * q1_hi - 1.5 * q3_lo, 2.5 * q3_lo - 1.5 * q1_hi)
+        else:
+            q1, q3 = quartiles[col]
+        if q3 - q1 == 0:
             continue
-        lower = q1 - 1.5 * iqr
-        upper = q3 + 1.5 * iqr
-        outlier_count = ((df[col] < lower) | (df[col] > upper)).sum()
+        bounds[col] = (_fences(q1, q3), (wide, narrow) if approximate else None)
+
+    select = []
+    for col, ((lower, upper), spread) in bounds.items():
+        select.append(_outside(quote_ident(col), lower, upper))
+        if spread:
+            select += [_outside(quote_ident(col), *fences) for fences in spread]
+    if approximate:
+        # Distinct 64-bit row hashes: exact barring hash collisions, without
+        # holding every distinct row for SELECT DISTINCT *
+        select.append("count(DISTINCT hash(_t))")
+    else:
+        select.append(f"(SELECT count(*) FROM (SELECT DISTINCT * FROM {source}))")
+    counts = list(conn.execute(f"SELECT {', '.join(select)} FROM {source} AS _t").fetchone())
+    distinct = counts.pop()
+
+    per_col = 3 if approximate else 1
+    for i, (col, ((lower, upper), _)) in enumerate(bounds.items()):
+        outlier_count, *spread = counts[i * per_col:(i + 1) * per_col]
         if outlier_count > 0:
-            anomalies.append({
+            add({
                 "type": "outlier",
                 "severity": "medium",
                 "message": f"Column '{col}' has {outlier_count} outlier values (outside {lower:.1f} - {upper:.1f})",
-            })
+            }, _bound(*spread, "t-digest quartiles") if spread else None)
 
     # Check for duplicate rows
-    dup_count = df.duplicated().sum()
+    dup_count = total - distinct
     if dup_count > 0:
-        anomalies.append({
+        add({
             "type": "duplicates",
             "severity": "low",
             "message": f"Found {dup_count} duplicate rows in '{table_name}'",
-        })
-
-    # Check for sudden changes in date-sorted numeric columns
-    date_cols = df.select_dtypes(include=["datetime64"]).columns
-    if len(date_cols) > 0:
-        date_col = date_cols[0]
-        sorted_df = df.sort_values(date_col)
-        for col in df.select_dtypes(include=["number"]).columns:
-            pct_change = sorted_df[col].pct_change().abs()
-            big_changes = pct_change[pct_change > 0.5]
-            if len(big_changes) > 0:
-                anomalies.append({
-                    "type": "sudden_change",
-                    "severity": "high",
-                    "message": f"Column '{col}' has {len(big_changes)} sudden changes (>50%) over time",
-                })
+        }, _bound(dup_count, dup_count, "row hash"))
+
+    # Check for sudden changes: for every date column, the totals of each
+    # numeric column per day/week/month are compared bucket to bucket.
+    # Totals of identifiers and years mean nothing, so those are skipped.
+    roles = {c["name"]: c["role"] for c in profile["columns"]} if profile else {}
+    summed = [c for c in numeric if roles.get(c) not in ("id", "date")]
+    adjective = {"day": "daily", "week": "weekly", "month": "monthly"}
+    for date_col in date_cols if summed else []:
+        first, last = date_ranges[date_col]
+        if first is None:
+            continue
+        unit, results = _bucket_changes(conn, source, date_col, summed, first, last)
+        for col, (changed, compared, periods) in zip(summed, results):
+            if changed == 0:
+                continue
+            periods = [str(p) for p in periods]
+            add({
+                "type": "sudden_change",
+                "severity": "high",
+                "message": (
+                    f"Column '{col}' {adjective[unit]} total changes by more than 50% "
+                    f"in {changed} of {compared} {unit}s by '{date_col}' (e.g. {unit} of {', '.join(periods[:3])})"
+                ),
+                "date_column": date_col,
+                "bucket": unit,
+                "periods": periods[:10],
+            }, _bound(changed, changed, "exact"))
 
     return anomalies
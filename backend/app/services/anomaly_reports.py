@@ -0,0 +1,56 @@
+"""
+anomaly_reports.py — Deferred anomaly detection.
+
+Uploads and appends return as soon as their data is queryable; anomaly
+detection is then queued on the low-priority background pool (never the
+ingest pool uploads wait on) and its result persisted per session/table
+version (``anomaly_reports`` in SQLite), where the
+``/api/upload/anomalies`` endpoints read it.
+"""
+
+from app.core.database import get_column_profile, get_user_duckdb, save_anomaly_report
+from app.ingestion.profiler import profile_table
+from app.ingestion.schema_detector import quote_ident
+from app.ingestion.streaming import submit_background
+from app.services.anomaly_detector import detect_anomalies
+
+# Appended rows wait here (outside the 'main' schema the NL2SQL prompt
+# lists) until their deferred scan has run
+PENDING_SCHEMA = "_pending_anomalies"
+
+
+def pending_table(table_name: str, version: int) -> str:
+    """Qualified name of the table holding rows appended in ``version``."""
+    return f"{PENDING_SCHEMA}.{quote_ident(f'{table_name}_v{version}')}"
+
+
+def schedule_anomaly_scan(session_id: str, table_name: str, version: int, source: str | None = None):
+    """
+    Record a pending report for a table version and queue its scan.
+
+    ``source`` names a table under ``PENDING_SCHEMA`` holding only the rows
+    to scan (appends); it is dropped once the scan has run.
+    """
+    scope = "appended_rows" if source else "table"
+    save_anomaly_report(session_id, table_name, version, "pending", scope=scope)
+    submit_background(_run_scan, session_id, table_name, version, source)
+
+
+def _run_scan(session_id: str, table_name: str, version: int, source: str | None):
+    """Blocking scan body — runs on the background pool."""
+    scope = "appended_rows" if source else "table"
+    try:
+        conn = get_user_duckdb(session_id)
+        try:
+            # Stored at ingest for this version; profiled here only if missing
+            profile = get_column_profile(session_id, table_name, version) or profile_table(conn, table_name)
+            anomalies = detect_anomalies(conn, table_name, source=source, profile=profile)
+        finally:
+            if source:
+                conn.execute(f"DROP TABLE IF EXISTS {source}")
+            conn.close()
+    except Exception as e:
+        save_anomaly_report(session_id, table_name, version, "error", scope=scope, error=str(e))
+        return
+    save_anomaly_report(session_id, table_name, version, "done", scope=scope, anomalies=anomalies)
+
@@ -0,0 +1,83 @@
+"""
+ingest_jobs.py — In-memory registry of background ingestion jobs.
+
+A job is created once the upload body is on disk; ``run_ingest_job`` then
+executes ``process_upload`` on the ingest pool and records progress
+(stage, bytes read, rows loaded) that the job-status and SSE endpoints read.
+"""
+
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from app.core.config import settings
+from app.services.ingest_service import process_upload
+
+# Stages run queued → loading → converting → done (or error)
+FINISHED = {"done", "error"}
+
+_jobs: dict[str, dict] = {}
+_lock = threading.Lock()
+
+
+def _prune_finished():
+    """Forget finished jobs older than INGEST_JOB_RETENTION_MINUTES."""
+    cutoff = time.time() - settings.INGEST_JOB_RETENTION_MINUTES * 60
+    for job_id in [j for j, job in _jobs.items() if job["stage"] in FINISHED and job["updated_at"] < cutoff]:
+        del _jobs[job_id]
+
+
+def create_job(owner: str, filename: str, session_id: str, bytes_read: int) -> dict:
+    """Register a queued job for a received upload and return a snapshot of it."""
+    now = time.time()
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "owner": owner,
+        "filename": filename,
+        "session_id": session_id,
+        "stage": "queued",
+        "bytes_read": bytes_read,
+        "rows_loaded": 0,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "revision": 0,
+    }
+    with _lock:
+        _prune_finished()
+        _jobs[job["job_id"]] = job
+        return dict(job)
+
+
+def update_job(job_id: str, **fields):
+    """Merge progress fields into a job and bump its revision."""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        job["updated_at"] = time.time()
+        job["revision"] += 1
+
+
+def get_job(job_id: str) -> dict | None:
+    """Return a snapshot of a job, or None if unknown/expired."""
+    with _lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def run_ingest_job(job_id: str, file_path: Path, filename: str, session_id: str, content_hash: str | None = None):
+    """Blocking job body — submit it to the ingest pool."""
+
+    def progress(**fields):
+        update_job(job_id, **fields)
+
+    try:
+        result = process_upload(file_path, filename, session_id, progress=progress, content_hash=content_hash)
+    except Exception as e:
+        update_job(job_id, stage="error", error=f"Failed to process file: {str(e)}")
+        return
+    update_job(job_id, stage="done", rows_loaded=result["rows"], result=result)
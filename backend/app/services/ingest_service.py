@@ -0,0 +1,411 @@
+import logging
+import os
+import re
+import threading
+import uuid
+from pathlib import Path
+from typing import Callable
+
+import duckdb
+
+from app.core.config import settings
+from app.core.database import (
+    backs_upload_cache,
+    bump_table_version,
+    delete_cached_upload,
+    get_cached_upload,
+    get_user_duckdb,
+    link_session,
+    move_session_references,
+    session_db_path,
+    sessions_linked_to,
+    store_cached_upload,
+    unlink_session,
+)
+from app.ingestion import parquet_store
+from app.ingestion.file_parser import describe_table, ingest_file, list_sheets
+from app.ingestion.schema_detector import quote_ident
+from app.ingestion.streaming import get_batch_pool, submit_background
+from app.nl2sql import schema_cache
+from app.services.anomaly_reports import PENDING_SCHEMA, pending_table, schedule_anomaly_scan
+
+logger = logging.getLogger("datawhisper")
+
+
+def table_name_from_filename(filename: str) -> str:
+    """Build a safe SQL identifier from an uploaded file's name."""
+    raw = Path(filename).stem.lower()
+    table_name = re.sub(r"[^a-z0-9_]", "_", raw)
+    table_name = re.sub(r"_+", "_", table_name).strip("_")
+    if not table_name or table_name[0].isdigit():
+        table_name = "t_" + (table_name or "data")
+    return table_name
+
+
+def reuse_cached_upload(content_hash: str, filename: str, session_id: str) -> dict | None:
+    """
+    If a file with this hash was ingested before under a name giving the
+    same table, link ``session_id`` to the session holding that data and
+    return its payload — no re-ingest needed. The same bytes under another
+    name are loaded again, so the table carries the name the user expects.
+    """
+    table_name = table_name_from_filename(filename)
+    cached = get_cached_upload(content_hash, table_name)
+    if cached is None:
+        return None
+    source_session, payload = cached
+    if not (settings.DATABASE_DIR / f"{source_session}.duckdb").exists():
+        delete_cached_upload(content_hash, table_name)
+        return None
+    link_session(session_id, source_session)
+    return {**payload, "session_id": session_id, "deduplicated": True}
+
+
+def process_upload(
+    file_path: Path,
+    filename: str,
+    session_id: str,
+    progress: Callable[..., None] | None = None,
+    content_hash: str | None = None,
+) -> dict:
+    """
+    Load a saved upload into the session's DuckDB and queue anomaly detection.
+
+    Returns once the table is queryable; the Parquet copy and the anomaly
+    report for the new version are written afterwards.
+    Blocking — call it through the ingest pool from async code.
+    ``progress(**fields)`` is called as stages change (see ``ingest_jobs``).
+    With ``content_hash`` the result is stored for ``reuse_cached_upload``.
+    Returns the upload response payload.
+    """
+    report = progress or (lambda **_: None)
+    table_name = table_name_from_filename(filename)
+
+    report(stage="loading")
+    conn = get_user_duckdb(session_id)
+    try:
+        info = ingest_file(conn, file_path, table_name)
+        report(stage="converting", rows_loaded=info["rows"])
+        version = bump_table_version(session_id, table_name, info["rows"])
+        schema_cache.refresh_table(session_id, conn, table_name, version)
+    finally:
+        conn.close()
+    schedule_parquet_copy(session_id, [table_name], [file_path])
+    schedule_anomaly_scan(session_id, table_name, version)
+
+    payload = {
+        "session_id": session_id,
+        "table_name": table_name,
+        "rows": info["rows"],
+        "columns": info["columns"],
+        "dtypes": info["dtypes"],
+        "inference": info["inference"],
+        "version": version,
+        "message": f"Loaded {info['rows']} rows into table '{table_name}'",
+    }
+    if content_hash:
+        store_cached_upload(content_hash, table_name, session_id, payload)
+    return payload
+
+
+# ── Batch (multi-file / multi-sheet) ingestion ────────────────────────────────
+
+def _stage_table(file_path: str, sheet_name: str | None, table_name: str, staging_path: str, threads: int) -> dict:
+    """
+    Worker-process body: load one file/sheet into its own staging DuckDB file.
+
+    Each worker writes a separate database, so loads never contend for the
+    session database's single writer.
+    """
+    conn = duckdb.connect(staging_path)
+    try:
+        conn.execute(f"SET threads TO {threads}")
+        return ingest_file(conn, Path(file_path), table_name, sheet_name=sheet_name)
+    finally:
+        conn.close()
+
+
+def _unique_name(name: str, taken: set[str]) -> str:
+    candidate, n = name, 2
+    while candidate in taken:
+        candidate, n = f"{name}_{n}", n + 1
+    taken.add(candidate)
+    return candidate
+
+
+def process_batch_upload(files: list[tuple[Path, str]], session_id: str) -> dict:
+    """
+    Load several uploads (every sheet of every workbook) into one session.
+
+    ``files`` is ``[(saved_path, original_filename), ...]``. Each file/sheet
+    becomes its own table; they are loaded concurrently on the batch process
+    pool into staging databases and then copied into the session database.
+    Blocking — call it through the ingest pool from async code.
+    """
+    units, taken = [], set()
+    for file_path, filename in files:
+        sheets = list_sheets(file_path)
+        for sheet in sheets:
+            base = table_name_from_filename(filename)
+            if sheet is not None and len(sheets) > 1:
+                base = table_name_from_filename(f"{base}_{sheet}")
+            units.append({"path": file_path, "filename": filename, "sheet": sheet, "table_name": _unique_name(base, taken)})
+
+    staging_dir = settings.DATABASE_DIR / "staging"
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    pool = get_batch_pool()
+    threads = max(1, (os.cpu_count() or 1) // max(1, min(len(units), settings.BATCH_INGEST_PROCESSES)))
+    for i, unit in enumerate(units):
+        unit["staging"] = staging_dir / f"{session_id}_{i}.duckdb"
+        unit["future"] = pool.submit(
+            _stage_table, str(unit["path"]), unit["sheet"], unit["table_name"], str(unit["staging"]), threads,
+        )
+
+    tables = []
+    conn = get_user_duckdb(session_id)
+    try:
+        for unit in units:
+            source = unit["filename"] + (f" [{unit['sheet']}]" if unit["sheet"] is not None else "")
+            try:
+                info = unit["future"].result()
+            except Exception as e:
+                raise ValueError(f"{source}: {e}") from e
+            table = quote_ident(unit["table_name"])
+            staging = str(unit["staging"]).replace("'", "''")
+            conn.execute(f"ATTACH '{staging}' AS staging (READ_ONLY)")
+            try:
+                conn.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM staging.{table}")
+            finally:
+                conn.execute("DETACH staging")
+            version = bump_table_version(session_id, unit["table_name"], info["rows"])
+            schema_cache.refresh_table(session_id, conn, unit["table_name"], version)
+            tables.append({
+                "table_name": unit["table_name"],
+                "source": source,
+                "rows": info["rows"],
+                "columns": info["columns"],
+                "dtypes": info["dtypes"],
+                "inference": info["inference"],
+                "version": version,
+            })
+    finally:
+        conn.close()
+        for unit in units:
+            unit["future"].cancel()
+            try:
+                unit["future"].result()
+            except Exception:
+                pass
+            unit["staging"].unlink(missing_ok=True)
+            unit["staging"].with_suffix(".duckdb.wal").unlink(missing_ok=True)
+    schedule_parquet_copy(session_id, [t["table_name"] for t in tables], [f for f, _ in files])
+    for table in tables:
+        schedule_anomaly_scan(session_id, table["table_name"], table["version"])
+
+    total = sum(t["rows"] for t in tables)
+    return {
+        "session_id": session_id,
+        "tables": tables,
+        "rows": total,
+        "message": f"Loaded {total} rows into {len(tables)} table(s)",
+    }
+
+
+# ── Session writes ────────────────────────────────────────────────────────────
+
+_session_locks: dict[str, threading.RLock] = {}
+_session_locks_guard = threading.Lock()
+
+
+def _session_lock(session_id: str) -> threading.RLock:
+    """
+    Serializes writes to a session's data: appends (which share the staging
+    table and the numbering of Parquet parts), the deferred Parquet copy
+    and copy-on-write clones of the session.
+    """
+    with _session_locks_guard:
+        return _session_locks.setdefault(session_id, threading.RLock())
+
+
+def schedule_parquet_copy(session_id: str, table_names: list[str], raw_files: list[Path]):
+    """
+    Queue the canonical Parquet copy of freshly loaded tables on the
+    background pool, so uploads return as soon as DuckDB holds the data.
+    The raw uploads are only discarded once the copy has been written.
+    """
+    if settings.PARQUET_ENABLED:
+        submit_background(_write_parquet_copy, session_id, table_names, raw_files)
+
+
+def _write_parquet_copy(session_id: str, table_names: list[str], raw_files: list[Path]):
+    """Blocking body of ``schedule_parquet_copy`` — runs on the background pool."""
+    with _session_lock(session_id):
+        # The session may have been deleted while this waited in the queue
+        if not (settings.DATABASE_DIR / f"{session_id}.duckdb").exists():
+            return
+        try:
+            conn = get_user_duckdb(session_id)
+            try:
+                for table_name in table_names:
+                    parquet_store.materialize(conn, session_id, table_name)
+            finally:
+                conn.close()
+        except Exception:
+            logger.exception("Parquet copy failed for session %s; raw uploads kept", session_id)
+            return
+    for file_path in raw_files:
+        parquet_store.delete_raw_upload(file_path)
+
+
+# ── Append (incremental) ingestion ────────────────────────────────────────────
+
+_APPEND_STAGING = "_append_staging"
+
+
+def _detach_shared_data(session_id: str):
+    """
+    Copy-on-write before a session's data is modified.
+
+    A dedup-linked session gets its own copy of the DuckDB file. A session
+    whose file others link to (or that backs an upload-cache entry) keeps
+    it, while a frozen copy takes over those references — so neither
+    sharers nor the content-hash cache see the appended rows.
+    """
+    own_path = settings.DATABASE_DIR / f"{session_id}.duckdb"
+    shared_path = session_db_path(session_id)
+    if shared_path != own_path:
+        _clone_session_data(shared_path.stem, session_id)
+        unlink_session(session_id)
+        return
+
+    if sessions_linked_to(session_id) or backs_upload_cache(session_id):
+        frozen_id = str(uuid.uuid4())
+        _clone_session_data(session_id, frozen_id)
+        move_session_references(session_id, frozen_id)
+
+
+def _clone_session_data(source_session_id: str, target_session_id: str):
+    """
+    Copy a session's DuckDB data and Parquet parts to a new session id.
+
+    The copy goes through the source database (the same instance any open
+    chat or scan connection uses), so rows still in its WAL are included —
+    copying the .duckdb file alone would miss them. Holding the source's
+    session lock keeps a deferred Parquet copy from being cloned half-written.
+    """
+    with _session_lock(source_session_id):
+        target_path = str(settings.DATABASE_DIR / f"{target_session_id}.duckdb").replace("'", "''")
+        source = get_user_duckdb(source_session_id)
+        try:
+            catalog = source.execute("SELECT current_database()").fetchone()[0]
+            source.execute(f"ATTACH '{target_path}' AS _clone")
+            try:
+                source.execute(f"COPY FROM DATABASE {quote_ident(catalog)} TO _clone")
+            finally:
+                source.execute("DETACH _clone")
+        finally:
+            source.close()
+        conn = get_user_duckdb(target_session_id)
+        try:
+            parquet_store.clone(conn, source_session_id, target_session_id)
+        finally:
+            conn.close()
+
+
+def _check_append_compatible(conn, table_name: str) -> list[tuple[str, str]]:
+    """
+    Validate the staged rows against the stored table.
+
+    Every staged column must exist in the table, and every non-null staged
+    value must cast to the stored type. Returns all stored ``(column, type)``
+    pairs; raises ValueError describing any mismatch.
+    """
+    stored = {row[0]: row[1] for row in conn.execute(f"DESCRIBE {quote_ident(table_name)}").fetchall()}
+    staged = {row[0]: row[1] for row in conn.execute(f"DESCRIBE {_APPEND_STAGING}").fetchall()}
+
+    unknown = [c for c in staged if c not in stored]
+    if unknown:
+        raise ValueError(f"Columns not in table '{table_name}': {', '.join(unknown)}")
+
+    retyped = [c for c in staged if staged[c] != stored[c]]
+    if retyped:
+        checks = ", ".join(
+            f"count({quote_ident(c)}) - count(TRY_CAST({quote_ident(c)} AS {stored[c]}))" for c in retyped
+        )
+        failures = conn.execute(f"SELECT {checks} FROM {_APPEND_STAGING}").fetchone()
+        bad = [f"{c} ({staged[c]} → {stored[c]}: {n} values)" for c, n in zip(retyped, failures) if n]
+        if bad:
+            raise ValueError(f"Incompatible column types: {'; '.join(bad)}")
+
+    return list(stored.items())
+
+
+def append_upload(file_path: Path, filename: str, session_id: str, table_name: str) -> dict:
+    """
+    Append a saved upload's rows to an existing table of a session.
+
+    The file is staged with the normal ingest path (same cleaning and
+    inference), checked against the stored column types, then inserted in
+    one transaction; appends to the same session run one after another.
+    Only the new rows are scanned for anomalies, after this returns: they
+    are kept in ``PENDING_SCHEMA`` until then.
+    Blocking — call it through the ingest pool from async code.
+    """
+    if not session_db_path(session_id).exists():
+        raise FileNotFoundError(f"Session '{session_id}' not found. Please upload data first.")
+    with _session_lock(session_id):
+        _detach_shared_data(session_id)
+
+        conn = get_user_duckdb(session_id)
+        try:
+            exists = conn.execute(
+                "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = 'main' AND table_name = ?",
+                [table_name],
+            ).fetchone()[0]
+            if not exists:
+                raise LookupError(f"Table '{table_name}' not found in this session")
+
+            staged = ingest_file(conn, file_path, _APPEND_STAGING)
+            try:
+                columns = _check_append_compatible(conn, table_name)
+                staged_cols = set(staged["columns"])
+                # Columns missing from the file are appended as NULL
+                values = ", ".join(
+                    f"CAST({quote_ident(c) if c in staged_cols else 'NULL'} AS {dtype}) AS {quote_ident(c)}"
+                    for c, dtype in columns
+                )
+                select_sql = f"SELECT {values} FROM {_APPEND_STAGING}"
+                if not parquet_store.is_view(conn, table_name):
+                    conn.execute("BEGIN TRANSACTION")
+                    try:
+                        conn.execute(f"INSERT INTO {quote_ident(table_name)} {select_sql}")
+                        conn.execute("COMMIT")
+                    except Exception:
+                        conn.execute("ROLLBACK")
+                        raise
+                # New part for the canonical copy (and, for views, the data itself)
+                if parquet_store.has_parquet(session_id, table_name):
+                    parquet_store.write_part(conn, session_id, table_name, select_sql)
+                info = describe_table(conn, table_name)
+                version = bump_table_version(session_id, table_name, info["rows"])
+                pending = pending_table(table_name, version)
+                conn.execute(f"CREATE SCHEMA IF NOT EXISTS {PENDING_SCHEMA}")
+                conn.execute(f"CREATE OR REPLACE TABLE {pending} AS {select_sql}")
+                schema_cache.refresh_table(session_id, conn, table_name, version, appended=pending)
+            finally:
+                conn.execute(f"DROP TABLE IF EXISTS {_APPEND_STAGING}")
+        finally:
+            conn.close()
+    parquet_store.delete_raw_upload(file_path)
+    schedule_anomaly_scan(session_id, table_name, version, source=pending)
+
+    return {
+        "session_id": session_id,
+        "table_name": table_name,
+        "rows_appended": staged["rows"],
+        "rows": info["rows"],
+        "columns": info["columns"],
+        "dtypes": info["dtypes"],
+        "version": version,
+        "message": f"Appended {staged['rows']} rows to table '{table_name}' ({info['rows']} total)",
+    }
@@ -66,6 +66,15 @@ def _is_datetime_col(series) -> bool:
     return False
 
 
+def _is_time_label(df, col: str, profiles: dict) -> bool:
+    """Time-like label column — from its column profile when the result keeps a source column name."""
+    if _DATE_NAME_RE.search(col):
+        return True
+    if col in profiles:
+        return profiles[col]["role"] == "date"
+    return _is_datetime_col(df[col])
+
+
 def _numeric_columns(df) -> list[str]:
     import pandas as pd
     return [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
@@ -76,7 +85,7 @@ def _categorical_columns(df) -> list[str]:
     return [c for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])]
 
 
-def recommend_chart_type(df, question: str = "") -> str:
+def recommend_chart_type(df, question: str = "", profiles: dict | None = None) -> str:
     """
     Core recommendation function.
 
@@ -84,12 +93,15 @@ def recommend_chart_type(df, question: str = "") -> str:
     ----------
     df       : pandas DataFrame (query result)
     question : original natural-language question (optional, improves accuracy)
+    profiles : column name → column profile of the queried tables (optional,
+               saves re-parsing result values to spot dates and names)
 
     Returns
     -------
     One of the chart type strings listed in the module docstring.
     """
     rows, cols = len(df), len(df.columns)
+    profiles = profiles or {}
 
     # ── Trivial cases ─────────────────────────────────────────────────────────
     if rows == 0:
@@ -117,7 +129,7 @@ def recommend_chart_type(df, question: str = "") -> str:
     # ── Exactly two columns: label + value ───────────────────────────────────
     if cols == 2 and n_numeric >= 1:
         label_col = category_cols[0] if category_cols else df.columns[0]
-        is_time   = _is_datetime_col(df[label_col]) or bool(_DATE_NAME_RE.search(label_col))
+        is_time   = _is_time_label(df, label_col, profiles)
 
         # Cumulative / area hint
         if _CUM_WORDS.search(question) and is_time:
@@ -140,7 +152,8 @@ def recommend_chart_type(df, question: str = "") -> str:
             distinct = df[label_col].nunique()
             # Named-entity columns (emp_name, customer_name, etc.) with many
             # distinct values are ranked / filtered lists → always render as table
-            if _NAME_COL_RE.search(label_col) and distinct > 5:
+            is_name  = label_col in profiles and profiles[label_col]["role"] == "name"
+            if (is_name or _NAME_COL_RE.search(label_col)) and distinct > 5:
                 return "table"
             # Pie for share-hint questions (any size ≤8) or very small sets (≤3)
             if _SHARE_WORDS.search(question) and distinct <= 8:
@@ -156,7 +169,7 @@ def recommend_chart_type(df, question: str = "") -> str:
     # ── 3+ columns with one label + multiple numeric → multi_series ──────────
     if n_category == 1 and n_numeric >= 2:
         label_col = category_cols[0]
-        is_time   = _is_datetime_col(df[label_col]) or bool(_DATE_NAME_RE.search(label_col))
+        is_time   = _is_time_label(df, label_col, profiles)
         if is_time or _TREND_WORDS.search(question):
             return "multi_series"   # will render as multi-line
         return "multi_series"       # will render as grouped bar
@@ -0,0 +1,28 @@
+import duckdb
+
+from app.ingestion.profiler import profile_table
+from app.services.anomaly_detector import detect_anomalies
+
+
+def _sudden_change_columns(anomalies):
+    return {a["message"].split("'")[1] for a in anomalies if a["type"] == "sudden_change"}
+
+
+def test_sudden_changes_skip_identifier_and_year_columns():
+    conn = duckdb.connect()
+    # One row a day for 60 days, three on day 30: every daily total jumps there
+    conn.execute("""
+        CREATE TABLE sales AS
+        SELECT row_number() OVER (ORDER BY day)::BIGINT AS emp_id, 2024::BIGINT AS year,
+               100.0 AS amount, day
+        FROM (
+            SELECT (DATE '2024-01-01' + INTERVAL (i) DAY)::DATE AS day
+            FROM range(60) r(i), range(3) k(j)
+            WHERE j = 0 OR i = 30
+        )
+    """)
+
+    flagged = _sudden_change_columns(detect_anomalies(conn, "sales", profile=profile_table(conn, "sales")))
+    assert flagged == {"amount"}
+    # Without the profile's roles every numeric column is summed
+    assert {"emp_id", "year"} <= _sudden_change_columns(detect_anomalies(conn, "sales"))
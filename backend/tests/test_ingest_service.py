@@ -0,0 +1,28 @@
+from app.core import database
+from app.core.config import settings
+from app.services import ingest_service
+
+
+def _upload(tmp_path, name, session_id, content_hash):
+    path = tmp_path / f"{session_id}.csv"
+    path.write_text("region,amount\nnorth,10\nsouth,20\n")
+    return ingest_service.reuse_cached_upload(content_hash, name, session_id) or ingest_service.process_upload(
+        path, name, session_id, content_hash=content_hash,
+    )
+
+
+def test_same_bytes_under_another_name_get_their_own_table(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_DIR", tmp_path)
+    monkeypatch.setattr(settings, "PARQUET_ENABLED", False)
+    monkeypatch.setattr(database, "AUDIT_DB_PATH", tmp_path / "audit.db")
+    monkeypatch.setattr(ingest_service, "schedule_anomaly_scan", lambda *args, **kwargs: None)
+    database.init_audit_db()
+
+    first = _upload(tmp_path, "sales.csv", "s1", "h")
+    again = _upload(tmp_path, "sales.csv", "s2", "h")
+    renamed = _upload(tmp_path, "revenue.csv", "s3", "h")
+
+    assert again["deduplicated"] and again["table_name"] == first["table_name"] == "sales"
+    assert "deduplicated" not in renamed
+    assert renamed["table_name"] == "revenue"
+    assert _upload(tmp_path, "revenue.csv", "s4", "h")["table_name"] == "revenue"
@@ -0,0 +1,37 @@
+import asyncio
+
+import httpx
+
+from app.core.config import settings
+from app.nl2sql import llm_client, ollama_pool
+
+
+def _backends(monkeypatch, handler):
+    monkeypatch.setattr(settings, "OLLAMA_BASE_URLS", "http://a:11434,http://b:11434")
+    monkeypatch.setattr(ollama_pool, "_backends", [])
+    monkeypatch.setattr(llm_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return {b["url"]: b for b in ollama_pool._pool()}
+
+
+def _server_error_on_a(request):
+    if request.url.host == "a":
+        return httpx.Response(500, json={"error": "model runner crashed"})
+    return httpx.Response(200, json={"response": "SELECT 1", "done": True})
+
+
+def test_server_error_fails_over_and_marks_backend_down(monkeypatch):
+    backends = _backends(monkeypatch, _server_error_on_a)
+
+    assert asyncio.run(llm_client._generate({"prompt": "q"})) == "SELECT 1"
+    assert not backends["http://a:11434"]["healthy"]
+    assert backends["http://b:11434"]["healthy"]
+
+
+def test_streamed_server_error_fails_over(monkeypatch):
+    backends = _backends(monkeypatch, _server_error_on_a)
+    flight = {"tokens": [], "done": False, "error": None, "event": asyncio.Event(), "sql": False, "end": None}
+
+    asyncio.run(llm_client._produce("k", flight, {"prompt": "q"}))
+    assert flight["error"] is None
+    assert flight["tokens"] == ["SELECT 1"]
+    assert not backends["http://a:11434"]["healthy"]
@@ -0,0 +1,41 @@
+import duckdb
+
+from app.core.config import settings
+from app.ingestion.file_parser import ingest_file
+
+
+def _load(tmp_path, monkeypatch, values):
+    monkeypatch.setattr(settings, "INFER_SAMPLE_ROWS", 3)
+    path = tmp_path / "data.csv"
+    path.write_text("units\n" + "\n".join(f'"{v}"' for v in values) + "\n")
+    conn = duckdb.connect()
+    info = ingest_file(conn, path, "t")
+    rows = [row[0] for row in conn.execute("SELECT units FROM t").fetchall()]
+    return info, rows
+
+
+def test_decimal_after_sample_widens_integer_column(tmp_path, monkeypatch):
+    info, rows = _load(tmp_path, monkeypatch, ["1", "2,000", "3", "1,234.56", "7"])
+
+    assert info["columns"] == ["units"]
+    assert info["dtypes"]["units"] == "DOUBLE"
+    assert info["inference"]["units"]["widened_from"] == "BIGINT"
+    assert info["inference"]["units"]["nulled"] == 0
+    assert rows == [1, 2000, 3, 1234.56, 7]
+
+
+def test_stray_text_after_sample_is_nulled_and_counted(tmp_path, monkeypatch):
+    info, rows = _load(tmp_path, monkeypatch, [str(i) for i in range(99)] + ["N/A"])
+
+    assert info["dtypes"]["units"] == "BIGINT"
+    assert "widened_from" not in info["inference"]["units"]
+    assert info["inference"]["units"]["nulled"] == 1
+    assert rows[-1] is None
+
+
+def test_mostly_text_after_sample_stays_varchar(tmp_path, monkeypatch):
+    info, rows = _load(tmp_path, monkeypatch, ["1", "2", "3", "four", "five"])
+
+    assert info["dtypes"]["units"] == "VARCHAR"
+    assert info["inference"]["units"]["widened_from"] == "BIGINT"
+    assert rows == ["1", "2", "3", "four", "five"]
@@ -0,0 +1,23 @@
+import pytest
+
+from app.nl2sql.sql_validator import complete_statement_end
+
+
+@pytest.mark.parametrize("text", [
+    "SELECT * FROM a\n\nNATURAL JOIN b",
+    "SELECT * FROM t WHERE x\n\nBETWEEN 1 AND 2",
+    "SELECT * FROM a\n\nASOF JOIN b ON a.t >= b.t",
+    "SELECT * FROM t WHERE x\n\nNOT IN (1, 2)",
+])
+def test_keyword_after_blank_line_keeps_generating(text):
+    assert complete_statement_end(text) is None
+
+
+def test_explanation_after_blank_line_ends_statement():
+    text = "SELECT * FROM t WHERE x > 1\n\nThis query returns"
+    assert text[:complete_statement_end(text)] == "SELECT * FROM t WHERE x > 1"
+
+
+def test_semicolon_and_fence_end_statement():
+    assert complete_statement_end("SELECT 1; -- done") == len("SELECT 1;")
+    assert complete_statement_end("```sql\nSELECT 1\n``` and") == len("```sql\nSELECT 1\n```")
@@ -14,6 +14,7 @@ const STAGE_LABELS = {
   generating:  "Writing SQL query",       // token stream appends here
   executing:   "Running the query...",
   healing:     "Fine-tuning the query...",
+  queued:      "Waiting for the assistant...",
 };
 
 function ChatWindow({ session }) {
@@ -51,8 +52,9 @@ function ChatWindow({ session }) {
         session.session_id,
         question,
         // onStage
-        (stage) => {
-          setStageMessage(STAGE_LABELS[stage] || "");
+        (stage, message) => {
+          // queued carries the position in line
+          setStageMessage(stage === "queued" ? message : STAGE_LABELS[stage] || "");
           if (stage !== "generating") setStreamingSQL("");
         },
         // onDone
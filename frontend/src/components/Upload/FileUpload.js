@@ -1,6 +1,6 @@
 import React, { useState, useCallback } from "react";
 import { useDropzone } from "react-dropzone";
-import { uploadFile } from "../../services/api";
+import { uploadFile, waitForAnomalies } from "../../services/api";
 import toast from "react-hot-toast";
 import {
   FiUploadCloud,
@@ -30,6 +30,18 @@ function FileUpload({ onUploadSuccess }) {
         setResult(res.data);
         toast.success(`Loaded ${res.data.rows} rows successfully!`);
         onUploadSuccess(res.data);
+        // Anomaly detection runs after the data is loaded — fill it in when ready
+        waitForAnomalies(res.data.session_id, res.data.table_name)
+          .then((report) => {
+            if (report?.anomalies) {
+              setResult((prev) =>
+                prev && prev.session_id === res.data.session_id
+                  ? { ...prev, anomalies: report.anomalies }
+                  : prev
+              );
+            }
+          })
+          .catch(() => {});
       } catch (err) {
         toast.error(err.response?.data?.detail || "Upload failed");
       } finally {
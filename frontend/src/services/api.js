@@ -42,6 +42,19 @@ export const uploadFile = (file, onProgress) => {
   });
 };
 
+export const getAnomalies = (sessionId, tableName) =>
+  API.get("/upload/anomalies", { params: { session_id: sessionId, table_name: tableName } });
+
+/** Poll the anomaly report (computed after the upload returns) until it is ready. */
+export const waitForAnomalies = async (sessionId, tableName, intervalMs = 1000, maxTries = 120) => {
+  for (let i = 0; i < maxTries; i++) {
+    const res = await getAnomalies(sessionId, tableName);
+    if (res.data.status !== "pending") return res.data;
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+  return null;
+};
+
 export const askQuestion = (sessionId, question) =>
   API.post("/query/", { session_id: sessionId, question });
 
@@ -79,7 +92,10 @@ export const askQuestionStream = async (sessionId, question, onStage, onDone, on
 
   if (!response.ok) {
     const err = await response.json().catch(() => ({}));
-    onError(err.detail || "Request failed");
+    // 429/503 from the LLM queue say when to retry
+    const retryAfter = response.headers.get("Retry-After");
+    const hint = retryAfter ? ` (try again in ${retryAfter}s)` : "";
+    onError((err.detail || "Request failed") + hint);
     return;
   }
 